@@ -4,19 +4,15 @@ from db import query_all, exec_write, query_one
 from firestore_db import fs_add_anomaly, fs_get_user_email, fs_get_alert_extras
 from emailer import send_email
 import config
+import coord
+import metrics
+from ingest import now_ms
 
 
 # =========================
-# Utility timestamp & label
+# Utility label
 # =========================
 
-def _to_seconds(ts):
-    """Converte timestamp ms->s se necessario, altrimenti lo lascia in s."""
-    t = float(ts)
-    # Soglia robusta: >1e11 è quasi certamente millisecondi (1973 in ms).
-    return t / 1000.0 if t > 1e11 else t
-
-
 def _labels():
     """Etichette leggibili per i sensori."""
     return {
@@ -34,16 +30,17 @@ def _labels():
 # =========================
 
 def stats_by_window(days=7, username=None):
-    start_ts = time.time() - days*24*3600  # secondi
+    start_ts = now_ms() - days*24*3600*1000  # timestamp in ms (vedi ingest.to_epoch_ms)
     params = ()
     user_clause = ''
     if username:
         user_clause = ' AND username=?'
         params = (username,)
 
+    # readings_tiered = raw + rollup compattati (vedi compactor.py)
     rows = query_all(f"""
-        SELECT sensor, AVG(value) as avg_v, COUNT(*) as n
-        FROM readings
+        SELECT sensor, SUM(vsum) / SUM(n) as avg_v, SUM(n) as n
+        FROM readings_tiered
         WHERE timestamp >= ? {user_clause}
         GROUP BY sensor
     """, (start_ts,) + params)
@@ -53,38 +50,14 @@ def stats_by_window(days=7, username=None):
 
 
 def last_week_stats(username=None):
-    week_ago = time.time() - 7*24*3600
-    params = ()
-    user_clause = ''
-    if username:
-        user_clause = ' AND username=?'
-        params = (username,)
-    rows = query_all(f"""
-        SELECT sensor, AVG(value) as avg_v, COUNT(*) as n
-        FROM readings
-        WHERE timestamp >= ? {user_clause}
-        GROUP BY sensor
-    """, (week_ago,) + params)
-    out = {r['sensor']: r['avg_v'] for r in rows}
-    total = sum(r['n'] for r in rows) if rows else 0
-    return out, total
+    """Medie e conteggio degli ultimi 7 giorni (stessa query di stats_by_window(7))."""
+    return stats_by_window(7, username)
 
 
 # =========================
 # Notifiche email & cooldown
 # =========================
 
-def _last_anomaly_ts(username, sensor):
-    """Ritorna il timestamp (come float) dell'ultima anomalia registrata, None se assente."""
-    row = query_one(
-        'SELECT timestamp FROM anomalies WHERE username=? AND sensor=? ORDER BY timestamp DESC LIMIT 1',
-        (username, sensor)
-    )
-    if not row:
-        return None
-    return float(row['timestamp'])
-
-
 def _recipient_for(username):
     """Destinatario principale preso da Firestore; fallback su FROM_EMAIL."""
     em = fs_get_user_email(username)
@@ -105,24 +78,95 @@ def _extra_recipients():
     return [e.strip() for e in raw.split(',') if e.strip()]
 
 
-def _should_email(prev_ts, current_ts):
-    """Applica il cooldown (in secondi) normalizzando entrambi i timestamp."""
+def _should_email(username, sensor, current_ts):
+    """
+    Applica il cooldown (in secondi) per (utente, sensore); current_ts in ms. Lo stato è nella
+    tabella condivisa `cooldowns`: con più worker una sola email per finestra.
+    """
     cooldown = int(getattr(config, 'ALERT_COOLDOWN_SEC', 900))  # default 15 min
-    if prev_ts is None:
-        return True
-    prev_s = _to_seconds(prev_ts)
-    curr_s = _to_seconds(current_ts)
-    return (curr_s - prev_s) >= cooldown
+    return coord.claim_cooldown(f'alert:{username}:{sensor}', current_ts / 1000.0, cooldown)
 
 
 # =========================
 # Rilevazione anomalie
 # =========================
 
+def _notify(username, sensor, ts_ms, detail, thr):
+    """Email di allerta ai destinatari dell'utente, rispettando il cooldown."""
+    if not _should_email(username, sensor, ts_ms):
+        return
+    label = _labels().get(sensor, sensor.upper())
+    subject = f"[ALLERTA] {username} — {label} sopra soglia"
+    ts_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts_ms / 1000.0))
+
+    body = (
+        "Ciao,\n\n"
+        "È stata rilevata un'anomalia.\n\n"
+        f"Utente: {username}\n"
+        f"Sensore: {sensor} ({label})\n"
+        f"{detail}\n"
+        f"Soglia: {thr:.3f}\n"
+        f"Timestamp: {ts_str}\n\n"
+        "— Sistema di monitoraggio"
+    )
+
+    # Costruisce lista destinatari (principale + extra), con deduplica
+    recips = []
+    main = _recipient_for(username)
+    if main:
+        recips.append(main)
+    recips.extend(_extra_recipients())
+    seen = set()
+    recipients = [r for r in recips if not (r in seen or seen.add(r))]
+
+    for r in recipients:
+        ok = send_email(r, subject, body)
+        if not ok:
+            print('[ALERT][WARN] invio email fallito per', r)
+
+
+def _record_anomaly(username, sensor, ts_ms, value, thr, window, detector, detail):
+    """
+    Salva l'anomalia (SQLite in ms, Firestore in secondi) e notifica. Ritorna il dict
+    dell'anomalia, o None se scartata perché l'utente era in movimento (motion.py).
+    """
+    import motion
+    lvl = motion.level(username, ts_ms) if motion.applies(sensor) else None
+    moving = lvl is not None and lvl >= config.MOTION_HIGH
+    if moving and config.MOTION_MODE == 'suppress':
+        return None
+
+    exec_write(
+        'INSERT INTO anomalies(username,sensor,timestamp,value,threshold,window,detector,motion) '
+        'VALUES(?,?,?,?,?,?,?,?)',
+        (username, sensor, ts_ms, value, thr, window, detector, lvl)
+    )
+    metrics.inc('anomalies_total', sensor=sensor, detector=detector or 'moving_average')
+
+    # Replica su Firestore (timestamp in secondi)
+    try:
+        fs_add_anomaly(username, sensor, ts_ms / 1000.0, value, thr, window)
+    except Exception as e:
+        print('[FS][WARN] fs_add_anomaly:', e)
+
+    if not moving:  # 'downrank': registrata ma senza email
+        _notify(username, sensor, ts_ms, detail, thr)
+    return {
+        'username': username,
+        'sensor': sensor,
+        'timestamp': ts_ms,
+        'value': value,
+        'threshold': thr,
+        'window': window,
+        'detector': detector,
+        'motion': lvl,
+    }
+
+
 def moving_average_anomaly(username, sensor):
     """
     Calcola la media mobile sugli ultimi N valori; se supera la soglia:
-      - registra l'anomalia in SQLite (timestamp SALVATO in secondi)
+      - registra l'anomalia in SQLite (timestamp in ms, come readings)
       - replica su Firestore (timestamp in secondi)
       - invia email di allerta (rispettando un cooldown configurabile)
     """
@@ -142,67 +186,152 @@ def moving_average_anomaly(username, sensor):
         return None
 
     if ma > thr:
-        # Timestamp più recente della finestra; normalizzato ai secondi per persistenza/notifica
-        ts_raw = rows[-1]['timestamp']
-        ts_sec = _to_seconds(ts_raw)
-
-        # Verifica cooldown rispetto all'ultima anomalia *precedente*
-        prev_ts = _last_anomaly_ts(username, sensor)
-
-        # Registra l'anomalia su DB **in secondi**
-        exec_write(
-            'INSERT INTO anomalies(username,sensor,timestamp,value,threshold,window) VALUES(?,?,?,?,?,?)',
-            (username, sensor, ts_sec, ma, thr, n)
-        )
-
-        # Replica su Firestore (timestamp in secondi)
-        try:
-            fs_add_anomaly(username, sensor, ts_sec, ma, thr, n)
-        except Exception as e:
-            print('[FS][WARN] fs_add_anomaly:', e)
-
-        # Invio email se rispettiamo il cooldown
-        if _should_email(prev_ts, ts_sec):
-            label = _labels().get(sensor, sensor.upper())
-            subject = f"[ALLERTA] {username} — {label} sopra soglia"
-            ts_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts_sec))
-
-            body = (
-                "Ciao,\n\n"
-                "È stata rilevata un'anomalia.\n\n"
-                f"Utente: {username}\n"
-                f"Sensore: {sensor} ({label})\n"
-                f"Media mobile (ultimi {n}): {ma:.3f}\n"
-                f"Soglia: {thr:.3f}\n"
-                f"Timestamp: {ts_str}\n\n"
-                "— Sistema di monitoraggio"
-            )
-
-            # Costruisce lista destinatari (principale + extra), con deduplica
-            recips = []
-            main = _recipient_for(username)
-            if main:
-                recips.append(main)
-            recips.extend(_extra_recipients())
-            seen = set()
-            recipients = [r for r in recips if not (r in seen or seen.add(r))]
-
-            for r in recipients:
-                ok = send_email(r, subject, body)
-                if not ok:
-                    print('[ALERT][WARN] invio email fallito per', r)
-
-        return {
-            'username': username,
-            'sensor': sensor,
-            'timestamp': ts_sec,   # ritorniamo secondi
-            'value': ma,
-            'threshold': thr,
-            'window': n
-        }
+        # Timestamp della finestra (ms interi, già normalizzato all'ingest)
+        ts_ms = int(rows[-1]['timestamp'])
+        return _record_anomaly(username, sensor, ts_ms, ma, thr, n, None,
+                               f"Media mobile (ultimi {n}): {ma:.3f}")
 
     return None
 
 
+def evaluate(username, sensor, samples):
+    """
+    Punto unico di rilevazione dopo l'inserimento di nuove letture `samples` [(ts_ms, value)]
+    di uno stream. Usa il rilevatore configurato per il sensore (config.DETECTORS),
+    aggiorna le feature derivate dello stream (derived.py, es. HRV dagli IBI) e, per
+    l'ACC, il livello di movimento usato per smorzare gli allarmi (motion.py).
+    Ritorna la lista delle anomalie registrate.
+    """
+    with metrics.timer('evaluate_seconds', sensor=sensor):
+        return _evaluate(username, sensor, samples)
+
+
+def _evaluate(username, sensor, samples):
+    import derived
+    import detectors
+    import motion
+    if sensor == 'acc':
+        motion.observe(username, samples)
+    derived.update(username, sensor, samples)
+    name = detectors.detector_for(sensor)
+    if name not in detectors.REGISTRY:
+        hit = moving_average_anomaly(username, sensor)
+        return [hit] if hit else []
+
+    out = []
+    for ts_ms, value, stat, thr in detectors.feed(username, sensor, name, samples):
+        hit = _record_anomaly(username, sensor, int(ts_ms), stat, thr, None, name,
+                              f"Valore {value:.3f}, {name} = {stat:.2f} (baseline personale)")
+        if hit:
+            out.append(hit)
+    return out
+
+
+# =========================
+# Rilevazione in blocco (storico, import bulk)
+# =========================
+
+def rolling_mean(values, n):
+    """Media mobile vettoriale con somma cumulativa: elemento i = media di values[i:i+n]."""
+    import numpy as np
+    v = np.asarray(values, dtype=float)
+    if v.size < n:
+        return np.empty(0)
+    c = np.concatenate(([0.0], np.cumsum(v)))
+    return (c[n:] - c[:-n]) / n
+
+
+def anomaly_rows(username, sensor, start_ms=None, end_ms=None, chunk_rows=200000):
+    """
+    Stessa regola di moving_average_anomaly applicata a tutte le letture salvate,
+    a blocchi di `chunk_rows` righe (le finestre a cavallo dei blocchi sono incluse).
+    Considera le finestre che iniziano in [start_ms, end_ms] e ritorna le righe per
+    `anomalies` (username, sensor, timestamp, value, threshold, window, detector, motion),
+    con il timestamp di inizio finestra come nel percorso live. Non invia email.
+    Per i sensori con un rilevatore in streaming (detectors.py) la serie viene
+    ripercorsa da `start_ms` con una baseline nuova, senza toccare quella live.
+    Il livello di movimento viene dalle letture ACC salvate (motion.levels_at).
+    """
+    import detectors
+    name = detectors.detector_for(sensor)
+    if name in detectors.REGISTRY:
+        rows = _stream_anomaly_rows(username, sensor, name, start_ms, end_ms, chunk_rows)
+    else:
+        rows = _ma_anomaly_rows(username, sensor, start_ms, end_ms, chunk_rows)
+    return _with_motion(username, sensor, rows)
+
+
+def _with_motion(username, sensor, rows):
+    """Aggiunge il livello di movimento alle righe e scarta quelle in movimento se MOTION_MODE='suppress'."""
+    import motion
+    if not rows or not motion.applies(sensor):
+        return [r + (None,) for r in rows]
+    levels = motion.levels_at(username, [r[2] for r in rows]).tolist()
+    out = []
+    for r, lvl in zip(rows, levels):
+        lvl = None if lvl != lvl else lvl   # NaN: ACC non disponibile
+        if lvl is not None and lvl >= config.MOTION_HIGH and config.MOTION_MODE == 'suppress':
+            continue
+        out.append(r + (lvl,))
+    return out
+
+
+def _ma_anomaly_rows(username, sensor, start_ms, end_ms, chunk_rows):
+    import numpy as np
+    import tsblocks
+    thr = getattr(config, 'THRESHOLDS', {}).get(sensor, None)
+    n = int(getattr(config, 'MOVING_AVG_WINDOW', 10))
+    if thr is None:
+        return []
+    lo = -2**62 if start_ms is None else int(start_ms)
+    hi = 2**62 if end_ms is None else int(end_ms)
+    limit = chunk_rows + n - 1
+    out = []
+    while True:
+        # raw + blocchi compressi: lo storico compattato resta a piena risoluzione
+        ts, vals = tsblocks.read_arrays(username, sensor, lo, None, limit=limit)
+        if ts.size < n:
+            break
+        ma = rolling_mean(vals, n)
+        starts = ts[:ma.size]
+        hit = np.nonzero((ma > thr) & (starts <= hi))[0]
+        out.extend((username, sensor, int(starts[i]), float(ma[i]), thr, n, None) for i in hit)
+        if ts.size < limit or starts[-1] > hi:
+            break
+        lo = int(ts[chunk_rows])  # inizio della prima finestra del blocco successivo
+    return out
+
+
+def _stream_anomaly_rows(username, sensor, name, start_ms, end_ms, chunk_rows):
+    import detectors
+    import tsblocks
+    lo = -2**62 if start_ms is None else int(start_ms)
+    hi = 2**62 if end_ms is None else int(end_ms)
+    det, out = None, []
+    while True:
+        ts, vals = tsblocks.read_arrays(username, sensor, lo, hi, limit=chunk_rows)
+        if not ts.size:
+            break
+        hits, det = detectors.scan(name, sensor, ts.tolist(), vals.tolist(), det)
+        out.extend((username, sensor, int(t), float(stat), thr, det.window(), name) for t, stat, thr in hits)
+        if ts.size < chunk_rows:
+            break
+        lo = int(ts[-1]) + 1
+    return out
+
+
+def rewrite_anomalies(con, username, sensor, rows, start_ms=None, end_ms=None):
+    """Sostituisce (nella transazione del chiamante) le anomalie di [start_ms, end_ms] con `rows`."""
+    lo = -2**62 if start_ms is None else int(start_ms)
+    hi = 2**62 if end_ms is None else int(end_ms)
+    con.execute('DELETE FROM anomalies WHERE username=? AND sensor=? AND timestamp BETWEEN ? AND ?',
+                (username, sensor, lo, hi))
+    con.executemany(
+        'INSERT INTO anomalies(username,sensor,timestamp,value,threshold,window,detector,motion) '
+        'VALUES(?,?,?,?,?,?,?,?)',
+        rows
+    )
+
+
 def recent_anomalies(limit=20):
     return query_all('SELECT * FROM anomalies ORDER BY timestamp DESC LIMIT ?', (limit,))
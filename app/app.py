@@ -4,17 +4,19 @@ import io
 import json
 import time
 import threading
+from urllib.parse import urlsplit
 from firestore_db import fs_get_user_email
 from db import query_one  # se non c’è già
 
 
 from flask import (
-    Flask, render_template, request, redirect, url_for, flash,
-    jsonify, abort, current_app, send_file
+    Flask, Blueprint, render_template, request, redirect, url_for, flash,
+    jsonify, abort, current_app, send_file, g, Response
 )
 from flask_login import (
     LoginManager, current_user, login_user, logout_user, login_required
 )
+from werkzeug.exceptions import RequestEntityTooLarge
 
 import config
 from db import init_db, exec_write, query_all, query_one
@@ -22,26 +24,35 @@ from auth import (
     validate_login, create_user, find_user_by_username, all_users,
     User, delete_user, sync_users_to_firestore
 )
-from analytics import last_week_stats, moving_average_anomaly, recent_anomalies, stats_by_window
+from analytics import evaluate, recent_anomalies, stats_by_window
 from emailer import send_email, email_status
-from firestore_db import fs_add_reading
-from plots import plot_user_sensor
+from firestore_db import fs_add_reading, fs_add_readings
+from plots import plot_user_sensor, plot_overview, series_response
+import feeder
+from ingest import insert_reading, ingest_batch, parse_reading, now_ms, to_epoch_ms
+import wire
+import compactor
+import bulk
+import reeval
+import derived
+import resample
+import pagecache
+import metrics
+import querylog
 
 
 # --------------------------------------------------------------------------------------
-# App & Login
+# Blueprint & Login
 # --------------------------------------------------------------------------------------
-app = Flask(__name__)
-app.config['SECRET_KEY'] = config.SECRET_KEY
-init_db()
+bp = Blueprint('main', __name__)
 
 @login_required
-@app.route('/favicon.ico')
+@bp.route('/favicon.ico')
 def favicon():
-    return app.send_static_file('favicon.ico')
+    return current_app.send_static_file('favicon.ico')
 
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -52,19 +63,94 @@ def load_user(user_id):
 
 
 # --------------------------------------------------------------------------------------
-# Bootstrap admin
+# Bootstrap (DB + admin) e app factory
 # --------------------------------------------------------------------------------------
-if not find_user_by_username('admin'):
-    try:
-        create_user('admin', 'admin@example.com', 'admin123', role='admin')
-        print('[INIT] created default admin: admin / admin123')
-    except Exception as e:
-        print('[INIT] admin create error:', e)
+_bootstrap_lock = threading.Lock()
+_bootstrapped = False
+
+def _bootstrap():
+    """
+    Crea le tabelle e l'admin predefinito. Non gira più all'import del modulo:
+    viene eseguito una sola volta per processo da create_app().
+    """
+    global _bootstrapped
+    with _bootstrap_lock:
+        if _bootstrapped:
+            return
+        init_db()
+        if not find_user_by_username('admin'):
+            try:
+                create_user('admin', 'admin@example.com', 'admin123', role='admin')
+                print('[INIT] created default admin: admin / admin123')
+            except Exception as e:
+                print('[INIT] admin create error:', e)
+        _bootstrapped = True
+
+def _fmt_epoch_ms(ts):
+    """Filtro Jinja: epoch ms -> 'YYYY-mm-dd HH:MM:SS' (ora locale)."""
+    if ts is None:
+        return '-'
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts / 1000.0))
+
+def create_app(overrides=None):
+    """
+    App factory: crea l'app Flask, registra login e route, esegue il bootstrap
+    e (se abilitato) avvia il supervisore dei feeder di questo processo.
+    Ogni worker gunicorn/waitress chiama create_app() una volta (vedi wsgi.py).
+    """
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = config.SECRET_KEY
+    app.config['MAX_CONTENT_LENGTH'] = int(config.MAX_REQUEST_MB * 1024 * 1024)  # oltre: 413
+    app.config['FEEDER_SUPERVISOR'] = config.FEEDER_SUPERVISOR
+    app.config['COMPACTOR'] = config.COMPACTOR
+    if overrides:
+        app.config.update(overrides)
+
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    app.jinja_env.filters['epoch_ms'] = _fmt_epoch_ms
+
+    _bootstrap()
+    if app.config['FEEDER_SUPERVISOR']:
+        feeder.start_supervisor()
+    if app.config['COMPACTOR']:
+        compactor.start_compactor()
+    return app
 
 
 # --------------------------------------------------------------------------------------
 # Helpers
 # --------------------------------------------------------------------------------------
+def _local_url(url):
+    """`url` se è un percorso relativo di questo sito, altrimenti la dashboard (niente open redirect)."""
+    url = (url or '').strip()
+    parts = urlsplit(url)
+    if not url.startswith('/') or url.startswith('//') or '\\' in url or parts.scheme or parts.netloc:
+        return url_for('main.dashboard')
+    return url
+
+
+def _history_rows(username, sensor=None, newest_first=False, limit=None):
+    """
+    Letture di un utente su tutto lo storico: righe raw di `readings` più i bucket già
+    compattati (readings_rollup: value = media del bucket, n = campioni aggregati, id e
+    assi vuoti). Ogni tier è ordinato e limitato per conto suo sugli indici, poi fusi.
+    """
+    order = 'DESC' if newest_first else 'ASC'
+    lim = f' LIMIT {int(limit)}' if limit else ''
+    by_sensor = ' AND sensor=?' if sensor else ''
+    params = (username,) + ((sensor,) if sensor else ())
+    return query_all(
+        f'SELECT * FROM (SELECT id, username, sensor, timestamp, value, ax, ay, az, 1 AS n FROM readings '
+        f'WHERE username=?{by_sensor} ORDER BY timestamp {order}{lim}) '
+        f'UNION ALL '
+        f'SELECT * FROM (SELECT NULL, username, sensor, bucket_ts, vsum / n, NULL, NULL, NULL, n '
+        f'FROM readings_rollup WHERE username=?{by_sensor} ORDER BY bucket_ts {order}{lim}) '
+        f'ORDER BY timestamp {order}{lim}',
+        params + params
+    )
+
+
 def _window_stats(usernames, days):
     """
     Ritorna, per ogni sensore, media/min/max/N nel periodo selezionato.
@@ -73,73 +159,72 @@ def _window_stats(usernames, days):
     if not isinstance(usernames, (list, tuple)):
         usernames = [usernames]
 
-    start_ts = time.time() - (days * 24 * 3600)
+    start_ts = now_ms() - days * 24 * 3600 * 1000  # ms, come readings.timestamp
     placeholders = ",".join(["?"] * len(usernames))
 
+    # Aggregazione in SQL sulla vista raw + rollup (vedi compactor.py)
     rows = query_all(
-        f"SELECT sensor, value FROM readings "
-        f"WHERE username IN ({placeholders}) AND timestamp>=?",
+        f"SELECT sensor, SUM(vsum) / SUM(n) AS avg, MIN(vmin) AS min, MAX(vmax) AS max, SUM(n) AS n "
+        f"FROM readings_tiered "
+        f"WHERE username IN ({placeholders}) AND timestamp>=? AND vsum IS NOT NULL "
+        f"GROUP BY sensor",
         tuple(usernames) + (start_ts,)
     )
+    return {r['sensor']: {"avg": r['avg'], "min": r['min'], "max": r['max'], "n": r['n']} for r in rows}
 
-    agg = {}
-    for r in rows:
-        s = r['sensor']
-        v = r['value']
-        if v is None:
-            continue
-        b = agg.setdefault(s, {"sum": 0.0, "n": 0, "min": None, "max": None})
-        b["sum"] += v
-        b["n"] += 1
-        b["min"] = v if b["min"] is None else min(b["min"], v)
-        b["max"] = v if b["max"] is None else max(b["max"], v)
-
-    out = {}
-    for s, b in agg.items():
-        out[s] = {
-            "avg": (b["sum"] / b["n"]) if b["n"] else None,
-            "min": b["min"],
-            "max": b["max"],
-            "n": b["n"]
-        }
-    return out
+
+def _sensor_correlations(username, since_ms):
+    """Correlazione tra sensori sulle medie per bucket (serie allineate di resample.py)."""
+    sensors = ['hr', 'eda', 'temp', 'acc']
+    start, end = since_ms // 60000 * 60000, now_ms()
+    # bucket di almeno un minuto, più larghi sui periodi lunghi (limite RESAMPLE_MAX_POINTS)
+    period = max(1, -(-(end - start) // (60000 * config.RESAMPLE_MAX_POINTS))) * 60000
+    try:
+        df = resample.frame(username, start, end, period, sensors, {'acc': 'mean'})
+    except ValueError:
+        return None
+    df = df.dropna(how='all')
+    if len(df) < 3:
+        return None
+    corr = df.corr(min_periods=3)
+    return {a: {b: (None if corr.at[a, b] != corr.at[a, b] else corr.at[a, b]) for b in sensors} for a in sensors}
 
 
 # --------------------------------------------------------------------------------------
 # Routes - base / auth
 # --------------------------------------------------------------------------------------
-@app.route('/')
+@bp.route('/')
 def index():
     if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     return render_template('index.html')
 
-@app.route('/about')
+@bp.route('/about')
 @login_required
 def about():
     return render_template('about.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         u = validate_login(request.form.get('username'), request.form.get('password'))
         if u:
             login_user(u)
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         flash('Credenziali non valide')
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 
 # --------------------------------------------------------------------------------------
 # Routes - dashboard / analytics / plots
 # --------------------------------------------------------------------------------------
-@app.route('/dashboard')
+@bp.route('/dashboard')
 @login_required
 def dashboard():
     # periodo selezionato
@@ -151,32 +236,29 @@ def dashboard():
     else:
         users = [current_user.username]
 
-    # statistiche
-    stats_window = _window_stats(users, days)
+    key = ('dashboard', current_user.username, current_user.is_admin(), days)
+    ctx = pagecache.get_or_compute(key, lambda: _dashboard_context(users, days))
+    return render_template('dashboard.html', users=users, days=days, motion_high=config.MOTION_HIGH, **ctx)
+
 
+def _dashboard_context(users, days):
+    """Dati della dashboard (in cache in pagecache finché la versione dei dati non cambia)."""
     target = None if current_user.is_admin() else current_user.username
-    stats_avg, stats_total = last_week_stats(target)
+    # last_week_stats e stats_by_window(7) sono la stessa query: calcolata una volta
     stats_week, total_week = stats_by_window(7, target)
-    stats_month, total_month = stats_by_window(30, target)
-    anomalies_list = recent_anomalies()
 
     # piccoli dataset per tabelline (ultimi 50 valori per sensore)
     chart_data = {}
     for uname in users:
         chart_data[uname] = {}
         for s in config.SENSORS:
-            rows = query_all(
-                'SELECT value FROM readings WHERE username=? AND sensor=? '
-                'ORDER BY timestamp ASC LIMIT 50',
-                (uname, s)
-            )
+            rows = _history_rows(uname, s, limit=50)
             chart_data[uname][s] = {'values': [r['value'] for r in rows]}
 
-    return render_template(
-        'dashboard.html',
-        users=users,
-        stats_window=stats_window, days=days,
-        stats_avg=stats_avg, stats_total=stats_total,
+    stats_month, total_month = stats_by_window(30, target)
+    return dict(
+        stats_window=_window_stats(users, days),
+        stats_avg=stats_week, stats_total=total_week,
         stats_week=stats_week, total_week=total_week,
         stats_month=stats_month, total_month=total_month,
         anomalies=[{
@@ -184,12 +266,14 @@ def dashboard():
             'sensor_type': a['sensor'],
             'value': a['value'],
             'threshold': a['threshold'],
-            'timestamp': a['timestamp']
-        } for a in anomalies_list],
+            'timestamp': a['timestamp'],
+            'detector': a.get('detector'),
+            'motion': a.get('motion'),
+        } for a in recent_anomalies()],
         chart_data=chart_data
     )
 
-@app.route('/analytics')
+@bp.route('/analytics')
 @login_required
 def analytics():
     days = request.args.get('days', type=int, default=getattr(config, 'DEFAULT_PLOT_DAYS', 7))
@@ -197,37 +281,66 @@ def analytics():
     username = request.args.get('user_id') or current_user.username
     if (not current_user.is_admin()) and username != current_user.username:
         flash('Accesso negato')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
+
+    ctx = pagecache.get_or_compute(('analytics', username, days), lambda: _analytics_context(username, days))
+    return render_template('analytics.html', days=days, target_username=username,
+                           hrv_window_min=config.HRV_WINDOW_SEC // 60, **ctx)
+
 
-    stats_window = _window_stats(username, days)
-    stats_avg, stats_total = last_week_stats(username)
+def _analytics_context(username, days):
+    """Dati della pagina analytics (in cache in pagecache finché la versione dei dati non cambia)."""
     stats_week, total_week = stats_by_window(7, username)
     stats_month, total_month = stats_by_window(30, username)
-
-    return render_template(
-        'analytics.html',
-        stats_window=stats_window, days=days,
-        target_username=username, stats_avg=stats_avg, stats_total=stats_total,
+    since_ms = now_ms() - days * 24 * 3600 * 1000
+    return dict(
+        hrv_stats=derived.summary(username, 'hrv_', since_ms),
+        eda_stats=derived.summary(username, 'eda_', since_ms),
+        correlations=_sensor_correlations(username, since_ms),
+        stats_window=_window_stats(username, days),
+        stats_avg=stats_week, stats_total=total_week,
         stats_week=stats_week, total_week=total_week,
         stats_month=stats_month, total_month=total_month
     )
 
-@app.route('/plot/<sensor>/<username>.png')
+@bp.route('/plot/<sensor>/<username>.png')
 @login_required
 def plot_sensor(sensor, username):
     # grafico PNG generato da matplotlib
     return plot_user_sensor(username, sensor, last_n=300)
 
 
+@bp.route('/plots/user/<username>.png')
+@login_required
+def plot_user_overview(username):
+    # tutti i sensori di un utente in un solo PNG (small multiples)
+    if (not current_user.is_admin()) and username != current_user.username:
+        return ('forbidden', 403)
+    return plot_overview('user', username)
+
+
+@bp.route('/plots/sensor/<sensor>.png')
+@login_required
+def plot_sensor_overview(sensor):
+    # un sensore per tutti gli utenti visibili (admin: tutti tranne 'admin'; user: se stesso)
+    if sensor not in config.SENSORS:
+        return ('sensore sconosciuto', 404)
+    if current_user.is_admin():
+        users = [u['username'] for u in all_users() if u['username'].lower() != 'admin']
+    else:
+        users = [current_user.username]
+    return plot_overview('sensor', sensor, sorted(users))
+
+
 # --------------------------------------------------------------------------------------
 # Routes - pagine informative
 # --------------------------------------------------------------------------------------
-@app.route('/help/exports')
+@bp.route('/help/exports')
 @login_required
 def help_exports():
     return render_template('help_exports.html')
 
-@app.route('/users')
+@bp.route('/users')
 @login_required
 def users_page():
     if current_user.is_admin():
@@ -246,20 +359,21 @@ def users_page():
 # --------------------------------------------------------------------------------------
 # Routes - admin
 # --------------------------------------------------------------------------------------
-@app.route('/admin')
+@bp.route('/admin')
 @login_required
 def admin_home():
     if not current_user.is_admin():
         flash('Solo amministratori')
-        return redirect(url_for('dashboard'))
-    return render_template('admin.html')
+        return redirect(url_for('main.dashboard'))
+    return render_template('admin.html', feeder_status=feeder.status(), reeval_status=reeval.status(),
+                           cache_stats=pagecache.stats())
 
-@app.route('/admin/new_user', methods=['GET', 'POST'])
+@bp.route('/admin/new_user', methods=['GET', 'POST'])
 @login_required
 def admin_new_user():
     if not current_user.is_admin():
         flash('Solo amministratori')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     if request.method == 'POST':
         try:
             username = request.form.get('username', '').strip()
@@ -269,12 +383,12 @@ def admin_new_user():
             create_user(username, email, password, role)
             send_email(email, 'Account creato', f'Username: {username}\nPassword: {password}')
             flash('Utente creato e email inviata')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         except Exception as e:
             flash(f'Errore creazione utente: {e}')
     return render_template('admin_new_user.html')
 
-@app.route('/admin/delete_user', methods=['POST'])
+@bp.route('/admin/delete_user', methods=['POST'])
 @login_required
 def admin_delete_user():
     if not current_user.is_admin():
@@ -282,110 +396,90 @@ def admin_delete_user():
     username = request.form.get('username')
     delete_user(username)
     flash('Utente eliminato (SQLite + Firestore)')
-    return redirect(url_for('admin_home'))
-
-# --- Feeder supervisor (server-side) ---
-_feeder_threads = {}
-_feeder_stop = {}
-
-def _run_feeder(uname, folder):
-    print('[FEEDER] start for', uname, 'folder', folder)
-    files = {
-        'acc': 'wrist_acc.csv',
-        'bvp': 'wrist_bvp.csv',
-        'eda': 'wrist_eda.csv',
-        'hr':  'wrist_hr.csv',
-        'ibi': 'wrist_ibi.csv',
-        'temp':'wrist_skin_temperature.csv',
-    }
-    # Lettori CSV semplici: attesi "timestamp,value" o solo "value"
-    fps = {}
-    for k, fname in files.items():
-        path = os.path.join(folder, fname)
-        if os.path.exists(path):
-            fps[k] = open(path, 'r', newline='')
-            next(fps[k], None)  # salta header
-
-    try:
-        while not _feeder_stop.get(uname):
-            sent_something = False
-            for sensor, f in list(fps.items()):
-                line = f.readline()
-                if not line:
-                    continue
-                parts = line.strip().split(',')
-                # Prova parsing: timestamp,value OPPURE value (usa time.time() per timestamp)
-                try:
-                    if len(parts) >= 2:
-                        ts = float(parts[0])
-                        val = float(parts[1])
-                    else:
-                        ts = time.time()
-                        val = float(parts[0])
-                except Exception:
-                    ts = time.time()
-                    try:
-                        val = float(parts[-1])
-                    except Exception:
-                        continue
-
-                exec_write(
-                    'INSERT INTO readings(username,sensor,timestamp,value) VALUES(?,?,?,?)',
-                    (uname, sensor, ts, val)
-                )
-                # anomaly check (salva eventuale anomalia e notifica)
-                moving_average_anomaly(uname, sensor)
-                sent_something = True
-
-            time.sleep(config.FEED_INTERVAL_SEC)
-    finally:
-        for f in fps.values():
-            try:
-                f.close()
-            except Exception:
-                pass
-        print('[FEEDER] stop for', uname)
+    return redirect(url_for('main.admin_home'))
 
-@app.route('/admin/start_feeder', methods=['POST'])
+# --- Feeder (eseguiti dal processo leader, vedi feeder.py) ---
+@bp.route('/admin/start_feeder', methods=['POST'])
 @login_required
 def admin_start_feeder():
     if not current_user.is_admin():
         return ('forbidden', 403)
-    # usa /data_samples/<username>/ come cartelle dati
-    base = os.path.abspath(os.path.join(app.root_path, os.pardir, 'data_samples'))
-    for uname in os.listdir(base):
-        folder = os.path.join(base, uname)
-        if not os.path.isdir(folder):
-            continue
-        if _feeder_threads.get(uname) and _feeder_threads[uname].is_alive():
-            continue
-        _feeder_stop[uname] = False
-        t = threading.Thread(target=_run_feeder, args=(uname, folder), daemon=True)
-        _feeder_threads[uname] = t
-        t.start()
+    # usa DATA_SAMPLES_DIR/<username>/ come cartelle dati (default: data_samples/ del repo)
+    feeder.request_start(config.DATA_SAMPLES_DIR)
     flash('Feeder avviati')
-    return redirect(url_for('admin_home'))
+    return redirect(url_for('main.admin_home'))
 
-@app.route('/admin/stop_feeder', methods=['POST'])
+@bp.route('/admin/stop_feeder', methods=['POST'])
 @login_required
 def admin_stop_feeder():
     if not current_user.is_admin():
         return ('forbidden', 403)
-    for uname in list(_feeder_stop.keys()):
-        _feeder_stop[uname] = True
+    feeder.request_stop()
     flash('Stop richiesto ai feeder')
-    return redirect(url_for('admin_home'))
+    return redirect(url_for('main.admin_home'))
+
+@bp.route('/admin/reset_feeder', methods=['POST'])
+@login_required
+def admin_reset_feeder():
+    if not current_user.is_admin():
+        return ('forbidden', 403)
+    # da usare a feeder fermi: un feeder attivo riscriverebbe la propria posizione
+    feeder.reset_checkpoints(request.form.get('username') or None)
+    flash('Posizione dei feeder azzerata: al prossimo avvio ripartono dall\'inizio dei CSV')
+    return redirect(url_for('main.admin_home'))
+
+@bp.route('/admin/compact', methods=['POST'])
+@login_required
+def admin_compact():
+    if not current_user.is_admin():
+        return ('forbidden', 403)
+    out = compactor.compact_once()
+    flash(f'Compattazione eseguita: {sum(out.values())} righe raw spostate nel rollup')
+    return redirect(url_for('main.admin_home'))
+
+@bp.route('/admin/reevaluate', methods=['POST'])
+@login_required
+def admin_reevaluate():
+    if not current_user.is_admin():
+        return ('forbidden', 403)
+    if reeval.start_background():
+        flash('Ricalcolo delle anomalie avviato (nessuna email per gli eventi storici)')
+    else:
+        flash('Ricalcolo delle anomalie già in corso')
+    return redirect(url_for('main.admin_home'))
 
 # --- Email helpers ---
-@app.route('/admin/email_status')
+@bp.route('/admin/email_status')
 @login_required
 def admin_email_status():
     if not current_user.is_admin():
         flash('Solo amministratori')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     return render_template('email_status.html', email_status=email_status())
 
-@app.route('/admin/email_csv_user', methods=['POST'])
+@bp.route('/admin/queries')
+@login_required
+def admin_queries():
+    if not current_user.is_admin():
+        flash('Solo amministratori')
+        return redirect(url_for('main.dashboard'))
+    sort = request.args.get('sort', 'total')
+    if sort not in ('total', 'max', 'count', 'avg'):
+        sort = 'total'
+    n = request.args.get('n', type=int, default=30)
+    return render_template('admin_queries.html', enabled=config.DB_PROFILE, slow_ms=config.DB_SLOW_MS,
+                           queries=querylog.top(n, sort), summary=querylog.summary(), sort=sort)
+
+@bp.route('/admin/queries/reset', methods=['POST'])
+@login_required
+def admin_queries_reset():
+    if not current_user.is_admin():
+        return ('forbidden', 403)
+    querylog.reset()
+    flash('Statistiche delle query azzerate')
+    return redirect(url_for('main.admin_queries'))
+
+@bp.route('/admin/email_csv_user', methods=['POST'])
 @login_required
 def admin_email_csv_user():
     if not current_user.is_admin():
@@ -394,7 +488,7 @@ def admin_email_csv_user():
     uname = request.form.get('username', '').strip()
     if not uname:
         flash('Username mancante')
-        return redirect(url_for('admin_home'))
+        return redirect(url_for('main.admin_home'))
 
     # 1) Firestore → 2) DB users → 3) campo form → se nulla => errore
     email = fs_get_user_email(uname)
@@ -404,15 +498,12 @@ def admin_email_csv_user():
 
     if not email:
         flash(f'Nessuna email trovata per utente {uname}')
-        return redirect(url_for('admin_home'))
+        return redirect(url_for('main.admin_home'))
 
-    rows = query_all(
-        'SELECT id, username, sensor, value, timestamp FROM readings WHERE username=? ORDER BY timestamp DESC LIMIT 1000',
-        (uname,)
-    )
+    rows = _history_rows(uname, newest_first=True, limit=1000)
     if not rows:
         flash(f'Nessun dato per {uname}')
-        return redirect(url_for('admin_home'))
+        return redirect(url_for('main.admin_home'))
 
     # Crea CSV in memoria (UTF-8)
     buf = io.StringIO()
@@ -451,25 +542,22 @@ def admin_email_csv_user():
     else:
         flash('Invio email fallito (controlla configurazione SMTP)')
 
-    return redirect(url_for('admin_home'))
+    return redirect(url_for('main.admin_home'))
 
-@app.route('/admin/email_csv_all', methods=['POST'])
+@bp.route('/admin/email_csv_all', methods=['POST'])
 @login_required
 def admin_email_csv_all():
     if not current_user.is_admin():
         return ('forbidden', 403)
     users_list = all_users()
     for u in users_list:
-        rows = query_all(
-            'SELECT * FROM readings WHERE username=? ORDER BY timestamp DESC LIMIT 500',
-            (u['username'],)
-        )
-        body = '\n'.join('{}, {}, {}, {}'.format(r['id'], r['username'], r['sensor'], r['value']) for r in rows[:300])
+        rows = _history_rows(u['username'], newest_first=True, limit=500)
+        body = '\n'.join('{}, {}, {}, {}'.format(r['id'] or '', r['username'], r['sensor'], r['value']) for r in rows[:300])
         send_email(u['email'], 'CSV dati personali', body)
     flash('Email CSV inviate')
-    return redirect(url_for('admin_home'))
+    return redirect(url_for('main.admin_home'))
 
-@app.route('/admin/email_unblock', methods=['POST'])
+@bp.route('/admin/email_unblock', methods=['POST'])
 @login_required
 def admin_email_unblock():
     if not current_user.is_admin():
@@ -477,9 +565,9 @@ def admin_email_unblock():
     email = request.form.get('email')
     send_email(email, 'Sblocco email', 'Richiesta sblocco eseguita.')
     flash('Email sbloccata (simulazione)')
-    return redirect(url_for('admin_home'))
+    return redirect(url_for('main.admin_home'))
 
-@app.route('/admin/export_user_csv', methods=['GET'])
+@bp.route('/admin/export_user_csv', methods=['GET'])
 @login_required
 def admin_export_user_csv():
     if not current_user.is_authenticated:
@@ -493,18 +581,15 @@ def admin_export_user_csv():
     if (not current_user.is_admin()) and (username != current_user.username):
         return ('forbidden', 403)
 
-    rows = query_all(
-        'SELECT id, username, sensor, timestamp, value FROM readings '
-        'WHERE username=? ORDER BY timestamp ASC',
-        (username,)
-    )
+    # storico completo: anche i bucket compattati (n > 1, id vuoto), vedi _history_rows
+    rows = _history_rows(username)
 
     buf = io.StringIO()
     w = csv.writer(buf)
-    w.writerow(['id', 'username', 'sensor', 'timestamp', 'timestamp_iso', 'value'])
+    w.writerow(['id', 'username', 'sensor', 'timestamp', 'timestamp_iso', 'value', 'ax', 'ay', 'az', 'n'])
 
     for r in rows:
-        ts = float(r['timestamp']) if r['timestamp'] is not None else ''
+        ts = r['timestamp'] / 1000.0 if r['timestamp'] is not None else ''  # ms -> s
         ts_iso = ''
         if ts != '':
             try:
@@ -514,13 +599,14 @@ def admin_export_user_csv():
                                  .astimezone(ZoneInfo('Europe/Rome')).isoformat()
             except Exception:
                 pass
-        w.writerow([r['id'], r['username'], r['sensor'], r['timestamp'], ts_iso, r['value']])
+        w.writerow([r['id'], r['username'], r['sensor'], r['timestamp'], ts_iso, r['value'],
+                    r['ax'], r['ay'], r['az'], r['n']])
 
     data = buf.getvalue().encode('utf-8')
     return send_file(io.BytesIO(data), mimetype='text/csv', as_attachment=True,
                      download_name=f'{username}_readings.csv')
 
-@app.route('/admin/notify_user', methods=['POST'])
+@bp.route('/admin/notify_user', methods=['POST'])
 @login_required
 def admin_notify_user():
     if not current_user.is_admin():
@@ -529,18 +615,18 @@ def admin_notify_user():
     msg = request.form.get('message')
     send_email(f'{uname}@example.com', 'Notifica dal sistema', msg or '(vuoto)')
     flash('Notifica inviata (email)')
-    return redirect(url_for('admin_home'))
+    return redirect(url_for('main.admin_home'))
 
-@app.route('/admin/sync_users')
+@bp.route('/admin/sync_users')
 @login_required
 def admin_sync_users():
     if not current_user.is_admin():
         abort(403)
     n = sync_users_to_firestore()
     flash(f'Utenti sincronizzati su Firestore: {n}')
-    return redirect(url_for('admin_home'))
+    return redirect(url_for('main.admin_home'))
 
-@app.route('/admin/fs_status')
+@bp.route('/admin/fs_status')
 @login_required
 def admin_fs_status():
     if not current_user.is_admin():
@@ -561,7 +647,7 @@ def admin_fs_status():
         cred_path=current_app.config.get('FIRESTORE_CREDENTIALS', None)
     )
 
-@app.route('/admin/fs_test_write')
+@bp.route('/admin/fs_test_write')
 @login_required
 def admin_fs_test_write():
     if not current_user.is_admin():
@@ -576,57 +662,202 @@ def admin_fs_test_write():
         import traceback
         traceback.print_exc()
         flash(f'Test write FAILED: {e}')
-    return redirect(url_for('admin_home'))
+    return redirect(url_for('main.admin_home'))
 
 
 # --------------------------------------------------------------------------------------
 # API
 # --------------------------------------------------------------------------------------
-@app.route('/api/sensor_data', methods=['POST'])
+@bp.route('/api/sensor_data', methods=['POST'])
 def api_sensor_data():
+    """
+    Lettura singola {username, sensor, timestamp, value | ax, ay, az} oppure batch
+    {device_id?, seq?, readings: [...]} (o lista di letture). Idempotente: i duplicati
+    (username, sensor, timestamp) sono ignorati e un batch con seq già confermato
+    per lo stesso device_id viene riconosciuto senza reinserirlo.
+
+    Accetta anche il formato colonnare {device_id?, seq?, series: [...]} in JSON,
+    msgpack o CBOR, eventualmente compresso gzip/zstd (vedi wire.py).
+    """
     try:
-        data = request.get_json(force=True)
-        username = data.get('username')
-        sensor = data.get('sensor')
-        ts = float(data.get('timestamp', time.time()))
-        val = float(data.get('value'))
+        if wire.is_compact(request.mimetype) or request.content_encoding:
+            body = wire.decompress(request.get_data(), request.content_encoding)
+            data = wire.loads(body, request.mimetype)
+        else:
+            data = request.get_json(force=True)
+    except wire.UnsupportedFormat as e:
+        return jsonify({'ok': False, 'error': str(e)}), 415
+    except (wire.PayloadTooLarge, RequestEntityTooLarge) as e:
+        return jsonify({'ok': False, 'error': str(e)}), 413
+    except Exception as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
 
-        if sensor not in config.SENSORS:
-            return jsonify({'ok': False, 'error': 'bad sensor'}), 400
+    try:
+        if isinstance(data, dict) and 'readings' not in data and 'series' not in data:
+            username, sensor, ts, val, axes = parse_reading(data)
+            ts_ms = insert_reading(username, sensor, ts, val, axes)
+            if ts_ms is None:
+                return jsonify({'ok': True, 'inserted': 0})
 
-        exec_write(
-            'INSERT INTO readings(username,sensor,timestamp,value) VALUES(?,?,?,?)',
-            (username, sensor, ts, val)
-        )
+            try:
+                fs_add_reading(username, sensor, ts_ms, val)
+            except Exception as e:
+                print('[FS][WARN] fs_add_reading:', e)
+
+            evaluate(username, sensor, [(ts_ms, val)])
+            return jsonify({'ok': True, 'inserted': 1})
+
+        device_id = data.get('device_id') if isinstance(data, dict) else None
+        seq = data.get('seq') if isinstance(data, dict) else None
+        if isinstance(data, dict) and 'series' in data:
+            readings = []
+            for series in data['series']:
+                if series.get('sensor') not in config.SENSORS:
+                    raise ValueError('bad sensor')
+                readings.extend(wire.to_rows(wire.decode_series(series)))
+        else:
+            items = data if isinstance(data, list) else data.get('readings') or []
+            readings = [parse_reading(d) for d in items]
+    except Exception as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
 
+    res = ingest_batch(readings, device_id=device_id, seq=seq, return_rows=True)
+    if res['rows']:
+        # solo le letture nuove: i duplicati di un reinvio non ripassano da Firestore e rilevatori
         try:
-            fs_add_reading(username, sensor, ts, val)
+            fs_add_readings(res['rows'])
         except Exception as e:
-            print('[FS][WARN] fs_add_reading:', e)
-
-        moving_average_anomaly(username, sensor)
-        return jsonify({'ok': True})
+            print('[FS][WARN] fs_add_readings:', e)
+        # anomalie: una valutazione per (utente, sensore) toccato, non per lettura
+        by_stream = {}
+        for u, s, t, v in res['rows']:
+            by_stream.setdefault((u, s), []).append((t, v))
+        for (username, sensor), samples in by_stream.items():
+            evaluate(username, sensor, samples)
+    return jsonify({'ok': True, 'inserted': res['inserted'], 'duplicate': res['duplicate'],
+                    'seq': seq})
+
+@bp.route('/api/upload_session', methods=['POST'])
+@login_required
+def api_upload_session():
+    """
+    Import bulk di una sessione E4 (zip con i wrist_*.csv, campo `file`) per l'utente
+    corrente; l'admin può indicare `username`. Con `next` (form HTML) fa redirect, altrimenti JSON.
+    """
+    username = (request.form.get('username') or current_user.username).strip()
+    if username != current_user.username and not current_user.is_admin():
+        return ('forbidden', 403)
+    f = request.files.get('file')
+    next_url = request.form.get('next')
+    if next_url:
+        next_url = _local_url(next_url)
+    try:
+        if not f:
+            raise ValueError('file zip mancante')
+        # lo stream dell'upload (file temporaneo oltre pochi KB), senza copiarlo in memoria
+        session = bulk.read_session(f.stream)
+        if not session:
+            raise ValueError('nessun file wrist_*.csv valido nello zip')
     except Exception as e:
-        return jsonify({'ok': False, 'error': str(e)}), 400
-
-@app.route('/api/user_data/<username>')
+        if next_url:
+            flash(f'Import non riuscito: {e}')
+            return redirect(next_url)
+        return jsonify({'ok': False, 'error': str(e)}), 413 if isinstance(e, bulk.MemberTooLarge) else 400
+
+    t0 = time.perf_counter()
+    summary = bulk.load_session(username, session)
+    elapsed = time.perf_counter() - t0
+    print(f'[BULK] upload {username}: {elapsed:.2f}s', summary)
+    if next_url:
+        inserted = sum(v['inserted'] for v in summary.values())
+        anomalies = sum(v['anomalies'] for v in summary.values())
+        flash(f'Sessione importata per {username}: {inserted} letture nuove, {anomalies} anomalie ({elapsed:.1f}s)')
+        return redirect(next_url)
+    return jsonify({'ok': True, 'username': username, 'seconds': elapsed, 'sensors': summary})
+
+@bp.route('/api/user_data/<username>')
 @login_required
 def api_user_data(username):
     if (not current_user.is_admin()) and username != current_user.username:
         return ('forbidden', 403)
-    rows = query_all(
-        'SELECT sensor, timestamp, value FROM readings '
-        'WHERE username=? ORDER BY timestamp ASC LIMIT 1000',
-        (username,)
-    )
-    return jsonify(rows)
+    rows = _history_rows(username, limit=1000)
+    return jsonify([{'sensor': r['sensor'], 'timestamp': r['timestamp'], 'value': r['value']} for r in rows])
+
+
+@bp.route('/api/series/<sensor>/<username>')
+@login_required
+def api_series(sensor, username):
+    """Serie sottocampionata per i grafici interattivi (stessa finestra dei PNG di /plot)."""
+    if (not current_user.is_admin()) and username != current_user.username:
+        return ('forbidden', 403)
+    if sensor not in config.SENSORS:
+        return jsonify({'ok': False, 'error': 'sensore sconosciuto'}), 404
+    return series_response(username, sensor, config.SERIES_MAX_POINTS)
+
+
+@bp.route('/api/resample/<username>')
+@login_required
+def api_resample(username):
+    """
+    Sensori allineati su una griglia comune.
+    Parametri: start, end (epoch in s o ms; default ultima ora), period_ms o hz (default 1 Hz),
+    sensors=hr,eda,acc, agg=hr:mean,acc:max, fill_ms (riempimento dei bucket vuoti).
+    """
+    if (not current_user.is_admin()) and username != current_user.username:
+        return ('forbidden', 403)
+    try:
+        end = to_epoch_ms(request.args['end']) if request.args.get('end') else now_ms()
+        start = to_epoch_ms(request.args['start']) if request.args.get('start') else end - 3600 * 1000
+        hz = request.args.get('hz', type=float)
+        period = int(round(1000 / hz)) if hz else request.args.get('period_ms', type=int, default=1000)
+        sensors = [s for s in request.args.get('sensors', '').split(',') if s] or None
+        if sensors and any(s not in config.SENSORS for s in sensors):
+            raise ValueError('sensore sconosciuto')
+        df = resample.frame(username, start, end, period, sensors,
+                            resample.parse_agg(request.args.get('agg')),
+                            request.args.get('fill_ms', type=int, default=0))
+    except (ValueError, TypeError, ZeroDivisionError) as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    return jsonify(dict(resample.to_json(df), ok=True, start=int(start), period_ms=int(period)))
+
+
+# --------------------------------------------------------------------------------------
+# Metriche (formato Prometheus, vedi metrics.py)
+# --------------------------------------------------------------------------------------
+@bp.before_app_request
+def _metrics_start():
+    g.metrics_t0 = time.perf_counter()
+
+
+@bp.after_app_request
+def _metrics_request(response):
+    t0 = g.pop('metrics_t0', None)
+    if t0 is not None:
+        endpoint = request.endpoint or 'not_found'
+        metrics.inc('http_requests_total', endpoint=endpoint, status=response.status_code)
+        metrics.observe('http_request_seconds', time.perf_counter() - t0, endpoint=endpoint)
+    return response
+
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """
+    Metriche di questo processo. Con METRICS_TOKEN impostato serve l'header
+    'Authorization: Bearer <token>'; senza, solo da localhost o per un admin loggato.
+    """
+    token = config.METRICS_TOKEN
+    if token:
+        if request.headers.get('Authorization', '') != f'Bearer {token}':
+            return ('unauthorized', 401)
+    elif request.remote_addr not in ('127.0.0.1', '::1') and not (
+            current_user.is_authenticated and current_user.is_admin()):
+        return ('forbidden', 403)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 # --------------------------------------------------------------------------------------
 # Main
 # --------------------------------------------------------------------------------------
-# Alla fine del file app/app.py, assicurati che ci sia:
 if __name__ == '__main__':
-    import os
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
@@ -0,0 +1,142 @@
+"""
+Import bulk di una sessione Empatica E4 (zip o cartella con i file wrist_*.csv).
+
+Invece di passare riga per riga dal feeder, ogni CSV viene letto con pandas in
+un colpo solo, i timestamp normalizzati in ms in modo vettoriale e le letture
+inserite con ingest_batch a blocchi grandi (una transazione per blocco). Dopo il
+caricamento di tutti i sensori (l'ACC serve a smorzare gli allarmi in movimento)
+le anomalie dell'intervallo importato vengono ricalcolate in blocco
+(analytics.anomaly_rows, senza email), così come le feature derivate (derived.py).
+Firestore non viene alimentato dall'import bulk: i volumi di una sessione
+(centinaia di migliaia di letture) non ci stanno.
+
+Uso da riga di comando (dalla cartella app/):
+
+    python bulk.py /percorso/sessione.zip --username alice
+    python bulk.py /percorso/cartella_sessione --username alice
+"""
+import os, time, zipfile, argparse
+
+import config
+import pagecache
+from ingest import CSV_FILES, ingest_batch, acc_magnitude, to_epoch_ms
+from db import transaction
+
+BATCH_ROWS = 50000
+
+
+class MemberTooLarge(ValueError):
+    """CSV nello zip più grande di config.BULK_MAX_MEMBER_MB una volta decompresso (HTTP 413)."""
+
+
+def _read_csv(fobj, sensor):
+    """CSV E4 -> (ts ms int64, valori, axes | None) con pandas; righe illeggibili scartate."""
+    import numpy as np
+    import pandas as pd
+
+    df = pd.read_csv(fobj, header=0, engine='c', on_bad_lines='skip')
+    ncols = 4 if sensor == 'acc' else 2
+    if df.shape[1] < ncols or df.empty:
+        return None
+    arr = df.iloc[:, :ncols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    arr = arr[~np.isnan(arr).any(axis=1)]
+    if not arr.size:
+        return None
+    ts = to_epoch_ms(arr[:, 0])
+    if sensor == 'acc':
+        axes = (arr[:, 1], arr[:, 2], arr[:, 3])
+        return ts, acc_magnitude(*axes), axes
+    vals = arr[:, 1] / 1000.0 if sensor == 'ibi' else arr[:, 1]  # IBI ms -> s
+    return ts, vals, None
+
+
+def read_session(source):
+    """
+    Legge una sessione da cartella, percorso di uno zip o file-like zip (upload).
+    Nello zip i CSV sono cercati per nome file, anche dentro sottocartelle, e letti
+    in streaming dal membro; un membro oltre BULK_MAX_MEMBER_MB solleva MemberTooLarge
+    (zipfile non decomprime oltre la dimensione dichiarata, quindi il controllo regge).
+    Ritorna {sensore: (ts, valori, axes)}.
+    """
+    out = {}
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        for sensor, fname in CSV_FILES.items():
+            path = os.path.join(source, fname)
+            if os.path.exists(path):
+                parsed = _read_csv(path, sensor)
+                if parsed is not None:
+                    out[sensor] = parsed
+        return out
+
+    by_name = {fname: sensor for sensor, fname in CSV_FILES.items()}
+    max_size = int(config.BULK_MAX_MEMBER_MB * 1024 * 1024)
+    with zipfile.ZipFile(source) as zf:
+        for info in zf.infolist():
+            sensor = by_name.get(os.path.basename(info.filename))
+            if sensor is None or info.is_dir():
+                continue
+            if info.file_size > max_size:
+                raise MemberTooLarge(f'{info.filename}: {info.file_size} byte, limite {max_size}')
+            with zf.open(info) as f:
+                parsed = _read_csv(f, sensor)
+            if parsed is not None:
+                out[sensor] = parsed
+    return out
+
+
+def _rows(username, sensor, ts, vals, axes, lo, hi):
+    ts_l, v_l = ts[lo:hi].tolist(), vals[lo:hi].tolist()
+    if axes is None:
+        return [(username, sensor, t, v, None) for t, v in zip(ts_l, v_l)]
+    ax, ay, az = (a[lo:hi].tolist() for a in axes)
+    return [(username, sensor, t, v, (x, y, z)) for t, v, x, y, z in zip(ts_l, v_l, ax, ay, az)]
+
+
+def load_session(username, session, batch_rows=BATCH_ROWS, backfill=True):
+    """
+    Carica nel DB una sessione letta con read_session. Idempotente: ricaricare la stessa
+    sessione non crea duplicati. Ritorna {sensore: {'rows', 'inserted', 'anomalies', 'derived'}}.
+    """
+    import derived
+    from analytics import anomaly_rows, rewrite_anomalies
+
+    summary = {}
+    for sensor, (ts, vals, axes) in session.items():
+        inserted = 0
+        for lo in range(0, len(ts), batch_rows):
+            inserted += ingest_batch(_rows(username, sensor, ts, vals, axes, lo, lo + batch_rows))['inserted']
+        summary[sensor] = {'rows': int(len(ts)), 'inserted': inserted, 'anomalies': 0, 'derived': 0}
+
+    for sensor, (ts, vals, axes) in session.items():
+        if backfill and len(ts):
+            start, end = int(ts.min()), int(ts.max())
+            rows = anomaly_rows(username, sensor, start, end)
+            with transaction() as con:
+                rewrite_anomalies(con, username, sensor, rows, start, end)
+            summary[sensor]['anomalies'] = len(rows)
+            summary[sensor]['derived'] = derived.backfill(username, sensor, start, end)
+    if backfill:
+        pagecache.bump()   # anomalie sostituite e feature derivate: nessun inserimento in readings
+    return summary
+
+
+def import_session(username, source, backfill=True):
+    """read_session + load_session con un riepilogo a console."""
+    t0 = time.perf_counter()
+    session = read_session(source)
+    t_parse = time.perf_counter() - t0
+    summary = load_session(username, session, backfill=backfill)
+    print(f'[BULK] {username}: parsing {t_parse:.2f}s, totale {time.perf_counter() - t0:.2f}s', summary)
+    return summary
+
+
+if __name__ == '__main__':
+    from db import init_db
+
+    ap = argparse.ArgumentParser(description='Importa una sessione E4 (zip o cartella di wrist_*.csv)')
+    ap.add_argument('source', help='File .zip o cartella della sessione')
+    ap.add_argument('--username', required=True, help='Utente a cui associare le letture')
+    ap.add_argument('--no-backfill', action='store_true', help='Non ricalcolare anomalie e feature derivate')
+    args = ap.parse_args()
+    init_db()
+    import_session(args.username, args.source, backfill=not args.no_backfill)
@@ -0,0 +1,145 @@
+"""
+Compattatore delle letture ad alta frequenza (tier raw → tier rollup).
+
+Per ogni sensore con una policy in config.RETENTION, le righe di `readings`
+più vecchie di `raw_hours` vengono aggregate in bucket da `bucket_sec` secondi
+(n, somma, min, max) in `readings_rollup` e poi cancellate. Ogni batch è una
+transazione limitata (COMPACT_BATCH_ROWS righe), così il lock di scrittura
+viene tenuto poco anche con milioni di righe. Lo spazio liberato viene
+restituito con PRAGMA incremental_vacuum.
+
+Le statistiche leggono la vista `readings_tiered` (raw + rollup), quindi il
+passaggio di tier è trasparente. Per i sensori in config.BLOCK_SENSORS le righe
+vengono anche salvate a piena risoluzione in blocchi compressi (tsblocks.py).
+La tabella `compacted_until` ricorda fin dove è arrivata la compattazione di ogni
+stream: l'ingest scarta le letture più vecchie (reimport di dati già compattati).
+"""
+import time, threading
+
+import config
+import coord
+import pagecache
+from db import transaction, get_conn
+
+LEASE_NAME = 'compactor'
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def _compact_batch(sensor, cutoff_ms, bucket_sec, batch_rows):
+    """Compatta un batch di righe raw di `sensor` più vecchie di `cutoff_ms`. Ritorna le righe rimosse."""
+    bucket_ms = int(bucket_sec * 1000)
+    with transaction() as con:
+        cur = con.cursor()
+        cur.execute('CREATE TEMP TABLE IF NOT EXISTS _compact_ids(id INTEGER PRIMARY KEY)')
+        cur.execute('DELETE FROM _compact_ids')
+        cur.execute(
+            'INSERT INTO _compact_ids(id) SELECT id FROM readings '
+            'WHERE sensor=? AND timestamp < ? ORDER BY timestamp LIMIT ?',
+            (sensor, cutoff_ms, batch_rows)
+        )
+        if cur.rowcount <= 0:
+            return 0
+        # righe ordinate per tempo: per ogni stream tutto ciò che precede il massimo è compattato
+        cur.execute(
+            'INSERT INTO compacted_until(username, sensor, ts) '
+            'SELECT r.username, r.sensor, MAX(r.timestamp) '
+            'FROM readings r JOIN _compact_ids c ON c.id = r.id WHERE 1 '
+            'GROUP BY r.username, r.sensor '
+            'ON CONFLICT(username, sensor) DO UPDATE SET ts = max(ts, excluded.ts)'
+        )
+        cur.execute(
+            'INSERT INTO readings_rollup(username, sensor, bucket_ts, bucket_sec, n, vsum, vmin, vmax) '
+            'SELECT r.username, r.sensor, (r.timestamp / ?) * ?, ?, '
+            '       COUNT(*), SUM(r.value), MIN(r.value), MAX(r.value) '
+            'FROM readings r JOIN _compact_ids c ON c.id = r.id '
+            'WHERE r.value IS NOT NULL '
+            'GROUP BY r.username, r.sensor, 3 '
+            'ON CONFLICT(username, sensor, bucket_ts) DO UPDATE SET '
+            '  n = n + excluded.n, vsum = vsum + excluded.vsum, '
+            '  vmin = min(vmin, excluded.vmin), vmax = max(vmax, excluded.vmax)',
+            (bucket_ms, bucket_ms, bucket_sec)
+        )
+        if sensor in config.BLOCK_SENSORS:
+            _seal_blocks(con, sensor)
+        cur.execute('DELETE FROM readings WHERE id IN (SELECT id FROM _compact_ids)')
+        return cur.rowcount
+
+
+def _seal_blocks(con, sensor):
+    """Copia le righe del batch corrente nei blocchi compressi (stessa transazione)."""
+    import numpy as np
+    import tsblocks
+
+    rows = con.execute(
+        'SELECT r.username, r.timestamp, r.value FROM readings r JOIN _compact_ids c ON c.id = r.id '
+        'WHERE r.value IS NOT NULL ORDER BY r.username, r.timestamp'
+    ).fetchall()
+    by_user = {}
+    for u, t, v in rows:
+        by_user.setdefault(u, ([], []))
+        by_user[u][0].append(t); by_user[u][1].append(v)
+    for u, (ts, vals) in by_user.items():
+        tsblocks.write_blocks(con, u, sensor, np.array(ts, dtype=np.int64), np.array(vals, dtype=float))
+
+
+def incremental_vacuum(min_free_pages=None, step_pages=None):
+    """Restituisce al filesystem fino a `step_pages` pagine se le pagine libere superano la soglia."""
+    min_free_pages = config.VACUUM_FREE_PAGES if min_free_pages is None else min_free_pages
+    step_pages = config.VACUUM_STEP_PAGES if step_pages is None else step_pages
+    with get_conn() as con:
+        free = con.execute('PRAGMA freelist_count').fetchone()[0]
+        if free < min_free_pages:
+            return 0
+        con.execute(f'PRAGMA incremental_vacuum({int(step_pages)})').fetchall()
+        return min(free, step_pages)
+
+
+def compact_once(now=None, max_batches=None):
+    """
+    Una passata completa su tutte le policy. Ritorna {sensore: righe_compattate}.
+    `max_batches` limita il lavoro per sensore (None = fino ad esaurimento).
+    """
+    now = time.time() if now is None else now
+    out = {}
+    for sensor, policy in config.RETENTION.items():
+        cutoff = int((now - policy['raw_hours'] * 3600) * 1000)
+        total, batches = 0, 0
+        while max_batches is None or batches < max_batches:
+            n = _compact_batch(sensor, cutoff, policy['bucket_sec'], config.COMPACT_BATCH_ROWS)
+            if n <= 0:
+                break
+            total += n
+            batches += 1
+        if total:
+            out[sensor] = total
+    if out:
+        print('[COMPACT] righe compattate:', out)
+        pagecache.bump()   # righe spostate nel rollup: sqlite_sequence non cambia
+    freed = incremental_vacuum()
+    if freed:
+        print('[COMPACT] incremental_vacuum pagine:', freed)
+    return out
+
+
+def _loop():
+    while True:
+        try:
+            # un solo processo compatta alla volta (lease più lungo dell'intervallo)
+            if coord.try_acquire_lease(LEASE_NAME, config.COMPACT_INTERVAL_SEC * 2):
+                compact_once()
+        except Exception as e:
+            print('[COMPACT][WARN]', e)
+        time.sleep(config.COMPACT_INTERVAL_SEC)
+
+
+def start_compactor():
+    """Avvia (una volta per processo) il thread di compattazione periodica."""
+    global _thread
+    with _thread_lock:
+        if _thread is not None and _thread.is_alive():
+            return _thread
+        _thread = threading.Thread(target=_loop, daemon=True, name='compactor')
+        _thread.start()
+        return _thread
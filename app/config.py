@@ -5,6 +5,16 @@ import os
 # =========================
 SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key-change-me')
 DATABASE_URL = os.environ.get('DATABASE_URL', 'app.db')
+DB_BUSY_TIMEOUT_SEC = float(os.environ.get('DB_BUSY_TIMEOUT_SEC', '30'))
+# Profiler delle query (querylog.py, pagina /admin/queries): spento di default
+DB_PROFILE = os.environ.get('DB_PROFILE', '0') == '1'
+DB_SLOW_MS = float(os.environ.get('DB_SLOW_MS', '100'))            # oltre: stampa con EXPLAIN QUERY PLAN
+DB_EXPLAIN_EVERY_SEC = float(os.environ.get('DB_EXPLAIN_EVERY_SEC', '300'))  # al più un EXPLAIN per statement
+# Limiti sui corpi delle richieste (oltre: HTTP 413). MAX_REQUEST_MB vale per tutte le route
+# (MAX_CONTENT_LENGTH di Flask, upload zip compresi); WIRE_MAX_DECOMPRESSED_MB limita il
+# corpo di /api/sensor_data dopo la decompressione gzip/zstd (wire.py).
+MAX_REQUEST_MB = float(os.environ.get('MAX_REQUEST_MB', '64'))
+WIRE_MAX_DECOMPRESSED_MB = float(os.environ.get('WIRE_MAX_DECOMPRESSED_MB', '64'))
 
 # =========================
 # Email config (Gmail SMTP)
@@ -23,7 +33,7 @@ FROM_EMAIL = os.environ.get('FROM_EMAIL', 'mattiaavellino2001@gmail.com')
 # =========================
 # Anomaly detection
 # =========================
-MOVING_AVG_WINDOW = int(os.environ.get('MOVING_AVG_WINDOW', '10'))   # last N values
+MOVING_AVG_WINDOW = int(os.environ.get('MOVING_AVG_WINDOW', '10'))   # last N values ('moving_average')
 THRESHOLDS = {
     'hr':   float(os.environ.get('THRESH_HR',   '120')),  # bpm
     'temp': float(os.environ.get('THRESH_TEMP', '38.5')), # °C
@@ -35,16 +45,146 @@ THRESHOLDS = {
 MOVING_AVERAGE_WINDOW = MOVING_AVG_WINDOW
 ANOMALY_THRESHOLDS = THRESHOLDS
 
+# Rilevatore per sensore (detectors.py):
+#   'moving_average' media degli ultimi MOVING_AVG_WINDOW campioni (regola storica, su SQL; default)
+#   'window'         media sugli ultimi WINDOW_SEC[sensore] secondi contro THRESHOLDS
+#   'zscore'/'cusum' baseline personale EWMA in streaming
+# Es. DETECTORS="bvp:window,eda:cusum"; DEFAULT_DETECTOR=window lo attiva per tutti i sensori
+DEFAULT_DETECTOR = os.environ.get('DEFAULT_DETECTOR', 'moving_average')
+DETECTORS = dict(
+    item.split(':', 1) for item in os.environ.get('DETECTORS', '').split(',') if ':' in item
+)
+# Durata della finestra per sensore in secondi (a 64 Hz 2 s = 128 campioni, a 1 Hz 10 s = 10)
+WINDOW_SEC = {
+    'hr': 10, 'temp': 60, 'eda': 10, 'bvp': 2, 'acc': 2, 'ibi': 30,
+}
+WINDOW_SEC.update(
+    (k, float(v)) for k, v in
+    (item.split(':', 1) for item in os.environ.get('WINDOW_SEC', '').split(',') if ':' in item)
+)
+# Parametri per rilevatore; chiavi 'nome:sensore' per valori specifici di un sensore
+DETECTOR_PARAMS = {
+    'window': {'stat': 'mean', 'max_buckets': 256},     # stat: mean | min | max
+    'zscore': {'alpha': 0.01, 'z': 4.0, 'warmup': 200},
+    'cusum':  {'alpha': 0.005, 'k': 0.5, 'h': 10.0, 'warmup': 200},
+}
+DETECTOR_PERSIST_SEC = float(os.environ.get('DETECTOR_PERSIST_SEC', '30'))  # salvataggio baseline
+
+# Allarmi HR/EDA durante il movimento (motion.py): livello = media |ACC - 1 g| sulla finestra
+#   'suppress' scarta l'allarme, 'downrank' lo registra senza email, 'off' disattiva
+MOTION_MODE = os.environ.get('MOTION_MODE', 'suppress')
+MOTION_SENSORS = [s for s in os.environ.get('MOTION_SENSORS', 'hr,eda').split(',') if s]
+MOTION_WINDOW_SEC = float(os.environ.get('MOTION_WINDOW_SEC', '10'))
+MOTION_HIGH = float(os.environ.get('MOTION_HIGH', '0.1'))             # g (riposo ≈ 0.015)
+MOTION_MAX_AGE_SEC = float(os.environ.get('MOTION_MAX_AGE_SEC', '30'))  # ACC più vecchio: ignorato
+
+# =========================
+# Feature derivate (derived.py)
+# =========================
+# HRV dagli IBI (hrv.py): finestre di HRV_WINDOW_SEC che avanzano di HRV_STEP_SEC
+HRV_WINDOW_SEC = int(os.environ.get('HRV_WINDOW_SEC', '300'))
+HRV_STEP_SEC = int(os.environ.get('HRV_STEP_SEC', '60'))
+HRV_MIN_BEATS = int(os.environ.get('HRV_MIN_BEATS', '30'))                   # battiti minimi per finestra
+HRV_MIN_COVERAGE = float(os.environ.get('HRV_MIN_COVERAGE', '0.2'))         # somma IBI / durata finestra
+HRV_MIN_COVERAGE_FREQ = float(os.environ.get('HRV_MIN_COVERAGE_FREQ', '0.5'))  # per LF/HF
+# EDA tonica/fasica e SCR (eda.py), feature per minuto
+EDA_FS_HZ = 4.0
+EDA_LOWPASS_SEC = float(os.environ.get('EDA_LOWPASS_SEC', '1'))      # media mobile passa-basso
+EDA_TONIC_SEC = float(os.environ.get('EDA_TONIC_SEC', '10'))         # minimo mobile + lisciatura
+EDA_SCR_RISE_SEC = float(os.environ.get('EDA_SCR_RISE_SEC', '4'))    # salita massima di una SCR
+EDA_SCR_MIN_AMP = float(os.environ.get('EDA_SCR_MIN_AMP', '0.01'))   # µS
+EDA_MAX_GAP_SEC = float(os.environ.get('EDA_MAX_GAP_SEC', '2'))      # oltre: nuovo segmento
+
+# =========================
+# Serie allineate tra sensori (resample.py)
+# =========================
+RESAMPLE_AGG = {'hr': 'mean', 'temp': 'mean', 'eda': 'mean', 'bvp': 'mean', 'acc': 'max', 'ibi': 'mean'}
+RESAMPLE_MAX_POINTS = int(os.environ.get('RESAMPLE_MAX_POINTS', '20000'))   # bucket per richiesta
+RESAMPLE_CACHE_SEC = float(os.environ.get('RESAMPLE_CACHE_SEC', '30'))
+RESAMPLE_CACHE_SIZE = int(os.environ.get('RESAMPLE_CACHE_SIZE', '64'))      # finestre in cache
+
 # =========================
 # Feeder
 # =========================
 FEED_INTERVAL_SEC = float(os.environ.get('FEED_INTERVAL_SEC', '1.0'))
+# Supervisore feeder: un solo processo (leader, via lease su SQLite) esegue i feeder
+FEEDER_SUPERVISOR = os.environ.get('FEEDER_SUPERVISOR', '1') == '1'
+FEEDER_LEASE_TTL_SEC = float(os.environ.get('FEEDER_LEASE_TTL_SEC', '15'))
+FEEDER_POLL_SEC = float(os.environ.get('FEEDER_POLL_SEC', '2'))
+# 'replay': simulazione, una riga per sensore ogni FEED_INTERVAL_SEC
+# 'tail':   ingester di file reali, legge tutte le righe complete disponibili e poi
+#           attende che il file cresca (polling), gestendo troncamento/rotazione
+FEEDER_MODE = os.environ.get('FEEDER_MODE', 'replay')
+FEEDER_TAIL_POLL_SEC = float(os.environ.get('FEEDER_TAIL_POLL_SEC', '1.0'))
+FEEDER_TAIL_BATCH = int(os.environ.get('FEEDER_TAIL_BATCH', '1000'))    # righe per transazione
+# Import bulk (bulk.py): dimensione massima di un CSV dentro lo zip, non compresso (oltre: 413)
+BULK_MAX_MEMBER_MB = float(os.environ.get('BULK_MAX_MEMBER_MB', '512'))
+
+# =========================
+# Alert email
+# =========================
+ALERT_COOLDOWN_SEC = int(os.environ.get('ALERT_COOLDOWN_SEC', '900'))  # 15 min, condiviso tra worker
 
 # =========================
 # Allowed sensors
 # =========================
 SENSORS = ['hr', 'temp', 'eda', 'bvp', 'acc', 'ibi']
 
+# =========================
+# Retention / compattazione
+# =========================
+# Per sensore: le letture raw restano per `raw_hours`, poi vengono compattate in
+# bucket da `bucket_sec` secondi (n, somma, min, max) nella tabella readings_rollup.
+# Spenta di default (le letture raw restano per sempre): RETENTION=1 attiva le policy
+# qui sotto; RETENTION_<SENSORE> ne sovrascrive una o attiva solo quella,
+# es. RETENTION_BVP="48:1" (ore_raw:secondi_bucket) o "off".
+RETENTION_ENABLED = os.environ.get('RETENTION', '0') == '1'
+
+def _retention(sensor, raw_hours, bucket_sec):
+    raw = os.environ.get(f'RETENTION_{sensor.upper()}')
+    if raw is None and not RETENTION_ENABLED:
+        return None
+    if raw is not None:
+        if raw.strip().lower() in ('', 'off', 'none'):
+            return None
+        h, _, b = raw.partition(':')
+        raw_hours, bucket_sec = float(h), int(b or bucket_sec)
+    return {'raw_hours': raw_hours, 'bucket_sec': bucket_sec}
+
+RETENTION = {s: p for s, p in {
+    'bvp':  _retention('bvp', 48, 1),          # 64 Hz
+    'acc':  _retention('acc', 48, 1),          # 32 Hz
+    'eda':  _retention('eda', 24 * 14, 10),    # 4 Hz
+    'temp': _retention('temp', 24 * 14, 10),   # 4 Hz
+}.items() if p}
+
+COMPACTOR = os.environ.get('COMPACTOR', '1') == '1'
+
+# Storage a blocchi (tsblocks.py): prima di cancellare le righe raw, il compattatore
+# salva la serie a piena risoluzione in chunk compressi per questi sensori. Ricalcolo
+# anomalie, HRV, EDA e livello di movimento leggono raw + blocchi: un sensore compattato
+# ma escluso da qui resta solo come bucket nel rollup e per loro sparisce.
+BLOCK_SENSORS = [s.strip() for s in os.environ.get('BLOCK_SENSORS', 'bvp,acc,eda,temp,hr,ibi').split(',')
+                 if s.strip()]
+BLOCK_CHUNK_SEC = int(os.environ.get('BLOCK_CHUNK_SEC', '60'))
+# Passo di quantizzazione dei valori nei blocchi (errore massimo = passo/2)
+BLOCK_QUANT = {
+    'bvp':  0.01,    # CSV E4 con 2 decimali
+    'acc':  1e-4,    # magnitudo in g
+    'eda':  1e-6,    # μS, 6 decimali
+    'temp': 0.01,    # °C
+    'hr':   0.01,    # bpm
+    'ibi':  1e-6,    # s
+}
+COMPACT_INTERVAL_SEC = float(os.environ.get('COMPACT_INTERVAL_SEC', '300'))
+COMPACT_BATCH_ROWS = int(os.environ.get('COMPACT_BATCH_ROWS', '20000'))   # righe per transazione
+VACUUM_FREE_PAGES = int(os.environ.get('VACUUM_FREE_PAGES', '1000'))      # soglia pagine libere
+VACUUM_STEP_PAGES = int(os.environ.get('VACUUM_STEP_PAGES', '2000'))      # pagine liberate per passata
+
+# Ricalcolo storico delle anomalie (reeval.py), dopo modifiche a THRESHOLDS o MOVING_AVG_WINDOW
+REEVAL_WORKERS = int(os.environ.get('REEVAL_WORKERS', str(min(4, os.cpu_count() or 1))))
+REEVAL_CHUNK_ROWS = int(os.environ.get('REEVAL_CHUNK_ROWS', '200000'))    # letture per blocco
+
 # =========================
 # Firestore
 # =========================
@@ -60,7 +200,35 @@ FIRESTORE_CREDENTIALS = os.environ.get(
 # Project ID GCP da usare (deve corrispondere alle credenziali)
 FIRESTORE_PROJECT_ID = os.environ.get('FIRESTORE_PROJECT_ID', 'strong-charge-465917-k4')
 
+# FIRESTORE_SYNC=0: niente copia su Firestore (sviluppo offline, benchmark riproducibili);
+# le scritture diventano no-op, le letture (email destinatari) ricadono sui fallback
+FIRESTORE_SYNC = os.environ.get('FIRESTORE_SYNC', '1') != '0'
+
 # =========================
 # Default plot window (days)
 # =========================
 DEFAULT_PLOT_DAYS = int(os.environ.get('DEFAULT_PLOT_DAYS', '7'))
+
+# Cartella dei CSV E4 per utente (<dir>/<username>/wrist_*.csv), letta da grafici e feeder
+DATA_SAMPLES_DIR = os.environ.get(
+    'DATA_SAMPLES_DIR',
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data_samples'))
+)
+
+# Rendering dei grafici in processi separati (render.py); 0 = nel thread della richiesta
+PLOT_WORKERS = int(os.environ.get('PLOT_WORKERS', str(min(4, os.cpu_count() or 1))))
+PLOT_QUEUE_MAX = int(os.environ.get('PLOT_QUEUE_MAX', '32'))        # grafici in corso + in coda
+PLOT_TIMEOUT_SEC = float(os.environ.get('PLOT_TIMEOUT_SEC', '20'))
+
+# Grafici interattivi (/api/series): punti massimi per richiesta (min/max per intervallo)
+SERIES_MAX_POINTS = int(os.environ.get('SERIES_MAX_POINTS', '5000'))
+
+# Cache del contesto di dashboard/analytics (pagecache.py), invalidata dalla versione dei dati
+PAGE_CACHE_SEC = float(os.environ.get('PAGE_CACHE_SEC', '60'))       # età massima; 0 = disattivata
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', '256'))      # pagine (utente, periodo)
+PAGE_CACHE_GRACE_SEC = float(os.environ.get('PAGE_CACHE_GRACE_SEC', '2'))  # servita anche con dati nuovi
+PAGE_CACHE_WAIT_SEC = float(os.environ.get('PAGE_CACHE_WAIT_SEC', '30'))  # attesa di un calcolo in corso
+
+# Metriche Prometheus (/metrics, metrics.py)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')   # se impostato: Authorization: Bearer <token>
@@ -0,0 +1,90 @@
+"""
+Coordinamento tra processi via SQLite.
+
+Con più worker (gunicorn/waitress) le variabili globali di modulo non sono
+condivise: lease (leader election), cooldown degli alert e piccolo stato
+applicativo vivono quindi in tabelle SQLite, aggiornate con statement atomici.
+"""
+import os, json, time, socket
+
+from db import exec_write, exec_write_count, query_one
+
+
+def worker_id():
+    """Identificativo del processo corrente (host:pid). Calcolato ogni volta: il pid cambia dopo il fork."""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+# =========================
+# Lease (leader election)
+# =========================
+
+def try_acquire_lease(name, ttl_sec, owner=None):
+    """
+    Acquisisce o rinnova il lease `name` per `ttl_sec` secondi.
+    Riesce se il lease è libero, scaduto o già nostro. Ritorna True se siamo il leader.
+    """
+    owner = owner or worker_id()
+    now = time.time()
+    n = exec_write_count(
+        'INSERT INTO leases(name, owner, expires_at) VALUES(?,?,?) '
+        'ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at '
+        'WHERE leases.owner=excluded.owner OR leases.expires_at < ?',
+        (name, owner, now + ttl_sec, now)
+    )
+    return n > 0
+
+
+def release_lease(name, owner=None):
+    """Rilascia il lease se è nostro (es. allo shutdown del worker)."""
+    owner = owner or worker_id()
+    exec_write('DELETE FROM leases WHERE name=? AND owner=?', (name, owner))
+
+
+def lease_owner(name):
+    """Proprietario attuale del lease (None se libero o scaduto)."""
+    row = query_one('SELECT owner, expires_at FROM leases WHERE name=?', (name,))
+    if not row or (row['expires_at'] or 0) < time.time():
+        return None
+    return row['owner']
+
+
+# =========================
+# Cooldown condivisi
+# =========================
+
+def claim_cooldown(key, ts, cooldown_sec):
+    """
+    Registra un evento `key` all'istante `ts` (secondi) solo se l'ultimo evento
+    registrato è più vecchio di `cooldown_sec`. Atomico tra processi:
+    ritorna True a un solo chiamante per finestra di cooldown.
+    """
+    n = exec_write_count(
+        'INSERT INTO cooldowns(key, last_ts) VALUES(?,?) '
+        'ON CONFLICT(key) DO UPDATE SET last_ts=excluded.last_ts '
+        'WHERE excluded.last_ts - cooldowns.last_ts >= ?',
+        (key, float(ts), float(cooldown_sec))
+    )
+    return n > 0
+
+
+# =========================
+# Stato applicativo (chiave → JSON)
+# =========================
+
+def state_get(key, default=None):
+    row = query_one('SELECT value FROM app_state WHERE key=?', (key,))
+    if not row or row['value'] is None:
+        return default
+    try:
+        return json.loads(row['value'])
+    except ValueError:
+        return default
+
+
+def state_set(key, value):
+    exec_write(
+        'INSERT INTO app_state(key, value) VALUES(?,?) '
+        'ON CONFLICT(key) DO UPDATE SET value=excluded.value',
+        (key, json.dumps(value))
+    )
@@ -2,69 +2,384 @@ import sqlite3, os, threading, time
 from contextlib import contextmanager
 
 import config
+import metrics
+import querylog
 
 _lock = threading.Lock()
 
 def init_db():
-    with get_conn() as con:
-        cur = con.cursor()
-        cur.execute('''CREATE TABLE IF NOT EXISTS users(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE,
-            email TEXT,
-            password_hash TEXT,
-            role TEXT DEFAULT 'user',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS readings(
+    # Avvio concorrente di più worker: il cambio di journal_mode e il VACUUM iniziale possono
+    # dare "database is locked" senza attendere il busy timeout. Ogni passo è idempotente
+    # (IF NOT EXISTS, migrazioni che rileggono user_version), quindi si riprova.
+    for attempt in range(5):
+        try:
+            with get_conn() as con:
+                _init_schema(con)
+            return
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or attempt == 4:
+                raise
+            print(f'[DB][WARN] init_db: {e}, nuovo tentativo')
+            time.sleep(0.2 * (attempt + 1))
+
+
+def _init_schema(con):
+    cur = con.cursor()
+    # auto_vacuum incrementale: il compattatore restituisce spazio al filesystem
+    # a piccoli passi (PRAGMA incremental_vacuum). Su un DB già esistente serve
+    # un VACUUM una tantum perché l'impostazione abbia effetto.
+    if cur.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        cur.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        cur.execute('VACUUM')
+    # WAL: letture concorrenti da più worker mentre un processo scrive
+    # (fuori dalla transazione: il journal_mode non si cambia dentro una transazione)
+    cur.execute('PRAGMA journal_mode=WAL').fetchall()
+    # Più worker avviano init_db insieme: creazione dello schema e user_version di un
+    # DB nuovo in un'unica transazione con lock di scrittura (gli altri attendono)
+    cur.execute('BEGIN IMMEDIATE')
+    fresh = not _has_table(con, 'readings')
+    cur.execute('''CREATE TABLE IF NOT EXISTS users(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE,
+        email TEXT,
+        password_hash TEXT,
+        role TEXT DEFAULT 'user',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    # Tutti i timestamp sono epoch in millisecondi, interi, normalizzati
+    # all'ingest (ingest.to_epoch_ms): i filtri per finestra usano gli indici.
+    cur.execute(_READINGS_DDL.format(name='readings'))
+    cur.execute(_ANOMALIES_DDL.format(name='anomalies'))
+    # --- Tier "freddo": letture compattate in bucket (vedi compactor.py) ---
+    cur.execute(_ROLLUP_DDL.format(name='readings_rollup'))
+    # --- Blocchi compressi a piena risoluzione (vedi tsblocks.py) ---
+    cur.execute('''CREATE TABLE IF NOT EXISTS reading_blocks(
+        username TEXT,
+        sensor TEXT,
+        chunk_start INTEGER,
+        t_start INTEGER,
+        t_end INTEGER,
+        n INTEGER,
+        quant REAL,
+        vmin REAL,
+        vmax REAL,
+        vsum REAL,
+        ts_blob BLOB,
+        val_blob BLOB,
+        PRIMARY KEY(username, sensor, chunk_start)
+    )''')
+    # Fin dove (timestamp ms incluso) ogni stream è stato compattato: l'ingest scarta le
+    # letture più vecchie, che finirebbero contate due volte in rollup e blocchi
+    cur.execute('''CREATE TABLE IF NOT EXISTS compacted_until(
+        username TEXT,
+        sensor TEXT,
+        ts INTEGER,
+        PRIMARY KEY(username, sensor)
+    )''')
+    # Ultimo numero di sequenza confermato per dispositivo (batch già ricevuti)
+    cur.execute('''CREATE TABLE IF NOT EXISTS ingest_seq(
+        device_id TEXT PRIMARY KEY,
+        last_seq INTEGER,
+        updated_at REAL
+    )''')
+    # --- Coordinamento tra processi (vedi coord.py) ---
+    cur.execute('''CREATE TABLE IF NOT EXISTS leases(
+        name TEXT PRIMARY KEY,
+        owner TEXT,
+        expires_at REAL
+    )''')
+    cur.execute('''CREATE TABLE IF NOT EXISTS cooldowns(
+        key TEXT PRIMARY KEY,
+        last_ts REAL
+    )''')
+    cur.execute('''CREATE TABLE IF NOT EXISTS app_state(
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )''')
+    cur.execute('''CREATE TABLE IF NOT EXISTS feeder_control(
+        username TEXT PRIMARY KEY,
+        folder TEXT,
+        desired TEXT DEFAULT 'stop',
+        updated_at REAL
+    )''')
+    # Posizione dei feeder nei file CSV (ripresa con seek dopo stop/riavvio)
+    cur.execute('''CREATE TABLE IF NOT EXISTS feeder_checkpoints(
+        username TEXT,
+        sensor TEXT,
+        path TEXT,
+        offset INTEGER,
+        last_ts INTEGER,
+        inode INTEGER,
+        updated_at REAL,
+        PRIMARY KEY(username, sensor)
+    )''')
+    # Baseline dei rilevatori di anomalie in streaming (vedi detectors.py)
+    cur.execute('''CREATE TABLE IF NOT EXISTS detector_state(
+        username TEXT,
+        sensor TEXT,
+        detector TEXT,
+        state TEXT,
+        updated_at REAL,
+        PRIMARY KEY(username, sensor, detector)
+    )''')
+    # Feature calcolate su finestre (HRV, ...): una riga per finestra, ts = inizio finestra
+    cur.execute('''CREATE TABLE IF NOT EXISTS derived_features(
+        username TEXT,
+        feature TEXT,
+        ts INTEGER,
+        window_sec INTEGER,
+        value REAL,
+        PRIMARY KEY(username, feature, ts)
+    )''')
+    if fresh:
+        # schema appena creato già nella forma finale: nessuna migrazione da applicare
+        cur.execute(f'PRAGMA user_version={len(_MIGRATIONS)}')
+    con.commit()
+    _migrate(con)
+    _create_indexes_and_views(con)
+
+
+_READINGS_DDL = '''CREATE TABLE IF NOT EXISTS {name}(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT,
             sensor TEXT,
-            timestamp REAL,
-            value REAL
-        )''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS anomalies(
+            timestamp INTEGER,
+            value REAL,
+            ax REAL,
+            ay REAL,
+            az REAL
+        )'''
+
+_ANOMALIES_DDL = '''CREATE TABLE IF NOT EXISTS {name}(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT,
             sensor TEXT,
-            timestamp REAL,
+            timestamp INTEGER,
             value REAL,
             threshold REAL,
-            window INTEGER
-        )''')
-        con.commit()
+            window INTEGER,
+            detector TEXT,
+            motion REAL
+        )'''
+
+_ROLLUP_DDL = '''CREATE TABLE IF NOT EXISTS {name}(
+            username TEXT,
+            sensor TEXT,
+            bucket_ts INTEGER,
+            bucket_sec INTEGER,
+            n INTEGER,
+            vsum REAL,
+            vmin REAL,
+            vmax REAL,
+            PRIMARY KEY(username, sensor, bucket_ts)
+        )'''
+
+
+def _create_indexes_and_views(con):
+    cur = con.cursor()
+    # Chiave unica: ingestione idempotente (INSERT OR IGNORE sui reinvii)
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS uq_readings_user_sensor_ts ON readings(username, sensor, timestamp)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_readings_ts ON readings(timestamp)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_anomalies_ts ON anomalies(timestamp)')
+    # Vista unificata raw + rollup: le statistiche leggono sempre da qui
+    # (media = SUM(vsum)/SUM(n), conteggio = SUM(n)).
+    cur.execute('''CREATE VIEW IF NOT EXISTS readings_tiered AS
+        SELECT username, sensor, timestamp, 1 AS n, value AS vsum, value AS vmin, value AS vmax
+        FROM readings
+        UNION ALL
+        SELECT username, sensor, bucket_ts AS timestamp, n, vsum, vmin, vmax
+        FROM readings_rollup
+    ''')
+    con.commit()
+
+
+def _has_table(con, name):
+    return con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+
+def _has_column(con, table, column):
+    return any(r[1] == column for r in con.execute(f'PRAGMA table_info({table})').fetchall())
+
+
+def _m1_acc_axes(con):
+    """ACC a 3 assi nella stessa riga di `readings` (value = magnitudo)."""
+    # Eccezione: le righe acc salvate prima di questa migrazione hanno ax/ay/az NULL e in
+    # `value` l'asse x (il vecchio parser leggeva solo la prima colonna). La magnitudo non
+    # si può ricostruire (y e z non sono mai stati salvati): restano come sono.
+    for col in ('ax', 'ay', 'az'):
+        if not _has_column(con, 'readings', col):
+            con.execute(f'ALTER TABLE readings ADD COLUMN {col} REAL')
+
+
+# Stessa regola di ingest.to_epoch_ms, in SQL: µs / ms / s -> ms interi
+_TO_MS_SQL = (
+    'CAST(ROUND(CASE WHEN {c} > 1e14 THEN {c} / 1000.0 '
+    'WHEN {c} > 1e11 THEN {c} ELSE {c} * 1000.0 END) AS INTEGER)'
+)
+
+
+def _m2_epoch_ms(con):
+    """Timestamp in millisecondi interi (INTEGER) per readings, anomalies e rollup."""
+    con.execute('DROP VIEW IF EXISTS readings_tiered')
+    ts = _TO_MS_SQL.format(c='timestamp')
+    con.execute(_READINGS_DDL.format(name='_readings_new'))
+    con.execute(f'INSERT INTO _readings_new(id, username, sensor, timestamp, value, ax, ay, az) '
+                f'SELECT id, username, sensor, {ts}, value, ax, ay, az FROM readings')
+    con.execute('DROP TABLE readings')
+    con.execute('ALTER TABLE _readings_new RENAME TO readings')
+
+    con.execute(_ANOMALIES_DDL.format(name='_anomalies_new'))
+    con.execute(f'INSERT INTO _anomalies_new(id, username, sensor, timestamp, value, threshold, window) '
+                f'SELECT id, username, sensor, {ts}, value, threshold, window FROM anomalies')
+    con.execute('DROP TABLE anomalies')
+    con.execute('ALTER TABLE _anomalies_new RENAME TO anomalies')
+
+    bts = _TO_MS_SQL.format(c='bucket_ts')
+    con.execute(_ROLLUP_DDL.format(name='_rollup_new'))
+    con.execute(f'INSERT INTO _rollup_new SELECT username, sensor, {bts}, bucket_sec, n, vsum, vmin, vmax '
+                f'FROM readings_rollup')
+    con.execute('DROP TABLE readings_rollup')
+    con.execute('ALTER TABLE _rollup_new RENAME TO readings_rollup')
+
+
+def _m3_unique_readings(con):
+    """Rimuove le letture duplicate e rende unica la chiave (username, sensor, timestamp)."""
+    con.execute('DELETE FROM readings WHERE id NOT IN '
+                '(SELECT MIN(id) FROM readings GROUP BY username, sensor, timestamp)')
+    con.execute('DROP INDEX IF EXISTS idx_readings_user_sensor_ts')
+    con.execute('CREATE UNIQUE INDEX IF NOT EXISTS uq_readings_user_sensor_ts ON readings(username, sensor, timestamp)')
+
+
+def _m4_anomaly_detector(con):
+    """Colonna `detector` in anomalies (NULL = media mobile storica)."""
+    if not _has_column(con, 'anomalies', 'detector'):
+        con.execute('ALTER TABLE anomalies ADD COLUMN detector TEXT')
+
+
+def _m5_anomaly_motion(con):
+    """Colonna `motion` in anomalies (livello di movimento al momento dell'allarme)."""
+    if not _has_column(con, 'anomalies', 'motion'):
+        con.execute('ALTER TABLE anomalies ADD COLUMN motion REAL')
+
+
+def _m6_ibi_seconds(con):
+    """IBI in secondi anche nelle righe salvate prima della conversione all'ingest (in ms)."""
+    # un IBI oltre 10 s non è fisiologico: è un valore in millisecondi (stessa regola di ingest)
+    con.execute("UPDATE readings SET value = value / 1000.0 WHERE sensor='ibi' AND value > 10")
+    con.execute("UPDATE anomalies SET value = value / 1000.0 WHERE sensor='ibi' AND value > 10")
+    con.execute("UPDATE anomalies SET threshold = threshold / 1000.0 WHERE sensor='ibi' AND threshold > 10")
+    con.execute("UPDATE readings_rollup SET vsum = vsum / 1000.0, vmin = vmin / 1000.0, vmax = vmax / 1000.0 "
+                "WHERE sensor='ibi' AND vsum > 10 * n")
+
+
+def _m7_compacted_until(con):
+    """Soglia di compattazione per stream, ricavata da rollup e blocchi già scritti."""
+    # del rollup si conosce solo il bucket: la soglia è la sua fine
+    con.execute('INSERT OR REPLACE INTO compacted_until(username, sensor, ts) '
+                'SELECT username, sensor, MAX(ts) FROM ('
+                '  SELECT username, sensor, MAX(bucket_ts + bucket_sec * 1000 - 1) AS ts '
+                '  FROM readings_rollup GROUP BY username, sensor'
+                '  UNION ALL'
+                '  SELECT username, sensor, MAX(t_end) FROM reading_blocks GROUP BY username, sensor'
+                ') GROUP BY username, sensor')
+
+
+# Migrazioni dello schema, applicate in ordine una sola volta (PRAGMA user_version).
+# I DB nuovi nascono già con lo schema finale (vedi init_db).
+_MIGRATIONS = [
+    _m1_acc_axes,
+    _m2_epoch_ms,
+    _m3_unique_readings,
+    _m4_anomaly_detector,
+    _m5_anomaly_motion,
+    _m6_ibi_seconds,
+    _m7_compacted_until,
+]
+
+
+def _migrate(con):
+    # Un passo per transazione con lock di scrittura (BEGIN IMMEDIATE: gli altri worker
+    # attendono invece di fallire con "database is locked"); la versione è riletta dentro
+    # la transazione, così un passo già applicato da un altro processo viene saltato.
+    for i, step in enumerate(_MIGRATIONS, start=1):
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            if con.execute('PRAGMA user_version').fetchall()[0][0] >= i:
+                con.rollback()
+                continue
+            print(f'[DB][MIGRATE] {i}: {step.__doc__.strip()}')
+            step(con)
+            con.execute(f'PRAGMA user_version={i}')
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
 
 @contextmanager
 def get_conn():
-    # SQLite connects by filename
-    con = sqlite3.connect(config.DATABASE_URL, check_same_thread=False)
+    # SQLite connects by filename; timeout = attesa sul lock quando più processi scrivono
+    con = sqlite3.connect(config.DATABASE_URL, check_same_thread=False,
+                          timeout=config.DB_BUSY_TIMEOUT_SEC)
     try:
         yield con
     finally:
         con.close()
 
 def exec_write(sql, params=()):
-    with _lock:
+    t0 = time.perf_counter()
+    with metrics.timer('db_seconds', op='write'), _lock:
+        with get_conn() as con:
+            cur = con.cursor()
+            cur.execute(sql, params)
+            con.commit()
+    if config.DB_PROFILE:
+        querylog.record(sql, params, time.perf_counter() - t0, cur.rowcount)
+    return cur.lastrowid
+
+@contextmanager
+def transaction():
+    """Connessione con lock di scrittura: commit a fine blocco, rollback in caso di errore."""
+    with metrics.timer('db_seconds', op='transaction'), _lock:
+        with get_conn() as con:
+            try:
+                yield con
+                con.commit()
+            except Exception:
+                con.rollback()
+                raise
+
+def exec_write_count(sql, params=()):
+    """Come exec_write ma ritorna il numero di righe modificate (per UPDATE/upsert condizionali)."""
+    t0 = time.perf_counter()
+    with metrics.timer('db_seconds', op='write'), _lock:
         with get_conn() as con:
             cur = con.cursor()
             cur.execute(sql, params)
             con.commit()
-            return cur.lastrowid
+    if config.DB_PROFILE:
+        querylog.record(sql, params, time.perf_counter() - t0, cur.rowcount)
+    return cur.rowcount
 
 def exec_many(sql, seq_of_params):
-    with _lock:
+    t0 = time.perf_counter()
+    with metrics.timer('db_seconds', op='write_many'), _lock:
         with get_conn() as con:
             cur = con.cursor()
             cur.executemany(sql, seq_of_params)
             con.commit()
+    if config.DB_PROFILE:
+        querylog.record(sql, (), time.perf_counter() - t0, cur.rowcount)
 
 def query_all(sql, params=()):
-    with get_conn() as con:
+    t0 = time.perf_counter()
+    with metrics.timer('db_seconds', op='query'), get_conn() as con:
         cur = con.cursor()
         cur.execute(sql, params)
         rows = cur.fetchall()
         cols = [d[0] for d in cur.description]
-        return [dict(zip(cols, r)) for r in rows]
+    if config.DB_PROFILE:
+        querylog.record(sql, params, time.perf_counter() - t0, len(rows))
+    return [dict(zip(cols, r)) for r in rows]
 
 def query_one(sql, params=()):
     rows = query_all(sql, params)
@@ -0,0 +1,76 @@
+"""
+Feature derivate calcolate su finestre di letture (HRV dagli IBI, componenti EDA).
+
+Le serie sono salvate in `derived_features` (una riga per utente, feature e inizio
+finestra) e aggiornate in due modi:
+  - in diretta: analytics.evaluate chiama update() dopo ogni inserimento; il modulo
+    del sensore ricalcola solo le finestre toccate dalle nuove letture
+  - in blocco: backfill() dopo un import (bulk.py) ricalcola tutto l'intervallo
+
+Ricalcolare una finestra sovrascrive il valore precedente (INSERT OR REPLACE):
+una finestra ancora aperta viene completata agli aggiornamenti successivi.
+"""
+import math
+
+from db import exec_many, query_all
+
+
+def _modules():
+    import eda
+    import hrv
+    return {'ibi': hrv, 'eda': eda}
+
+
+def update(username, sensor, samples):
+    """Aggiornamento incrementale dopo nuove letture [(ts_ms, value)] di uno stream."""
+    mod = _modules().get(sensor)
+    if mod is None or not samples:
+        return 0
+    try:
+        return mod.update_live(username, samples)
+    except Exception as e:
+        print('[DERIVED][WARN]', username, sensor, e)
+        return 0
+
+
+def backfill(username, sensor, start_ms, end_ms):
+    """Ricalcolo in blocco delle feature derivate di un sensore su [start_ms, end_ms]."""
+    mod = _modules().get(sensor)
+    return mod.compute_range(username, start_ms, end_ms) if mod is not None else 0
+
+
+def upsert(username, window_sec, window_starts, features):
+    """Salva {feature: valori} allineati a window_starts; i NaN (finestre senza dati) sono saltati."""
+    rows = []
+    starts = [int(t) for t in window_starts]
+    for name, values in features.items():
+        for ts, v in zip(starts, values.tolist()):
+            if not math.isnan(v) and not math.isinf(v):
+                rows.append((username, name, ts, int(window_sec), v))
+    if rows:
+        exec_many('INSERT OR REPLACE INTO derived_features(username, feature, ts, window_sec, value) '
+                  'VALUES (?,?,?,?,?)', rows)
+    return len(rows)
+
+
+def series(username, feature, start_ms=None, end_ms=None):
+    """[(ts_ms, valore)] di una feature, in ordine di tempo."""
+    rows = query_all('SELECT ts, value FROM derived_features WHERE username=? AND feature=? '
+                     'AND ts>=? AND ts<=? ORDER BY ts',
+                     (username, feature, start_ms if start_ms is not None else 0,
+                      end_ms if end_ms is not None else 2 ** 62))
+    return [(r['ts'], r['value']) for r in rows]
+
+
+def summary(username, prefix, start_ms):
+    """{feature: {'last', 'last_ts', 'avg', 'min', 'max', 'n'}} delle feature che iniziano con prefix."""
+    rows = query_all(
+        'SELECT d.feature, AVG(d.value) AS avg, MIN(d.value) AS min, MAX(d.value) AS max, '
+        'COUNT(*) AS n, MAX(d.ts) AS last_ts, '
+        '(SELECT value FROM derived_features l WHERE l.username=d.username AND l.feature=d.feature '
+        ' ORDER BY l.ts DESC LIMIT 1) AS last '
+        'FROM derived_features d WHERE d.username=? AND substr(d.feature, 1, ?)=? AND d.ts>=? '
+        'GROUP BY d.feature ORDER BY d.feature',
+        (username, len(prefix), prefix, start_ms)   # prefisso letterale: in LIKE '_' è un jolly
+    )
+    return {r['feature']: dict(r) for r in rows}
@@ -0,0 +1,360 @@
+"""
+Rilevatori di anomalie in streaming con baseline per utente.
+
+Ogni rilevatore riceve i campioni uno alla volta (update) e mantiene uno stato
+O(1) per (utente, sensore), serializzabile in JSON. Gli stati sono tenuti in
+memoria nel processo e salvati periodicamente (config.DETECTOR_PERSIST_SEC)
+nella tabella `detector_state`, da cui vengono ricaricati al riavvio.
+
+Rilevatori disponibili (config.DETECTORS per sensore, default config.DEFAULT_DETECTOR):
+  - window: media (o min/max) sugli ultimi config.WINDOW_SEC[sensore] secondi contro
+            THRESHOLDS; la finestra è a durata, non a numero di campioni, quindi
+            10 s sono 10 s sia per HR (1 Hz) sia per BVP (64 Hz)
+  - zscore: media e varianza EWMA della persona; anomalia se |z| > soglia
+  - cusum:  somma cumulativa delle deviazioni standardizzate (derive lente)
+'moving_average' (default) resta la regola storica su SQL (analytics.moving_average_anomaly):
+ultimi MOVING_AVG_WINDOW campioni; gli altri si attivano per sensore o con DEFAULT_DETECTOR.
+
+Con più worker che ricevono letture dello stesso stream ogni processo aggiorna
+la propria copia della baseline (vale l'ultima salvata): per z-score le stime
+restano valide, CUSUM è più affidabile se lo stream arriva a un solo processo
+(feeder o dispositivo sempre sullo stesso worker).
+"""
+import json, math, time, threading
+from collections import deque
+
+import config
+from db import query_one, exec_many
+
+# =========================
+# Interfaccia
+# =========================
+
+class Detector:
+    """Rilevatore in streaming: update() per ogni campione, stato serializzabile."""
+    name = None
+
+    def __init__(self, **params):
+        self.params = params
+
+    def update(self, ts_ms, value):
+        """Ritorna None oppure (statistica, soglia) se il campione è anomalo."""
+        raise NotImplementedError
+
+    def get_state(self):
+        return {}
+
+    def set_state(self, state):
+        pass
+
+    def window(self):
+        """Ampiezza indicativa della baseline in campioni (colonna `window` di anomalies)."""
+        return None
+
+
+class Ewma:
+    """Media e varianza esponenziali (aggiornamento incrementale, O(1))."""
+    __slots__ = ('alpha', 'n', 'mean', 'var')
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.n, self.mean, self.var = 0, 0.0, 0.0
+
+    def update(self, x):
+        if self.n == 0:
+            self.mean, self.var = x, 0.0
+        else:
+            d = x - self.mean
+            inc = self.alpha * d
+            self.mean += inc
+            self.var = (1.0 - self.alpha) * (self.var + d * inc)
+        self.n += 1
+
+    def z(self, x):
+        return (x - self.mean) / math.sqrt(self.var) if self.var > 0 else 0.0
+
+    def get_state(self):
+        return {'n': self.n, 'mean': self.mean, 'var': self.var}
+
+    def set_state(self, st):
+        self.n, self.mean, self.var = int(st.get('n', 0)), float(st.get('mean', 0.0)), float(st.get('var', 0.0))
+
+
+class SlidingWindow:
+    """
+    Finestra scorrevole di durata fissa con media, min e max in O(1) ammortizzato.
+
+    I campioni sono aggregati in al più `max_buckets` bucket [inizio, n, somma, min, max]
+    (stessa idea di readings_rollup): la memoria dipende dalla durata, non dalla
+    frequenza di campionamento. Min e max usano due deque monotone con al più
+    una voce per bucket. Il bordo della finestra ha la granularità di un bucket.
+    """
+
+    def __init__(self, seconds, max_buckets=256):
+        self.span_ms = int(seconds * 1000)
+        self.res = max(1, self.span_ms // max_buckets)
+        self.buckets = deque()
+        self.mins = deque()   # (bucket, valore) con valori crescenti
+        self.maxs = deque()   # (bucket, valore) con valori decrescenti
+        self.n, self.total = 0, 0.0
+
+    def _push(self, b, v):
+        while self.mins and self.mins[-1][1] >= v:
+            self.mins.pop()
+        if not (self.mins and self.mins[-1][0] == b):
+            self.mins.append((b, v))
+        while self.maxs and self.maxs[-1][1] <= v:
+            self.maxs.pop()
+        if not (self.maxs and self.maxs[-1][0] == b):
+            self.maxs.append((b, v))
+
+    def add(self, ts_ms, v):
+        b = ts_ms - ts_ms % self.res
+        last = self.buckets[-1] if self.buckets else None
+        if last is not None and b <= last[0]:
+            # stesso bucket (o campione in ritardo): aggregato nell'ultimo
+            b = last[0]
+            last[1] += 1; last[2] += v
+            last[3] = min(last[3], v); last[4] = max(last[4], v)
+        else:
+            self.buckets.append([b, 1, v, v, v])
+        self.n += 1
+        self.total += v
+        self._push(b, v)
+        self._expire(b)
+
+    def _expire(self, latest):
+        cutoff = latest - self.span_ms
+        while self.buckets and self.buckets[0][0] <= cutoff:
+            _, n, tot, _, _ = self.buckets.popleft()
+            self.n -= n
+            self.total -= tot
+        while self.mins and self.mins[0][0] <= cutoff:
+            self.mins.popleft()
+        while self.maxs and self.maxs[0][0] <= cutoff:
+            self.maxs.popleft()
+
+    @property
+    def mean(self):
+        return self.total / self.n if self.n else None
+
+    @property
+    def min(self):
+        return self.mins[0][1] if self.mins else None
+
+    @property
+    def max(self):
+        return self.maxs[0][1] if self.maxs else None
+
+    def covered_ms(self):
+        """Durata coperta dai campioni attuali (per non dare allarmi a finestra ancora vuota)."""
+        if not self.buckets:
+            return 0
+        return self.buckets[-1][0] + self.res - self.buckets[0][0]
+
+    def get_state(self):
+        return {'span_ms': self.span_ms, 'res': self.res, 'buckets': [list(b) for b in self.buckets]}
+
+    def set_state(self, state):
+        if state.get('span_ms') != self.span_ms or state.get('res') != self.res:
+            return  # durata cambiata in config: si riparte da una finestra vuota
+        self.buckets = deque(list(b) for b in state.get('buckets', []))
+        self.mins.clear(); self.maxs.clear()
+        self.n = sum(b[1] for b in self.buckets)
+        self.total = sum(b[2] for b in self.buckets)
+        for b, _, _, mn, mx in self.buckets:
+            self._push(b, mn)
+            self._push(b, mx)
+
+
+# =========================
+# Rilevatori
+# =========================
+
+class WindowDetector(Detector):
+    """Media/min/max degli ultimi `seconds` secondi contro una soglia fissa; un allarme per finestra."""
+    name = 'window'
+
+    def __init__(self, seconds=10, threshold=None, stat='mean', max_buckets=256, min_fill=0.8):
+        super().__init__(seconds=seconds, threshold=threshold, stat=stat)
+        self.w = SlidingWindow(seconds, max_buckets)
+        self.threshold, self.stat, self.min_fill = threshold, stat, min_fill
+        self.quiet_until = None
+
+    def update(self, ts_ms, value):
+        self.w.add(ts_ms, value)
+        if self.threshold is None or self.w.covered_ms() < self.min_fill * self.w.span_ms:
+            return None
+        x = getattr(self.w, self.stat)
+        if x > self.threshold and (self.quiet_until is None or ts_ms >= self.quiet_until):
+            # niente raffica di allarmi (uno per campione) finché la finestra non si rinnova
+            self.quiet_until = ts_ms + self.w.span_ms
+            return x, self.threshold
+        return None
+
+    def get_state(self):
+        return dict(self.w.get_state(), quiet_until=self.quiet_until)
+
+    def set_state(self, state):
+        self.w.set_state(state)
+        self.quiet_until = state.get('quiet_until')
+
+    def window(self):
+        return self.w.n
+
+
+class ZScoreDetector(Detector):
+    """|x - media| / deviazione standard della baseline EWMA della persona."""
+    name = 'zscore'
+
+    def __init__(self, alpha=0.01, z=4.0, warmup=200):
+        super().__init__(alpha=alpha, z=z, warmup=warmup)
+        self.base = Ewma(alpha)
+        self.z_thr, self.warmup = z, warmup
+
+    def update(self, ts_ms, value):
+        ready = self.base.n >= self.warmup and self.base.var > 0
+        z = self.base.z(value) if ready else 0.0
+        self.base.update(value)
+        if ready and abs(z) > self.z_thr:
+            return z, self.z_thr
+        return None
+
+    def get_state(self):
+        return self.base.get_state()
+
+    def set_state(self, state):
+        self.base.set_state(state)
+
+    def window(self):
+        return int(round(2.0 / self.base.alpha - 1))
+
+
+class CusumDetector(Detector):
+    """CUSUM bilaterale sulle deviazioni standardizzate rispetto alla baseline EWMA."""
+    name = 'cusum'
+
+    def __init__(self, alpha=0.005, k=0.5, h=10.0, warmup=200):
+        super().__init__(alpha=alpha, k=k, h=h, warmup=warmup)
+        self.base = Ewma(alpha)
+        self.k, self.h, self.warmup = k, h, warmup
+        self.pos = self.neg = 0.0
+
+    def update(self, ts_ms, value):
+        ready = self.base.n >= self.warmup and self.base.var > 0
+        z = self.base.z(value) if ready else 0.0
+        self.base.update(value)
+        if not ready:
+            return None
+        self.pos = max(0.0, self.pos + z - self.k)
+        self.neg = max(0.0, self.neg - z - self.k)
+        if self.pos > self.h or self.neg > self.h:
+            stat = self.pos if self.pos >= self.neg else -self.neg
+            self.pos = self.neg = 0.0  # riparte dopo l'allarme
+            return stat, self.h
+        return None
+
+    def get_state(self):
+        return dict(self.base.get_state(), pos=self.pos, neg=self.neg)
+
+    def set_state(self, state):
+        self.base.set_state(state)
+        self.pos, self.neg = float(state.get('pos', 0.0)), float(state.get('neg', 0.0))
+
+    def window(self):
+        return int(round(2.0 / self.base.alpha - 1))
+
+
+REGISTRY = {
+    'window': WindowDetector,
+    'zscore': ZScoreDetector,
+    'cusum': CusumDetector,
+}
+
+
+def detector_for(sensor):
+    """Nome del rilevatore configurato per il sensore ('moving_average' = regola SQL storica)."""
+    return config.DETECTORS.get(sensor, config.DEFAULT_DETECTOR)
+
+
+def create(name, sensor=None):
+    params = dict(config.DETECTOR_PARAMS.get(name, {}))
+    if name == 'window':
+        params.setdefault('seconds', config.WINDOW_SEC.get(sensor, 10))
+        params.setdefault('threshold', config.THRESHOLDS.get(sensor))
+    params.update(config.DETECTOR_PARAMS.get(f'{name}:{sensor}', {}))
+    return REGISTRY[name](**params)
+
+
+# =========================
+# Stati per stream (cache di processo + persistenza)
+# =========================
+
+_streams = {}     # (username, sensor, name) -> Detector
+_dirty = set()
+_lock = threading.Lock()
+_last_flush = time.time()
+
+
+def get_stream(username, sensor, name):
+    key = (username, sensor, name)
+    det = _streams.get(key)
+    if det is None:
+        det = create(name, sensor)
+        row = query_one('SELECT state FROM detector_state WHERE username=? AND sensor=? AND detector=?', key)
+        if row and row['state']:
+            det.set_state(json.loads(row['state']))
+        _streams[key] = det
+    return det
+
+
+def feed(username, sensor, name, samples):
+    """
+    Passa i campioni (ts_ms, value) al rilevatore dello stream.
+    Ritorna gli allarmi [(ts_ms, value, statistica, soglia)] e salva le baseline se è ora.
+    """
+    alerts = []
+    with _lock:
+        det = get_stream(username, sensor, name)
+        for ts, v in samples:
+            if v is None:
+                continue
+            hit = det.update(ts, v)
+            if hit is not None:
+                alerts.append((ts, v, hit[0], hit[1]))
+        _dirty.add((username, sensor, name))
+    flush()
+    return alerts
+
+
+def flush(force=False):
+    """Salva le baseline modificate se sono passati DETECTOR_PERSIST_SEC (o subito con force)."""
+    global _last_flush
+    now = time.time()
+    with _lock:
+        if not _dirty or (not force and now - _last_flush < config.DETECTOR_PERSIST_SEC):
+            return 0
+        rows = [(u, s, n, json.dumps(_streams[(u, s, n)].get_state()), now) for u, s, n in _dirty]
+        _dirty.clear()
+        _last_flush = now
+    exec_many(
+        'INSERT INTO detector_state(username, sensor, detector, state, updated_at) VALUES(?,?,?,?,?) '
+        'ON CONFLICT(username, sensor, detector) DO UPDATE SET state=excluded.state, updated_at=excluded.updated_at',
+        rows
+    )
+    return len(rows)
+
+
+def scan(name, sensor, ts, values, det=None):
+    """
+    Esegue un rilevatore su una serie storica (ricalcolo, import bulk) senza toccare
+    le baseline live. Passare lo stesso `det` per proseguire su blocchi successivi.
+    Ritorna (allarmi [(ts_ms, statistica, soglia)], det).
+    """
+    det = det or create(name, sensor)
+    out = []
+    for t, v in zip(ts, values):
+        hit = det.update(t, v)
+        if hit is not None:
+            out.append((t, hit[0], hit[1]))
+    return out, det
@@ -0,0 +1,145 @@
+"""
+Attività elettrodermica (EDA): componente tonica, fasica e risposte SCR.
+
+Pipeline sul segnale a 4 Hz, tutta vettoriale NumPy:
+  1. segmenti: il segnale viene spezzato dove mancano campioni per più di EDA_MAX_GAP_SEC
+  2. passa-basso: media mobile centrata di EDA_LOWPASS_SEC (toglie rumore e quantizzazione)
+  3. tonica: minimo mobile centrato su EDA_TONIC_SEC, poi lisciato con una media mobile
+     della stessa durata (inviluppo inferiore lento); fasica = filtrato - tonica
+  4. SCR: massimi locali della fasica la cui salita rispetto al minimo dei
+     EDA_SCR_RISE_SEC precedenti supera EDA_SCR_MIN_AMP µS
+
+Per ogni minuto (inizio allineato al minuto, ms epoch) si salvano in `derived_features`
+(derived.py) tonica media, fasica media, numero di SCR e ampiezza media delle SCR.
+
+In diretta update_live elabora solo i minuti per cui sono già arrivati i campioni che
+servono ai filtri centrati (_pad_ms dopo la fine del minuto): il risultato è lo stesso
+del calcolo in blocco su tutta la sessione.
+"""
+import config
+
+MINUTE_MS = 60000
+
+FEATURES = ('eda_tonic', 'eda_phasic', 'eda_scr_count', 'eda_scr_amp')
+
+
+def _n(sec):
+    return max(1, int(round(sec * config.EDA_FS_HZ)))
+
+
+def _pad_ms():
+    # contesto necessario a destra/sinistra di un campione: filtri centrati + salita SCR
+    return int((config.EDA_LOWPASS_SEC + 2 * config.EDA_TONIC_SEC + config.EDA_SCR_RISE_SEC) * 1000) + 1000
+
+
+def _moving(x, n, fn=None):
+    """Media (o fn: np.min) mobile centrata su n campioni, bordi estesi col valore estremo."""
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    h = n // 2
+    xp = np.pad(x, (h, n - 1 - h), mode='edge')
+    if fn is not None:
+        return fn(sliding_window_view(xp, n), axis=1)
+    c = np.concatenate(([0.0], np.cumsum(xp)))
+    return (c[n:] - c[:-n]) / n
+
+
+def decompose(values):
+    """Un segmento continuo -> (filtrato, tonica, fasica, ampiezza SCR per campione o 0)."""
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    x = np.asarray(values, dtype=float)
+    filt = _moving(x, _n(config.EDA_LOWPASS_SEC))
+    nt = _n(config.EDA_TONIC_SEC)
+    tonic = _moving(_moving(filt, nt, np.min), nt)
+    phasic = filt - tonic
+
+    amp = np.zeros(x.size)
+    if x.size >= 3:
+        r = _n(config.EDA_SCR_RISE_SEC)
+        onset = sliding_window_view(np.pad(phasic, (r - 1, 0), mode='edge'), r).min(axis=1)
+        peak = np.zeros(x.size, dtype=bool)
+        peak[1:-1] = (phasic[1:-1] > phasic[:-2]) & (phasic[1:-1] >= phasic[2:])
+        rise = phasic - onset
+        hit = peak & (rise >= config.EDA_SCR_MIN_AMP)
+        amp[hit] = rise[hit]
+    return filt, tonic, phasic, amp
+
+
+def compute(ts_ms, values, start_ms=None, end_ms=None):
+    """
+    Feature per minuto sui minuti che iniziano in [start_ms, end_ms] (default: tutti).
+    Ritorna (inizio minuti, {feature: valori}) con NaN per i minuti con pochi campioni.
+    """
+    import numpy as np
+
+    ts = np.asarray(ts_ms, dtype=np.int64)
+    x = np.asarray(values, dtype=float)
+    if ts.size < 2:
+        return np.empty(0, dtype=np.int64), {f: np.empty(0) for f in FEATURES}
+    order = np.argsort(ts, kind='stable')
+    ts, x = ts[order], x[order]
+
+    tonic = np.empty(x.size)
+    phasic = np.empty(x.size)
+    amp = np.empty(x.size)
+    cuts = np.flatnonzero(np.diff(ts) > config.EDA_MAX_GAP_SEC * 1000) + 1
+    for lo, hi in zip(np.concatenate(([0], cuts)), np.concatenate((cuts, [ts.size]))):
+        _, tonic[lo:hi], phasic[lo:hi], amp[lo:hi] = decompose(x[lo:hi])
+
+    lo_m = (ts[0] if start_ms is None else int(start_ms)) // MINUTE_MS
+    hi_m = (ts[-1] if end_ms is None else int(end_ms)) // MINUTE_MS
+    keep = (ts // MINUTE_MS >= lo_m) & (ts // MINUTE_MS <= hi_m)
+    idx = ts[keep] // MINUTE_MS - lo_m
+    size = int(hi_m - lo_m + 1)
+    if size <= 0:
+        return np.empty(0, dtype=np.int64), {f: np.empty(0) for f in FEATURES}
+
+    n = np.bincount(idx, minlength=size).astype(float)
+    scr = amp[keep] > 0
+    n_scr = np.bincount(idx, weights=scr, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ok = n >= 0.5 * config.EDA_FS_HZ * 60
+        out = {
+            'eda_tonic': np.where(ok, np.bincount(idx, weights=tonic[keep], minlength=size) / n, np.nan),
+            'eda_phasic': np.where(ok, np.bincount(idx, weights=phasic[keep], minlength=size) / n, np.nan),
+            'eda_scr_count': np.where(ok, n_scr, np.nan),
+            'eda_scr_amp': np.where(ok & (n_scr > 0),
+                                    np.bincount(idx, weights=amp[keep], minlength=size) / n_scr, np.nan),
+        }
+    return (np.arange(lo_m, hi_m + 1, dtype=np.int64) * MINUTE_MS), out
+
+
+def compute_range(username, start_ms, end_ms):
+    """Ricalcola e salva le feature dei minuti in [start_ms, end_ms]. Ritorna i valori salvati."""
+    import derived
+    import tsblocks
+
+    start = int(start_ms) // MINUTE_MS * MINUTE_MS
+    pad = _pad_ms()
+    ts, vals = tsblocks.read_arrays(username, 'eda', start - pad, int(end_ms) + MINUTE_MS + pad)
+    if ts.size < 2:
+        return 0
+    minutes, feats = compute(ts, vals, start, end_ms)
+    return derived.upsert(username, 60, minutes, feats)
+
+
+_done_until = {}
+
+
+def update_live(username, samples):
+    """
+    Dopo nuove letture EDA [(ts_ms, µS)] elabora i minuti completati: quelli che
+    finiscono almeno _pad_ms prima dell'ultimo campione, non ancora salvati.
+    """
+    if not samples:
+        return 0
+    ready = (max(int(t) for t, _ in samples) - _pad_ms()) // MINUTE_MS   # primo minuto non pronto
+    prev = _done_until.get(username)
+    if prev is not None and ready <= prev:
+        return 0
+    _done_until[username] = ready
+    start = prev if prev is not None else ready - 1
+    return compute_range(username, start * MINUTE_MS, ready * MINUTE_MS - 1)
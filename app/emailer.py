@@ -1,10 +1,26 @@
-import smtplib, ssl, sys, mimetypes
-from email.message import EmailMessage
+import sys, time, mimetypes
 import config
+import coord
+import metrics
 
-_last_status = {'last_sent': None, 'queue_size': 0}
+# Stato email condiviso tra worker (tabella app_state, vedi coord.py)
+_STATUS_KEY = 'email_status'
+
+def _set_last_sent(mode):
+    try:
+        coord.state_set(_STATUS_KEY, {'last_sent': mode, 'last_sent_at': time.time(), 'queue_size': 0})
+    except Exception as e:
+        print('[EMAIL][WARN] stato non salvato:', e, file=sys.stderr)
 
 def send_email(to_email, subject, body, attachments=None):
+    """Come _send_email, con durata ed esito nelle metriche (email_seconds)."""
+    t0 = time.perf_counter()
+    ok = _send_email(to_email, subject, body, attachments)
+    metrics.observe('email_seconds', time.perf_counter() - t0,
+                    mode=config.EMAIL_MODE, outcome='ok' if ok else 'error')
+    return ok
+
+def _send_email(to_email, subject, body, attachments=None):
     """
     Invia una email.
     - to_email: destinatario (stringa)
@@ -17,7 +33,6 @@ def send_email(to_email, subject, body, attachments=None):
           "mime":     "text/csv"      (opzionale; se assente prova da mimetypes)
         }
     """
-    global _last_status
     attachments = attachments or []
 
     if config.EMAIL_MODE == 'console':
@@ -25,10 +40,14 @@ def send_email(to_email, subject, body, attachments=None):
         print(body[:2000])
         if attachments:
             print('[EMAIL][CONSOLE] allegati:', [a.get('filename') for a in attachments])
-        _last_status['last_sent'] = 'console'
+        _set_last_sent('console')
         return True
 
     try:
+        # smtplib/ssl/email caricati solo quando si invia davvero (avvio più rapido)
+        import smtplib, ssl
+        from email.message import EmailMessage
+
         msg = EmailMessage()
         msg['From'] = config.FROM_EMAIL
         msg['To'] = to_email
@@ -62,11 +81,11 @@ def send_email(to_email, subject, body, attachments=None):
             server.login(config.SMTP_USER, config.SMTP_PASS)
             server.send_message(msg)
 
-        _last_status['last_sent'] = 'smtp'
+        _set_last_sent('smtp')
         return True
     except Exception as e:
         print('[EMAIL][ERROR]', e, file=sys.stderr)
         return False
 
 def email_status():
-    return _last_status
+    return coord.state_get(_STATUS_KEY, {'last_sent': None, 'queue_size': 0})
@@ -0,0 +1,328 @@
+"""
+Feeder lato server: legge i CSV in data_samples/<username>/ e inserisce le letture nel DB.
+
+Lo stato desiderato (run/stop) è salvato nella tabella `feeder_control`, così
+qualsiasi worker può ricevere i comandi dell'admin. Un solo processo alla volta
+(il leader, scelto con un lease su SQLite) esegue davvero i thread dei feeder:
+il supervisore di ogni worker prova a prendere il lease e, se ci riesce,
+allinea i thread locali allo stato desiderato.
+
+La posizione di lettura (byte offset + ultimo timestamp) di ogni (utente, sensore)
+è salvata in `feeder_checkpoints`: dopo uno stop, un riavvio o un cambio di
+leader il feeder riprende con seek() invece di rileggere il file dall'inizio.
+I file sono aperti in binario, così l'offset è esatto. L'inserimento è
+idempotente (vedi ingest.py), quindi le righe tra l'ultimo checkpoint e un
+crash vengono reinserite senza duplicati.
+
+Modalità (config.FEEDER_MODE):
+  - replay: una riga per sensore ogni FEED_INTERVAL_SEC (simulazione)
+  - tail:   legge tutte le righe complete disponibili a batch e poi attende che
+            il file cresca (polling ogni FEEDER_TAIL_POLL_SEC); se il file viene
+            troncato o sostituito (rotazione) riparte dall'inizio del nuovo file.
+            Con 'moving_average' l'anomalia viene valutata sull'ultima lettura
+            di ogni batch; i rilevatori in streaming ricevono tutte le letture.
+"""
+import os, time, threading
+
+import config
+import metrics
+from db import exec_write, exec_many, query_all
+from analytics import evaluate
+from ingest import CSV_FILES, parse_line, insert_reading, ingest_batch, to_epoch_ms
+import coord
+import detectors
+
+LEASE_NAME = 'feeder_supervisor'
+
+# Stato locale al processo leader
+_threads = {}
+_stop = {}
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+# =========================
+# Comandi (da qualsiasi worker)
+# =========================
+
+def request_start(base):
+    """Segna come 'run' un feeder per ogni cartella in `base`. Ritorna gli username coinvolti."""
+    started = []
+    now = time.time()
+    for uname in sorted(os.listdir(base)):
+        folder = os.path.join(base, uname)
+        if not os.path.isdir(folder):
+            continue
+        exec_write(
+            'INSERT INTO feeder_control(username, folder, desired, updated_at) VALUES(?,?,?,?) '
+            'ON CONFLICT(username) DO UPDATE SET folder=excluded.folder, desired=excluded.desired, '
+            'updated_at=excluded.updated_at',
+            (uname, folder, 'run', now)
+        )
+        started.append(uname)
+    return started
+
+
+def request_stop():
+    """Segna come 'stop' tutti i feeder; il leader li ferma al prossimo giro."""
+    exec_write("UPDATE feeder_control SET desired='stop', updated_at=?", (time.time(),))
+
+
+# =========================
+# Thread feeder (solo nel leader)
+# =========================
+
+def reset_checkpoints(username=None):
+    """Cancella i checkpoint (di un utente o di tutti): al prossimo avvio si rilegge dall'inizio."""
+    if username:
+        exec_write('DELETE FROM feeder_checkpoints WHERE username=?', (username,))
+    else:
+        exec_write('DELETE FROM feeder_checkpoints')
+
+
+def _load_checkpoints(uname):
+    rows = query_all('SELECT sensor, path, offset, last_ts, inode FROM feeder_checkpoints WHERE username=?',
+                     (uname,))
+    return {r['sensor']: r for r in rows}
+
+
+def _save_checkpoints(uname, states):
+    """Salva in una sola transazione la posizione dei sensori avanzati dall'ultimo salvataggio."""
+    now = time.time()
+    rows = [(uname, sensor, st['path'], st['pos'], st['last_ts'], st['inode'], now)
+            for sensor, st in states.items() if st['dirty']]
+    if not rows:
+        return
+    _report_lag(uname, states, now)
+    exec_many(
+        'INSERT INTO feeder_checkpoints(username, sensor, path, offset, last_ts, inode, updated_at) '
+        'VALUES(?,?,?,?,?,?,?) ON CONFLICT(username, sensor) DO UPDATE SET path=excluded.path, '
+        'offset=excluded.offset, last_ts=excluded.last_ts, inode=excluded.inode, updated_at=excluded.updated_at',
+        rows
+    )
+    for st in states.values():
+        st['dirty'] = False
+
+
+def _report_lag(uname, states, now):
+    """Metriche dei sensori avanzati: byte ancora da leggere e, in tail, ritardo dall'ultima lettura."""
+    for sensor, st in states.items():
+        if not st['dirty'] or st['f'] is None:
+            continue
+        try:
+            metrics.set_gauge('feeder_backlog_bytes', max(0, os.fstat(st['f'].fileno()).st_size - st['pos']),
+                              username=uname, sensor=sensor)
+        except OSError:
+            pass
+        # in replay i timestamp sono quelli storici del CSV: il ritardo non ha senso
+        if config.FEEDER_MODE == 'tail' and st['last_ts'] is not None:
+            metrics.set_gauge('feeder_lag_seconds', now - st['last_ts'] / 1000.0, username=uname, sensor=sensor)
+
+
+def _open(st, cp=None):
+    """Apre il file del sensore; riprende dal checkpoint se riguarda lo stesso file, altrimenti salta l'header."""
+    if not os.path.exists(st['path']):
+        return False
+    f = open(st['path'], 'rb')
+    info = os.fstat(f.fileno())
+    st.update(f=f, inode=info.st_ino, dirty=True)
+    if cp and cp['path'] == st['path'] and cp['inode'] == info.st_ino and cp['offset'] <= info.st_size:
+        f.seek(cp['offset'])
+        st.update(pos=cp['offset'], last_ts=cp['last_ts'], dirty=False)
+    else:
+        f.readline()  # header
+        st.update(pos=f.tell(), last_ts=None)
+    return True
+
+
+def _close(st):
+    if st.get('f'):
+        try:
+            st['f'].close()
+        except Exception:
+            pass
+        st['f'] = None
+
+
+def _next_line(st, partial_ok):
+    """
+    Prossima riga decodificata, o None a fine file. Una riga senza newline finale
+    (il writer non l'ha ancora completata) viene lasciata nel file se partial_ok è falso.
+    """
+    f = st['f']
+    line = f.readline()
+    if not line:
+        return None
+    if not line.endswith(b'\n') and not partial_ok:
+        f.seek(st['pos'])
+        return None
+    st['pos'] = f.tell()
+    st['dirty'] = True
+    return line.decode('utf-8', 'replace')
+
+
+def _rotated(st):
+    """Vero se il file è stato troncato o sostituito da un altro (stesso path, inode diverso)."""
+    try:
+        info = os.stat(st['path'])
+    except OSError:
+        return False
+    return info.st_ino != st['inode'] or info.st_size < st['pos']
+
+
+def _replay_step(uname, states):
+    for sensor, st in states.items():
+        if st['f'] is None:
+            continue
+        line = _next_line(st, partial_ok=True)
+        if line is None:
+            continue
+        parsed = parse_line(sensor, line)
+        if parsed is None:
+            continue
+        ts, val, axes = parsed
+        st['last_ts'] = to_epoch_ms(ts)
+
+        # riga già presente (es. ripresa dopo un crash): niente doppio conteggio né anomalia
+        ts_ms = insert_reading(uname, sensor, ts, val, axes)
+        if ts_ms is None:
+            continue
+        # anomaly check (salva eventuale anomalia e notifica)
+        evaluate(uname, sensor, [(ts_ms, val)])
+
+
+def _tail_step(uname, states):
+    """Un giro in modalità tail. Ritorna il numero di righe lette."""
+    got = 0
+    for sensor, st in states.items():
+        if st['f'] is None:
+            if not _open(st):
+                continue
+        batch = []
+        while len(batch) < config.FEEDER_TAIL_BATCH:
+            line = _next_line(st, partial_ok=False)
+            if line is None:
+                break
+            parsed = parse_line(sensor, line)
+            if parsed is not None:
+                ts, val, axes = parsed
+                batch.append((uname, sensor, ts, val, axes))
+        if batch:
+            got += len(batch)
+            st['last_ts'] = to_epoch_ms(batch[-1][2])
+            # solo le righe nuove: dopo un riavvio dal checkpoint o una rotazione il file
+            # può ripresentare righe già salvate, che non devono ripassare dai rilevatori
+            new_rows = ingest_batch(batch, return_rows=True)['rows']
+            if new_rows:
+                evaluate(uname, sensor, [(t, v) for _, _, t, v in new_rows])
+        elif _rotated(st):
+            print('[FEEDER] file troncato o ruotato, riparto dall\'inizio:', st['path'])
+            _close(st)
+            _open(st)
+    return got
+
+
+def _run_feeder(uname, folder, stop_event):
+    tail = config.FEEDER_MODE == 'tail'
+    print('[FEEDER] start for', uname, 'folder', folder, '(tail)' if tail else '')
+    # Lettori CSV: formato per sensore in ingest.parse_line (acc a 3 assi)
+    checkpoints = _load_checkpoints(uname)
+    states = {}
+    for sensor, fname in CSV_FILES.items():
+        st = {'path': os.path.join(folder, fname), 'f': None, 'pos': 0,
+              'last_ts': None, 'inode': None, 'dirty': False}
+        if _open(st, checkpoints.get(sensor)) or tail:
+            states[sensor] = st
+
+    try:
+        while not stop_event.is_set():
+            if tail:
+                got = _tail_step(uname, states)
+                _save_checkpoints(uname, states)
+                if not got:
+                    stop_event.wait(config.FEEDER_TAIL_POLL_SEC)
+            else:
+                _replay_step(uname, states)
+                _save_checkpoints(uname, states)
+                stop_event.wait(config.FEED_INTERVAL_SEC)
+    finally:
+        try:
+            _save_checkpoints(uname, states)
+            detectors.flush(force=True)
+        except Exception as e:
+            print('[FEEDER][WARN] checkpoint:', e)
+        for st in states.values():
+            _close(st)
+        metrics.discard('feeder_backlog_bytes', username=uname)
+        metrics.discard('feeder_lag_seconds', username=uname)
+        print('[FEEDER] stop for', uname)
+
+
+def _start_local(uname, folder):
+    t = _threads.get(uname)
+    if t and t.is_alive():
+        return
+    ev = threading.Event()
+    t = threading.Thread(target=_run_feeder, args=(uname, folder, ev), daemon=True,
+                         name=f'feeder-{uname}')
+    _stop[uname] = ev
+    _threads[uname] = t
+    t.start()
+
+
+def _stop_local(uname=None):
+    for u in ([uname] if uname else list(_stop.keys())):
+        ev = _stop.get(u)
+        if ev:
+            ev.set()
+
+
+def _reconcile():
+    """Allinea i thread locali allo stato desiderato in feeder_control."""
+    rows = query_all('SELECT username, folder, desired FROM feeder_control')
+    for r in rows:
+        if r['desired'] == 'run':
+            _start_local(r['username'], r['folder'])
+        else:
+            _stop_local(r['username'])
+
+
+def _supervise():
+    leader = False
+    while True:
+        try:
+            is_leader = coord.try_acquire_lease(LEASE_NAME, config.FEEDER_LEASE_TTL_SEC)
+            if is_leader:
+                if not leader:
+                    print('[FEEDER] supervisor leader:', coord.worker_id())
+                _reconcile()
+            elif leader:
+                print('[FEEDER] leadership persa, stop feeder locali')
+                _stop_local()
+            leader = is_leader
+        except Exception as e:
+            print('[FEEDER][WARN] supervisor:', e)
+        time.sleep(config.FEEDER_POLL_SEC)
+
+
+def start_supervisor():
+    """Avvia (una volta per processo) il thread supervisore dei feeder."""
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is not None and _supervisor.is_alive():
+            return _supervisor
+        _supervisor = threading.Thread(target=_supervise, daemon=True, name='feeder-supervisor')
+        _supervisor.start()
+        return _supervisor
+
+
+def status():
+    """Stato desiderato dei feeder e leader attuale (per la pagina admin)."""
+    return {
+        'leader': coord.lease_owner(LEASE_NAME),
+        'feeders': query_all(
+            'SELECT c.username, c.desired, c.updated_at, MAX(k.last_ts) AS last_ts '
+            'FROM feeder_control c LEFT JOIN feeder_checkpoints k ON k.username = c.username '
+            'GROUP BY c.username ORDER BY c.username'
+        ),
+    }
@@ -2,17 +2,16 @@ import os
 import time
 import threading
 import json
-from google.cloud import firestore
-from google.oauth2 import service_account
-
-# Per compatibilità con firebase_admin (se necessario)
-try:
-    import firebase_admin
-    from firebase_admin import credentials as fb_credentials
-    from firebase_admin import firestore as fb_firestore
-    FIREBASE_ADMIN_AVAILABLE = True
-except ImportError:
-    FIREBASE_ADMIN_AVAILABLE = False
+import importlib.util
+
+import config
+import metrics
+
+# google-cloud-firestore e firebase_admin sono pesanti da importare (grpc, protobuf):
+# vengono caricati solo al primo uso reale del client, non all'import del modulo.
+# Qui verifichiamo solo la presenza di firebase_admin, senza importarlo.
+FIREBASE_ADMIN_AVAILABLE = importlib.util.find_spec('firebase_admin') is not None
+if not FIREBASE_ADMIN_AVAILABLE:
     print("[FS][WARN] firebase_admin not available, using google-cloud-firestore only")
 
 _fs_lock = threading.Lock()
@@ -21,6 +20,8 @@ _fs_client = None
 
 def get_credentials():
     """Get Google credentials from environment variable or local file"""
+    from google.oauth2 import service_account
+
     if os.environ.get('GOOGLE_CREDENTIALS'):
         # Cloud: usa la variabile d'ambiente
         try:
@@ -52,6 +53,10 @@ def _init_client():
     with _fs_lock:
         if _fs_client is not None:
             return _fs_client
+        if not config.FIRESTORE_SYNC:
+            raise RuntimeError('Firestore disattivato (FIRESTORE_SYNC=0)')
+
+        from google.cloud import firestore
 
         # Ottieni project ID dall'ambiente o usa default
         project_id = os.environ.get('GOOGLE_CLOUD_PROJECT', 'strong-charge-465917-k4')
@@ -106,7 +111,11 @@ def fs_get_user_email(username: str):
     2) poi query su collection('users') where username == <username>
     Cerca i campi: 'alert_email', 'email', 'mail'.
     """
-    db = fs()
+    try:
+        db = fs()
+    except Exception as e:
+        print(f"[FS][WARN] fs_get_user_email: client non disponibile: {e}")
+        return None
 
     # 1) Prova doc id = username su collezioni plausibili
     for col in ("users", "profiles", "utenti"):
@@ -146,8 +155,8 @@ def fs_get_alert_extras():
     Se non trovate, torna [].
     Accetta anche stringa CSV nel campo 'emails' o 'recipients'.
     """
-    db = fs()
     try:
+        db = fs()
         snap = db.collection("settings").document("alerts").get()
         if snap.exists:
             data = snap.to_dict() or {}
@@ -169,6 +178,8 @@ def fs_get_alert_extras():
 # ---------- Users ----------
 def fs_upsert_user(username, email, role, created_at=None):
     """Crea o aggiorna un utente"""
+    if not config.FIRESTORE_SYNC:
+        return
     db = fs()
     doc = {
         "username": username,
@@ -188,6 +199,8 @@ def fs_upsert_user(username, email, role, created_at=None):
 
 def fs_delete_user(username):
     """Elimina un utente"""
+    if not config.FIRESTORE_SYNC:
+        return
     db = fs()
     print(f'[FS][DELETE][user] {username}')
     try:
@@ -234,6 +247,8 @@ def fs_list_users():
 # ---------- Readings ----------
 def fs_add_reading(username, sensor, timestamp, value):
     """Aggiunge una lettura sensore"""
+    if not config.FIRESTORE_SYNC:
+        return
     db = fs()
     data = {
         "username": username,
@@ -242,17 +257,50 @@ def fs_add_reading(username, sensor, timestamp, value):
         "value": float(value),
         "created_at": time.time()
     }
-    print(f'[FS][ADD][reading] {username}/{sensor}: {value}')
     try:
-        db.collection("readings").add(data)
-        print('[FS][SUCCESS] Reading added')
+        # doc-id deterministico: un reinvio sovrascrive invece di duplicare
+        # (niente print per ogni lettura: conteggi e tempi in metrics, /metrics)
+        with metrics.timer('firestore_seconds', outcome=True, op='add_reading'):
+            db.collection("readings").document(_reading_doc_id(username, sensor, timestamp)).set(data)
     except Exception as e:
         print(f'[FS][ERROR] Failed to add reading: {e}')
         raise
 
 
+def _reading_doc_id(username, sensor, timestamp):
+    return f"{username}_{sensor}_{int(float(timestamp))}"
+
+
+def fs_add_readings(readings):
+    """Aggiunge più letture (username, sensor, timestamp, value) con batch write da max 500 documenti"""
+    if not config.FIRESTORE_SYNC:
+        return
+    db = fs()
+    col = db.collection("readings")
+    now = time.time()
+    total = 0
+    try:
+        for i in range(0, len(readings), 500):
+            batch = db.batch()
+            for username, sensor, timestamp, value in readings[i:i + 500]:
+                batch.set(col.document(_reading_doc_id(username, sensor, timestamp)), {
+                    "username": username,
+                    "sensor": sensor,
+                    "timestamp": float(timestamp),
+                    "value": float(value),
+                    "created_at": now
+                })
+            with metrics.timer('firestore_seconds', outcome=True, op='add_readings'):
+                batch.commit()
+            total += len(readings[i:i + 500])
+    except Exception as e:
+        print(f'[FS][ERROR] Failed to add readings batch: {e}')
+        raise
+
+
 def fs_get_readings(username, sensor=None, limit=100):
     """Ottiene le letture di un utente"""
+    from google.cloud import firestore
     db = fs()
     try:
         query = db.collection("readings").where("username", "==", username)
@@ -276,6 +324,8 @@ def fs_get_readings(username, sensor=None, limit=100):
 # ---------- Anomalies ----------
 def fs_add_anomaly(username, sensor, timestamp, value, threshold, window):
     """Aggiunge un'anomalia rilevata"""
+    if not config.FIRESTORE_SYNC:
+        return
     db = fs()
     data = {
         "username": username,
@@ -286,10 +336,9 @@ def fs_add_anomaly(username, sensor, timestamp, value, threshold, window):
         "window": int(window),
         "created_at": time.time()
     }
-    print(f'[FS][ADD][anomaly] {username}/{sensor}: {value} (threshold: {threshold})')
     try:
-        db.collection("anomalies").add(data)
-        print('[FS][SUCCESS] Anomaly added')
+        with metrics.timer('firestore_seconds', outcome=True, op='add_anomaly'):
+            db.collection("anomalies").add(data)
     except Exception as e:
         print(f'[FS][ERROR] Failed to add anomaly: {e}')
         raise
@@ -297,6 +346,7 @@ def fs_add_anomaly(username, sensor, timestamp, value, threshold, window):
 
 def fs_get_anomalies(username=None, limit=50):
     """Ottiene le anomalie"""
+    from google.cloud import firestore
     db = fs()
     try:
         query = db.collection("anomalies")
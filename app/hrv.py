@@ -0,0 +1,162 @@
+"""
+HRV (variabilità della frequenza cardiaca) dagli intervalli IBI del braccialetto.
+
+Per finestre di config.HRV_WINDOW_SEC secondi che avanzano di HRV_STEP_SEC
+(inizio allineato alla griglia dei passi, in ms epoch):
+  - dominio del tempo: RMSSD, SDNN, pNN50 e HR media, con somme cumulative:
+    tutte le finestre di una giornata in poche operazioni NumPy
+  - dominio della frequenza: potenza LF (0.04-0.15 Hz), HF (0.15-0.4 Hz) e LF/HF
+    dal tacogramma ricampionato a 4 Hz (np.interp), finestra di Hann e np.fft.rfft
+    su tutte le finestre insieme (niente SciPy)
+
+Gli IBI sono salvati in secondi (ingest.parse_line); qui si lavora in ms.
+RMSSD e pNN50 usano solo coppie di battiti consecutivi: l'E4 scarta i battiti
+con artefatti e la differenza tra due IBI separati da un buco non ha senso.
+Le finestre con troppo pochi battiti (HRV_MIN_BEATS, HRV_MIN_COVERAGE) non
+producono valori; LF/HF richiedono una copertura più alta (HRV_MIN_COVERAGE_FREQ)
+perché l'interpolazione sui buchi altera lo spettro.
+
+I risultati sono salvati in `derived_features` (derived.py): /analytics li legge
+senza ricalcolarli.
+"""
+import config
+
+FS_HZ = 4.0
+LF_BAND = (0.04, 0.15)
+HF_BAND = (0.15, 0.40)
+
+FEATURES = ('hrv_rmssd', 'hrv_sdnn', 'hrv_pnn50', 'hrv_hr', 'hrv_lf', 'hrv_hf', 'hrv_lf_hf')
+
+
+def _window_starts(ts, win, step, start_ms, end_ms):
+    import numpy as np
+    lo = int(ts[0]) - win + 1 if start_ms is None else int(start_ms)
+    hi = int(ts[-1]) if end_ms is None else int(end_ms)
+    first = -(-lo // step) * step          # primo multiplo del passo >= lo
+    return np.arange(first, hi + 1, step, dtype=np.int64)
+
+
+def _spectral(ts, rr, ws, win, ok):
+    """Potenze LF/HF (ms²) per le finestre `ws` con ok=True; NaN altrove."""
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    lf = np.full(ws.size, np.nan)
+    hf = np.full(ws.size, np.nan)
+    dt_ms = 1000.0 / FS_HZ
+    n = int(win / dt_ms)
+    # griglia assoluta (multipli di dt in ms epoch): stessi campioni in diretta e in blocco
+    origin = -(-int(ts[0]) // int(dt_ms)) * int(dt_ms)
+    grid = np.arange(origin, ts[-1] + 1, dt_ms)
+    if grid.size < n or not ok.any():
+        return lf, hf
+    tach = np.interp(grid, ts, rr)
+
+    # finestra interamente dentro il tacogramma
+    g0 = np.ceil((ws - origin) / dt_ms).astype(np.int64)
+    sel = ok & (g0 >= 0) & (g0 + n <= grid.size)
+    if not sel.any():
+        return lf, hf
+    mat = sliding_window_view(tach, n)[g0[sel]]
+    mat = mat - mat.mean(axis=1, keepdims=True)
+    w = np.hanning(n)
+    spec = np.abs(np.fft.rfft(mat * w, axis=1)) ** 2 * (2.0 / (FS_HZ * np.sum(w * w)))
+    f = np.fft.rfftfreq(n, 1.0 / FS_HZ)
+    df = f[1] - f[0]
+    lf[sel] = spec[:, (f >= LF_BAND[0]) & (f < LF_BAND[1])].sum(axis=1) * df
+    hf[sel] = spec[:, (f >= HF_BAND[0]) & (f < HF_BAND[1])].sum(axis=1) * df
+    return lf, hf
+
+
+def compute(ts_ms, rr_ms, start_ms=None, end_ms=None, window_sec=None, step_sec=None):
+    """
+    HRV su tutte le finestre che iniziano in [start_ms, end_ms] (default: tutte quelle
+    che contengono almeno un battito). Ritorna (window_starts, {feature: valori}) con
+    NaN dove la finestra non ha dati sufficienti.
+    """
+    import numpy as np
+
+    win = int((window_sec or config.HRV_WINDOW_SEC) * 1000)
+    step = int((step_sec or config.HRV_STEP_SEC) * 1000)
+    ts = np.asarray(ts_ms, dtype=np.int64)
+    rr = np.asarray(rr_ms, dtype=float)
+    if ts.size < 2:
+        return np.empty(0, dtype=np.int64), {f: np.empty(0) for f in FEATURES}
+    order = np.argsort(ts, kind='stable')
+    ts, rr = ts[order], rr[order]
+
+    ws = _window_starts(ts, win, step, start_ms, end_ms)
+    i0 = np.searchsorted(ts, ws, 'left')
+    i1 = np.searchsorted(ts, ws + win, 'left')
+    nb = (i1 - i0).astype(float)
+
+    # media e SDNN da somme cumulative (valori centrati: niente cancellazione numerica)
+    mu = rr.mean()
+    c1 = np.concatenate(([0.0], np.cumsum(rr - mu)))
+    c2 = np.concatenate(([0.0], np.cumsum((rr - mu) ** 2)))
+    s1 = c1[i1] - c1[i0]
+    s2 = c2[i1] - c2[i0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = s1 / nb + mu
+        sdnn = np.sqrt(np.maximum(s2 - s1 * s1 / nb, 0.0) / (nb - 1))
+
+        # coppie (k, k+1) di battiti consecutivi: il secondo arriva dopo circa un IBI
+        d = np.diff(rr)
+        consec = np.abs(np.diff(ts) - rr[1:]) <= 0.2 * rr[1:]
+        pc = np.concatenate(([0], np.cumsum(consec)))
+        pq = np.concatenate(([0.0], np.cumsum(np.where(consec, d * d, 0.0))))
+        p50 = np.concatenate(([0], np.cumsum(consec & (np.abs(d) > 50.0))))
+        # coppie con entrambi i battiti nella finestra (i0 = n: finestra dopo l'ultimo battito)
+        k0 = np.minimum(i0, ts.size - 1)
+        j1 = np.maximum(i1 - 1, k0)
+        npairs = (pc[j1] - pc[k0]).astype(float)
+        rmssd = np.sqrt((pq[j1] - pq[k0]) / npairs)
+        pnn50 = 100.0 * (p50[j1] - p50[k0]) / npairs
+
+        coverage = (s1 + nb * mu) / win
+        ok = (nb >= config.HRV_MIN_BEATS) & (coverage >= config.HRV_MIN_COVERAGE)
+        lf, hf = _spectral(ts, rr, ws, win, ok & (coverage >= config.HRV_MIN_COVERAGE_FREQ))
+        out = {
+            'hrv_rmssd': np.where(ok & (npairs >= 2), rmssd, np.nan),
+            'hrv_sdnn': np.where(ok, sdnn, np.nan),
+            'hrv_pnn50': np.where(ok & (npairs >= 2), pnn50, np.nan),
+            'hrv_hr': np.where(ok, 60000.0 / mean, np.nan),
+            'hrv_lf': lf,
+            'hrv_hf': hf,
+            'hrv_lf_hf': lf / hf,
+        }
+    return ws, out
+
+
+def compute_range(username, start_ms, end_ms):
+    """Ricalcola e salva le finestre HRV che si sovrappongono a [start_ms, end_ms]. Ritorna le finestre salvate."""
+    import derived
+    import tsblocks
+
+    win = int(config.HRV_WINDOW_SEC * 1000)
+    ts, vals = tsblocks.read_arrays(username, 'ibi', int(start_ms) - win, int(end_ms) + win - 1)
+    if ts.size < 2:
+        return 0
+    ws, feats = compute(ts, vals * 1000.0, int(start_ms) - win + 1, int(end_ms))
+    return derived.upsert(username, config.HRV_WINDOW_SEC, ws, feats)
+
+
+_last_step = {}
+
+
+def update_live(username, samples):
+    """
+    Aggiornamento incrementale dopo nuove letture IBI [(ts_ms, s)]: quando i battiti
+    entrano in un nuovo passo ricalcola solo le finestre che contengono il passo appena
+    chiuso (HRV_WINDOW_SEC / HRV_STEP_SEC finestre, pochi battiti ciascuna).
+    """
+    if not samples:
+        return 0
+    step = int(config.HRV_STEP_SEC * 1000)
+    cur = max(int(t) for t, _ in samples) // step
+    prev = _last_step.get(username)
+    if prev is not None and cur <= prev:
+        return 0
+    _last_step[username] = cur
+    start = (prev if prev is not None else cur - 1) * step
+    return compute_range(username, start, cur * step - 1)
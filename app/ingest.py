@@ -0,0 +1,183 @@
+"""
+Parsing e inserimento delle letture E4, condivisi da feeder, API e import bulk.
+
+Formati CSV attesi in data_samples/<username>/ (header sulla prima riga):
+  - acc:  timestamp, ax, ay, az   -> 3 assi in g + magnitudo sqrt(ax²+ay²+az²) come `value`
+  - ibi:  timestamp, duration     -> duration (ms) convertita in secondi (anche dall'API:
+          un valore oltre IBI_MS_ABOVE è in ms, nessun intervallo tra battiti dura tanto)
+  - bvp/eda/hr/temp: timestamp, valore
+
+Tutti i timestamp vengono normalizzati qui, una volta sola, in epoch millisecondi
+interi (to_epoch_ms): nel DB non si indovina più l'unità in lettura.
+"""
+import math, time
+
+import config
+import metrics
+from db import exec_write_count, transaction
+
+IBI_MS_ABOVE = 10.0     # secondi
+
+CSV_FILES = {
+    'acc':  'wrist_acc.csv',
+    'bvp':  'wrist_bvp.csv',
+    'eda':  'wrist_eda.csv',
+    'hr':   'wrist_hr.csv',
+    'ibi':  'wrist_ibi.csv',
+    'temp': 'wrist_skin_temperature.csv',
+}
+
+
+def to_epoch_ms(ts):
+    """
+    Epoch in millisecondi interi. Accetta secondi, millisecondi o microsecondi
+    (scalari o array NumPy); le soglie distinguono le unità per date dal 1973 in poi.
+    """
+    if isinstance(ts, (int, float, str)):
+        t = float(ts)
+        if t > 1e14:
+            t /= 1000.0
+        elif t <= 1e11:
+            t *= 1000.0
+        return int(round(t))
+    import numpy as np
+    t = np.asarray(ts, dtype=float)
+    t = np.where(t > 1e14, t / 1000.0, np.where(t > 1e11, t, t * 1000.0))
+    return np.rint(t).astype(np.int64)
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def acc_magnitude(ax, ay, az):
+    """
+    Magnitudo dell'accelerazione. Accetta scalari o array NumPy (calcolo vettoriale
+    per i percorsi bulk); per gli scalari evita di importare NumPy.
+    """
+    if isinstance(ax, (int, float)):
+        return math.sqrt(ax * ax + ay * ay + az * az)
+    import numpy as np
+    ax, ay, az = (np.asarray(a, dtype=float) for a in (ax, ay, az))
+    return np.sqrt(ax * ax + ay * ay + az * az)
+
+
+def parse_line(sensor, line):
+    """
+    Converte una riga CSV in (timestamp, value, axes) con axes=(ax, ay, az) solo per acc.
+    Accetta anche righe "value" senza timestamp (usa time.time()). Ritorna None se illeggibile.
+    """
+    parts = line.strip().split(',')
+    if not parts or parts == ['']:
+        return None
+    try:
+        if sensor == 'acc' and len(parts) >= 4:
+            ax, ay, az = float(parts[1]), float(parts[2]), float(parts[3])
+            return float(parts[0]), acc_magnitude(ax, ay, az), (ax, ay, az)
+        if len(parts) >= 2:
+            ts, val = float(parts[0]), float(parts[1])
+        else:
+            ts, val = time.time(), float(parts[0])
+    except ValueError:
+        try:
+            ts, val = time.time(), float(parts[-1])
+        except ValueError:
+            return None
+    if sensor == 'ibi':
+        val = val / 1000.0  # durata IBI in ms nei CSV E4 -> secondi (come THRESHOLDS['ibi'])
+    return ts, val, None
+
+
+def parse_reading(data):
+    """Dict JSON dell'API -> (username, sensor, ts, value, axes). ValueError se il sensore non è valido."""
+    username = data.get('username')
+    sensor = data.get('sensor')
+    ts = data.get('timestamp', time.time())  # s, ms o µs: normalizzato all'ingest
+
+    if sensor not in config.SENSORS:
+        raise ValueError('bad sensor')
+
+    # acc: se arrivano i 3 assi, value = magnitudo calcolata qui (anomalie sulla magnitudo)
+    axes = None
+    if sensor == 'acc' and all(data.get(k) is not None for k in ('ax', 'ay', 'az')):
+        axes = (float(data['ax']), float(data['ay']), float(data['az']))
+        val = acc_magnitude(*axes)
+    else:
+        val = float(data.get('value'))
+        if sensor == 'ibi' and val > IBI_MS_ABOVE:
+            val = val / 1000.0  # client che inviano ancora la durata in ms
+    return username, sensor, ts, val, axes
+
+
+# Le letture già coperte dalla compattazione (compacted_until, vedi compactor.py) vengono
+# scartate come i duplicati: un reimport non le conta una seconda volta in rollup e blocchi.
+_INSERT_SQL = ('INSERT OR IGNORE INTO readings(username,sensor,timestamp,value,ax,ay,az) '
+               'SELECT ?1,?2,?3,?4,?5,?6,?7 WHERE NOT EXISTS ('
+               'SELECT 1 FROM compacted_until WHERE username=?1 AND sensor=?2 AND ts>=?3)')
+
+
+def insert_reading(username, sensor, ts, value, axes=None):
+    """
+    Inserisce una lettura con timestamp normalizzato (ms interi); per acc salva
+    anche i tre assi nella stessa riga. Idempotente sulla chiave
+    (username, sensor, timestamp): ritorna il timestamp salvato, None se duplicata
+    o più vecchia della parte già compattata dello stream.
+    """
+    ts_ms = to_epoch_ms(ts)
+    ax, ay, az = axes if axes else (None, None, None)
+    n = exec_write_count(_INSERT_SQL, (username, sensor, ts_ms, value, ax, ay, az))
+    metrics.inc('ingest_readings_total', sensor=sensor)
+    if n:
+        metrics.inc('ingest_inserted_total', sensor=sensor)
+    return ts_ms if n else None
+
+
+def ingest_batch(readings, device_id=None, seq=None, return_rows=False):
+    """
+    Inserisce un batch di letture (username, sensor, ts, value, axes) in una transazione.
+
+    - Duplicati (stessa chiave username/sensor/timestamp) ignorati: reinviare è sicuro.
+      Lo stesso vale per le letture già compattate (timestamp <= compacted_until).
+    - Con device_id+seq: se seq <= ultimo seq confermato per il dispositivo il batch
+      è già stato ricevuto e viene confermato senza toccare `readings`.
+      I batch di un dispositivo vanno inviati in ordine di seq.
+
+    Ritorna {'inserted': n, 'duplicate': bool, 'touched': {(username, sensor), ...}};
+    con return_rows anche 'rows': le sole letture inserite davvero [(username, sensor, ts_ms, value)],
+    da passare a rilevatori e Firestore (un reinvio parziale non le conta due volte).
+    """
+    rows = []
+    touched = set()
+    for username, sensor, ts, value, axes in readings:
+        ax, ay, az = axes if axes else (None, None, None)
+        rows.append((username, sensor, to_epoch_ms(ts), value, ax, ay, az))
+        touched.add((username, sensor))
+
+    with transaction() as con:
+        con.execute('BEGIN IMMEDIATE')  # lettura + aggiornamento di last_seq atomici tra processi
+        if device_id is not None and seq is not None:
+            row = con.execute('SELECT last_seq FROM ingest_seq WHERE device_id=?', (device_id,)).fetchall()
+            if row and row[0][0] is not None and int(seq) <= row[0][0]:
+                return {'inserted': 0, 'duplicate': True, 'touched': set(), 'rows': []}
+        # id AUTOINCREMENT e lock di scrittura tenuto: le righe nuove sono quelle con id > last_id
+        last_id = (con.execute('SELECT MAX(id) FROM readings').fetchall()[0][0] or 0) if return_rows else 0
+        counts = {}                            # sensore -> (ricevute, nuove), per le metriche
+        for sensor in dict.fromkeys(r[1] for r in rows):
+            part = [r for r in rows if r[1] == sensor]
+            before = con.total_changes
+            con.executemany(_INSERT_SQL, part)
+            counts[sensor] = (len(part), con.total_changes - before)
+        inserted = sum(new for _, new in counts.values())
+        new_rows = con.execute(
+            'SELECT username, sensor, timestamp, value FROM readings WHERE id > ? ORDER BY id', (last_id,)
+        ).fetchall() if return_rows and inserted else []
+        if device_id is not None and seq is not None:
+            con.execute(
+                'INSERT INTO ingest_seq(device_id, last_seq, updated_at) VALUES(?,?,?) '
+                'ON CONFLICT(device_id) DO UPDATE SET last_seq=excluded.last_seq, updated_at=excluded.updated_at',
+                (device_id, int(seq), time.time())
+            )
+    for sensor, (received, new) in counts.items():
+        metrics.inc('ingest_readings_total', received, sensor=sensor)
+        metrics.inc('ingest_inserted_total', new, sensor=sensor)
+    return {'inserted': inserted, 'duplicate': False, 'touched': touched, 'rows': new_rows}
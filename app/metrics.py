@@ -0,0 +1,192 @@
+"""
+Metriche del processo in formato testo Prometheus (endpoint /metrics).
+
+Contatori, gauge e istogrammi con etichette, tenuti in memoria senza dipendenze:
+ogni aggiornamento è un lock e qualche operazione su dict (1-3 µs), quindi le
+metriche restano attive anche in produzione (METRICS_ENABLED=0 le spegne).
+
+    metrics.inc('ingest_readings_total', sensor='hr')
+    with metrics.timer('db_seconds', op='query'):
+        ...
+
+Le metriche sono del processo che risponde: con gunicorn ogni worker ha le sue
+(l'etichetta `worker` sulle serie le distingue, vedi coord.worker_id).
+Per valori che esistono già altrove (render.stats, pagecache.stats) si registra un
+collector, letto solo al momento dello scrape.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+import config
+
+PREFIX = 'healthmon_'
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# nome -> (tipo, descrizione, bucket)
+_DEFS = {
+    'ingest_readings_total': ('counter', 'Letture ricevute per sensore (nuove + duplicate)', None),
+    'ingest_inserted_total': ('counter', 'Letture nuove salvate per sensore', None),
+    'db_seconds': ('histogram', 'Durata delle operazioni SQLite, attesa del lock di scrittura compresa', None),
+    'firestore_seconds': ('histogram', 'Durata delle scritture su Firestore', None),
+    'email_seconds': ('histogram', 'Durata dell\'invio email', None),
+    'evaluate_seconds': ('histogram', 'Durata di analytics.evaluate (movimento, feature derivate, rilevatore)', None),
+    'anomalies_total': ('counter', 'Anomalie registrate per sensore e rilevatore', None),
+    'plot_render_seconds': ('histogram', 'Durata del rendering dei grafici vista dalla richiesta', None),
+    'feeder_lag_seconds': ('gauge', 'Ritardo tra ora e timestamp dell\'ultima lettura inserita dal feeder (modalità tail)', None),
+    'feeder_backlog_bytes': ('gauge', 'Byte del CSV non ancora letti dal feeder', None),
+    'http_requests_total': ('counter', 'Richieste HTTP per endpoint e codice di stato', None),
+    'http_request_seconds': ('histogram', 'Durata delle richieste HTTP per endpoint', None),
+}
+
+_lock = threading.Lock()
+_values = {}          # nome -> {etichette: valore | [conteggi per bucket..., somma, conteggio]}
+_collectors = []      # funzioni () -> [(nome, tipo, descrizione, [(etichette dict, valore)])]
+_start = time.time()
+
+
+def _key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def inc(name, value=1, **labels):
+    if not config.METRICS_ENABLED:
+        return
+    key = _key(labels)
+    with _lock:
+        series = _values.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    if not config.METRICS_ENABLED:
+        return
+    key = _key(labels)
+    with _lock:
+        _values.setdefault(name, {})[key] = value
+
+
+def observe(name, value, **labels):
+    """Aggiunge un'osservazione (secondi) all'istogramma `name`."""
+    if not config.METRICS_ENABLED:
+        return
+    buckets = _DEFS[name][2] or DEFAULT_BUCKETS
+    key = _key(labels)
+    i = bisect_left(buckets, value)
+    with _lock:
+        series = _values.setdefault(name, {})
+        h = series.get(key)
+        if h is None:
+            h = series[key] = [0] * (len(buckets) + 2)
+        if i < len(buckets):
+            h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+
+class timer:
+    """
+    Context manager che osserva la durata del blocco nell'istogramma `name`.
+    Con outcome=True aggiunge l'etichetta outcome='ok' / 'error' (eccezione nel blocco).
+    """
+    __slots__ = ('name', 'labels', 'outcome', 't0')
+
+    def __init__(self, name, outcome=False, **labels):
+        self.name = name
+        self.labels = labels
+        self.outcome = outcome
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.t0
+        if self.outcome:
+            observe(self.name, elapsed, outcome='error' if exc_type else 'ok', **self.labels)
+        else:
+            observe(self.name, elapsed, **self.labels)
+        return False
+
+
+def discard(name, **labels):
+    """Rimuove le serie di `name` con queste etichette (es. gauge di un feeder fermato)."""
+    match = set(labels.items())
+    with _lock:
+        series = _values.get(name, {})
+        for key in [k for k in series if match <= set(k)]:
+            del series[key]
+
+
+def collector(fn):
+    """Registra una funzione letta a ogni scrape (valori calcolati altrove)."""
+    _collectors.append(fn)
+    return fn
+
+
+def _fmt_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ''
+    esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in items) + '}'
+
+
+def _fmt_value(v):
+    if v is None:
+        return 'NaN'
+    if isinstance(v, bool):
+        return '1' if v else '0'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render():
+    """Testo in formato di esposizione Prometheus (text/plain; version=0.0.4)."""
+    import coord
+    worker = (('worker', coord.worker_id()),)
+    out = []
+    with _lock:
+        snapshot = {name: {k: (list(v) if isinstance(v, list) else v) for k, v in series.items()}
+                    for name, series in _values.items()}
+
+    for name, (kind, help_, buckets) in _DEFS.items():
+        series = snapshot.get(name)
+        if not series:
+            continue
+        full = PREFIX + name
+        out.append(f'# HELP {full} {help_}')
+        out.append(f'# TYPE {full} {kind}')
+        for key, v in sorted(series.items()):
+            if kind != 'histogram':
+                out.append(f'{full}{_fmt_labels(key, worker)} {_fmt_value(v)}')
+                continue
+            cum = 0
+            for le, n in zip(buckets or DEFAULT_BUCKETS, v):
+                cum += n
+                out.append(f'{full}_bucket{_fmt_labels(key, worker + (("le", le),))} {cum}')
+            out.append(f'{full}_bucket{_fmt_labels(key, worker + (("le", "+Inf"),))} {v[-1]}')
+            out.append(f'{full}_sum{_fmt_labels(key, worker)} {_fmt_value(v[-2])}')
+            out.append(f'{full}_count{_fmt_labels(key, worker)} {v[-1]}')
+
+    for fn in _collectors:
+        try:
+            families = fn()
+        except Exception as e:
+            print('[METRICS][WARN] collector', getattr(fn, '__name__', fn), e)
+            continue
+        for name, kind, help_, samples in families:
+            full = PREFIX + name
+            out.append(f'# HELP {full} {help_}')
+            out.append(f'# TYPE {full} {kind}')
+            for labels, v in samples:
+                out.append(f'{full}{_fmt_labels(_key(labels), worker)} {_fmt_value(v)}')
+
+    out.append(f'# HELP {PREFIX}process_start_time_seconds Avvio del processo (epoch)')
+    out.append(f'# TYPE {PREFIX}process_start_time_seconds gauge')
+    out.append(f'{PREFIX}process_start_time_seconds{_fmt_labels((), worker)} {_start}')
+    return '\n'.join(out) + '\n'
+
+
+def reset():
+    with _lock:
+        _values.clear()
@@ -0,0 +1,80 @@
+"""
+Livello di movimento per utente dall'accelerometro, per smorzare gli allarmi fisiologici.
+
+Durante l'attività fisica HR ed EDA salgono normalmente: un allarme su questi sensori
+(config.MOTION_SENSORS) mentre l'utente si muove è quasi sempre un falso positivo.
+Il livello di attività è la media di |magnitudo - 1 g| sugli ultimi MOTION_WINDOW_SEC
+secondi (≈ 0.015 g a riposo, 0.1-0.6 g camminando o correndo).
+
+  - in diretta: observe() riceve le letture ACC da analytics.evaluate e aggiorna una
+    finestra scorrevole in memoria (detectors.SlidingWindow); level() la legge senza
+    query al DB
+  - in blocco: levels_at() calcola lo stesso livello dalle letture ACC salvate, con
+    somme cumulative, per gli istanti delle anomalie ricalcolate (bulk.py, reeval.py)
+
+Con livello >= MOTION_HIGH l'allarme viene scartato (MOTION_MODE='suppress') oppure
+registrato senza email (MOTION_MODE='downrank'); il livello resta in anomalies.motion.
+"""
+import threading
+
+import config
+
+_windows = {}
+_lock = threading.Lock()
+
+
+def applies(sensor):
+    return config.MOTION_MODE != 'off' and sensor in config.MOTION_SENSORS
+
+
+def observe(username, samples):
+    """Aggiorna lo stato di movimento con nuove letture ACC [(ts_ms, magnitudo in g)]."""
+    from detectors import SlidingWindow
+    with _lock:
+        win = _windows.get(username)
+        if win is None:
+            win = _windows[username] = SlidingWindow(config.MOTION_WINDOW_SEC)
+        for ts_ms, mag in samples:
+            if mag is not None:
+                win.add(int(ts_ms), abs(mag - 1.0))
+
+
+def level(username, ts_ms):
+    """Livello di attività attorno a ts_ms, o None se l'ACC dell'utente manca o è troppo lontano nel tempo."""
+    with _lock:
+        win = _windows.get(username)
+        if win is None or not win.buckets:
+            return None
+        if abs(int(ts_ms) - win.buckets[-1][0]) > config.MOTION_MAX_AGE_SEC * 1000:
+            return None
+        return win.mean
+
+
+def levels_at(username, ts_list):
+    """Livello di attività negli istanti ts_list dalle letture ACC salvate; NaN dove manca l'ACC."""
+    import numpy as np
+    import tsblocks
+
+    q = np.asarray(ts_list, dtype=np.int64)
+    out = np.full(q.size, np.nan)
+    if not q.size:
+        return out
+    span = int(config.MOTION_WINDOW_SEC * 1000)
+    ts, vals = tsblocks.read_arrays(
+        username, 'acc', int(q.min()) - span - int(config.MOTION_MAX_AGE_SEC * 1000) + 1, int(q.max()))
+    if not ts.size:
+        return out
+    c = np.concatenate(([0.0], np.cumsum(np.abs(vals - 1.0))))
+    # come lo stato live: finestra che termina all'ultima lettura ACC non successiva all'istante
+    hi = np.searchsorted(ts, q, 'right')
+    ok = hi > 0
+    last = ts[np.maximum(hi - 1, 0)]
+    lo = np.searchsorted(ts, last - span, 'right')
+    ok &= q - last <= config.MOTION_MAX_AGE_SEC * 1000
+    out[ok] = (c[hi] - c[lo])[ok] / (hi - lo)[ok]
+    return out
+
+
+def reset():
+    with _lock:
+        _windows.clear()
@@ -0,0 +1,121 @@
+"""
+Cache delle pagine dashboard e analytics.
+
+Il contesto dei template (statistiche, anomalie, card HRV/EDA, correlazioni) è calcolato
+una volta per (pagina, utente, parametri) e riusato finché i dati non cambiano:
+  - versione dei dati = contatori AUTOINCREMENT di sqlite_sequence (readings, anomalies,
+    users): ogni inserimento li incrementa, da qualunque processo, senza scritture in più
+    nell'ingest; il numero di utenti copre le cancellazioni. Le modifiche che non inseriscono
+    righe (ricalcolo delle anomalie, compattazione nel rollup, import bulk) chiamano bump(),
+    un contatore in app_state letto con la stessa query, quindi valido per tutti i processi
+  - PAGE_CACHE_SEC limita comunque l'età: le finestre "ultimi N giorni" scorrono con l'orologio
+  - con i feeder attivi la versione cambia più volte al secondo: una pagina più giovane di
+    PAGE_CACHE_GRACE_SEC viene servita anche se nel frattempo sono arrivati dati
+  - richieste concorrenti uguali: la prima calcola, le altre aspettano il suo risultato
+
+Si tiene il contesto e non l'HTML: messaggi flash e utente nella navbar restano per richiesta.
+Con gunicorn ogni worker ha la sua cache (la versione dei dati è comune).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import config
+import metrics
+from db import query_all, exec_write
+
+_cache = OrderedDict()     # key -> (version, expires_at, value, created_at)
+_lock = threading.Lock()
+_inflight = {}             # key -> threading.Event della richiesta che sta calcolando
+_BUMP_KEY = 'pagecache_bump'   # contatore in app_state delle invalidazioni esplicite
+_stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'stale': 0, 'evictions': 0, 'compute_sec': 0.0}
+
+
+def data_version():
+    """Versione corrente dei dati: cambia a ogni lettura, anomalia o utente inserito/rimosso."""
+    rows = query_all("SELECT name, seq FROM sqlite_sequence "
+                     "WHERE name IN ('readings', 'anomalies', 'users') "
+                     "UNION ALL SELECT 'n_users', COUNT(*) FROM users "
+                     "UNION ALL SELECT key, value FROM app_state WHERE key=?", (_BUMP_KEY,))
+    return tuple(sorted((r['name'], r['seq']) for r in rows))
+
+
+def bump():
+    """Invalida le pagine di tutti i processi (modifiche che non passano dagli inserimenti)."""
+    exec_write("INSERT INTO app_state(key, value) VALUES(?, '1') "
+               "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1", (_BUMP_KEY,))
+
+
+def get_or_compute(key, compute):
+    """
+    Valore in cache per `key` se la versione dei dati è la stessa e non è scaduto,
+    altrimenti compute(). Una sola compute() alla volta per chiave.
+    """
+    if config.PAGE_CACHE_SEC <= 0:
+        return compute()
+    version = data_version()
+    waited = False
+    while True:
+        with _lock:
+            hit = _cache.get(key)
+            if hit is not None:
+                now = time.time()
+                if (hit[0] == version and hit[1] > now) or now - hit[3] < config.PAGE_CACHE_GRACE_SEC:
+                    _cache.move_to_end(key)
+                    if not waited:                  # chi ha atteso è già contato in coalesced
+                        _stats['hits'] += 1
+                    return hit[2]
+                _stats['stale'] += 1
+                del _cache[key]
+            event = _inflight.get(key)
+            if event is None:
+                event = _inflight[key] = threading.Event()
+                break
+            _stats['coalesced'] += 1
+            waited = True
+        # un'altra richiesta sta calcolando la stessa pagina: attende e riprova dalla cache
+        # (se quella fallisce, questa calcola a sua volta)
+        event.wait(config.PAGE_CACHE_WAIT_SEC)
+
+    try:
+        t0 = time.perf_counter()
+        value = compute()
+        elapsed = time.perf_counter() - t0
+        with _lock:
+            _stats['misses'] += 1
+            _stats['compute_sec'] += elapsed
+            now = time.time()
+            _cache[key] = (version, now + config.PAGE_CACHE_SEC, value, now)
+            _cache.move_to_end(key)
+            while len(_cache) > config.PAGE_CACHE_SIZE:
+                _cache.popitem(last=False)
+                _stats['evictions'] += 1
+        return value
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        event.set()
+
+
+def stats():
+    """Contatori del processo corrente (per /admin e metriche)."""
+    with _lock:
+        lookups = _stats['hits'] + _stats['misses'] + _stats['coalesced']
+        return dict(_stats, entries=len(_cache), inflight=len(_inflight),
+                    hit_ratio=round((_stats['hits'] + _stats['coalesced']) / lookups, 3) if lookups else None)
+
+
+@metrics.collector
+def _metrics():
+    s = stats()
+    return [
+        ('page_cache_lookups_total', 'counter', 'Richieste di pagine in cache per esito',
+         [({'result': k}, s[k]) for k in ('hits', 'coalesced', 'misses', 'stale')]),
+        ('page_cache_compute_seconds_total', 'counter', 'Tempo speso a calcolare le pagine', [({}, s['compute_sec'])]),
+        ('page_cache_entries', 'gauge', 'Pagine in cache', [({}, s['entries'])]),
+    ]
+
+
+def clear():
+    with _lock:
+        _cache.clear()
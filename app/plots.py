@@ -1,17 +1,9 @@
 import io
 import os
-import csv
-import math
 import re
+import threading
 import datetime as dt
-import numpy as np
-
-# Backend headless per generare immagini senza display
-import matplotlib
-matplotlib.use("Agg")
-
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+from collections import OrderedDict
 from flask import send_file, request
 
 # =========================
@@ -19,15 +11,26 @@ from flask import send_file, request
 # =========================
 UNITS = {"hr": "bpm", "temp": "°C", "eda": "µS", "bvp": "a.u.", "ibi": "s", "acc": "g"}
 
-# CSV attesi in data_samples/<username>/
-CSV_FILES = {
-    "acc":  "wrist_acc.csv",
-    "bvp":  "wrist_bvp.csv",
-    "eda":  "wrist_eda.csv",
-    "hr":   "wrist_hr.csv",
-    "ibi":  "wrist_ibi.csv",
-    "temp": "wrist_skin_temperature.csv",
-}
+# CSV attesi in config.DATA_SAMPLES_DIR/<username>/ (stessa mappa usata da feeder e ingest)
+from ingest import CSV_FILES, acc_magnitude, to_epoch_ms
+import config
+from config import SENSORS
+
+OVERVIEW_MAX_PANELS = 16
+
+# =========================
+# Import pigri (matplotlib/numpy)
+# =========================
+def _pyplot():
+    """
+    Importa matplotlib (backend headless Agg) solo al primo grafico richiesto:
+    pyplot da solo costa centinaia di ms all'avvio del server e delle CLI.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+    return plt, mdates
 
 # =========================
 # Utility generali
@@ -35,28 +38,14 @@ CSV_FILES = {
 def _downsample(xs, ys, max_points=1200):
     if len(xs) <= max_points:
         return xs, ys
+    import numpy as np
     idx = np.linspace(0, len(xs) - 1, max_points, dtype=int)
-    return [xs[i] for i in idx], [ys[i] for i in idx]
+    return xs[idx], ys[idx]
 
 def _has_labeled(ax):
     handles, labels = ax.get_legend_handles_labels()
     return any(lbl and not lbl.startswith("_") for lbl in labels)
 
-def _to_float(x):
-    if x is None or x == "" or str(x).lower() in ("nan", "none"):
-        return None
-    try:
-        return float(x)
-    except Exception:
-        return None
-
-def _normalize_epoch(ts_list):
-    """Ritorna epoch in secondi (accetta secondi o millisecondi)."""
-    xs = [float(t) for t in ts_list]
-    if xs and max(xs) > 1e12:  # valori in ms
-        xs = [t / 1000.0 for t in xs]
-    return xs
-
 def _parse_window_param():
     """
     Supporta:
@@ -100,9 +89,39 @@ def _window_bounds_from_dataset(max_dt, window: str):
 # =========================
 # Lettura CSV per sensore
 # =========================
+_csv_cache = OrderedDict()   # path -> (mtime, size, ts, vals), per processo
+_csv_lock = threading.Lock()
+CSV_CACHE_FILES = 24
+
+
 def _read_from_csv(username, sensor):
     """
-    Restituisce (timestamps_epoch_sec, values_float) dal CSV del sensore.
+    Come _load_csv, ma tiene in memoria gli ultimi CSV letti (validati con mtime e
+    dimensione): i grafici singoli e le panoramiche dello stesso utente non rileggono
+    lo stesso file. Gli array restituiti sono condivisi: non modificarli.
+    """
+    path = os.path.abspath(os.path.join(config.DATA_SAMPLES_DIR, username, CSV_FILES.get(sensor, "")))
+    try:
+        st = os.stat(path)
+    except OSError:
+        return _load_csv(path, sensor)
+    with _csv_lock:
+        hit = _csv_cache.get(path)
+        if hit is not None and hit[:2] == (st.st_mtime, st.st_size):
+            _csv_cache.move_to_end(path)
+            return hit[2], hit[3]
+    ts, vals = _load_csv(path, sensor)
+    with _csv_lock:
+        _csv_cache[path] = (st.st_mtime, st.st_size, ts, vals)
+        while len(_csv_cache) > CSV_CACHE_FILES:
+            _csv_cache.popitem(last=False)
+    return ts, vals
+
+
+def _load_csv(path, sensor):
+    """
+    Restituisce (timestamps_epoch_sec, values_float) come array NumPy dal CSV del sensore,
+    senza le righe incomplete.
       - acc: timestamp, ax, ay, az  -> magnitudo sqrt(ax^2 + ay^2 + az^2)
       - ibi: timestamp, duration    -> duration(ms) convertita in secondi
       - bvp: timestamp, bvp
@@ -110,33 +129,72 @@ def _read_from_csv(username, sensor):
       - hr : timestamp, hr
       - temp: timestamp, temp
     """
-    base = os.path.join(os.path.dirname(__file__), "..", "data_samples", username)
-    path = os.path.abspath(os.path.join(base, CSV_FILES.get(sensor, "")))
-    if not os.path.exists(path):
-        return [], []
-
-    ts, vals = [], []
-    with open(path, newline="") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            ts.append(row.get("timestamp"))
-            if sensor == "acc":
-                ax = _to_float(row.get("ax"))
-                ay = _to_float(row.get("ay"))
-                az = _to_float(row.get("az"))
-                vals.append(None if None in (ax, ay, az) else math.sqrt(ax*ax + ay*ay + az*az))
-            elif sensor == "ibi":
-                dur_ms = _to_float(row.get("duration"))
-                vals.append(None if dur_ms is None else dur_ms / 1000.0)
-            else:
-                vals.append(_to_float(row.get(sensor)))
-
-    ts = _normalize_epoch(ts)
+    import numpy as np
+    import pandas as pd
+
+    if not os.path.isfile(path):
+        return np.empty(0), np.empty(0)
+
+    cols = {"acc": ["ax", "ay", "az"], "ibi": ["duration"]}.get(sensor, [sensor])
+    df = pd.read_csv(path, usecols=lambda c: c in ["timestamp"] + cols, on_bad_lines="skip")
+    if any(c not in df.columns for c in ["timestamp"] + cols):
+        return np.empty(0), np.empty(0)
+    arr = df[["timestamp"] + cols].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    arr = arr[~np.isnan(arr).any(axis=1)]
+
+    ts = to_epoch_ms(arr[:, 0]) / 1000.0   # stessa normalizzazione dell'ingest: s, ms o µs
+    if sensor == "acc":
+        vals = acc_magnitude(arr[:, 1], arr[:, 2], arr[:, 3])
+    elif sensor == "ibi":
+        vals = arr[:, 1] / 1000.0
+    else:
+        vals = arr[:, 1]
     return ts, vals
 
 # =========================
 # Rendering helpers
 # =========================
+_FIGS = {}   # figure riusate nei processi di rendering (render.py), per forma della griglia
+
+
+def _figure(reuse=False, rows=0, sharex=False):
+    """
+    Figura e assi per un grafico singolo (rows=0) o una colonna di `rows` pannelli;
+    con reuse la stessa figura del processo per quella forma, ripulita.
+    """
+    plt, _ = _pyplot()
+
+    def new():
+        if not rows:
+            return plt.subplots(figsize=(7.2, 3.1), dpi=120)
+        height = 0.5 + 1.45 * rows
+        fig, axes = plt.subplots(rows, 1, figsize=(7.2, height), dpi=110, sharex=sharex, squeeze=False)
+        # margini fissi in pollici (titolo in alto, date in basso): niente tight_layout,
+        # che misura ogni etichetta di ogni pannello e costa quanto il disegno
+        fig.subplots_adjust(left=0.11, right=0.98, top=1 - 0.4 / height, bottom=0.45 / height,
+                            hspace=0.15 if sharex else 0.5)
+        return fig, list(axes[:, 0])
+
+    if not reuse:
+        return new()
+    key = (rows, sharex)
+    if key not in _FIGS:
+        fig, ax = new()
+        sp = fig.subplotpars
+        _FIGS[key] = (fig, ax, dict(left=sp.left, right=sp.right, bottom=sp.bottom, top=sp.top,
+                                    hspace=sp.hspace))
+    fig, ax, layout = _FIGS[key]
+    for a in (ax if rows else [ax]):
+        a.cla()
+    fig.subplots_adjust(**layout)   # tight_layout riparte dalla stessa disposizione
+    return fig, ax
+
+
+def warm():
+    """Import di matplotlib e figura pronta (initializer dei processi di rendering)."""
+    _figure(reuse=True)
+
+
 def _nodata(ax, sensor, username, msg):
     ax.set_title(f"{sensor.upper()} • {username}")
     ax.set_xlabel("tempo")
@@ -144,60 +202,72 @@ def _nodata(ax, sensor, username, msg):
     ax.text(0.5, 0.5, msg, ha="center", va="center", transform=ax.transAxes, color="#666")
     ax.grid(True, alpha=0.3)
 
-def _as_png(fig):
+def _png_bytes(fig, reuse=False, tight=True):
+    plt, _ = _pyplot()
     buf = io.BytesIO()
-    fig.tight_layout()
+    if tight:
+        fig.tight_layout()
     fig.savefig(buf, format="png")
-    plt.close(fig)
-    buf.seek(0)
-    return send_file(buf, mimetype="image/png")
+    if not reuse:
+        plt.close(fig)
+    return buf.getvalue()
 
 # =========================
-# Endpoint principale
+# Rendering
 # =========================
-def plot_user_sensor(username, sensor, last_n=200):
+def _series(username, sensor, window):
     """
-    Genera un PNG del sensore leggendo i CSV **con le date originali del CSV**.
-    - Nessuna alterazione dell'anno o delle date.
-    - Intervallo 'window' relativo alla **data massima presente nel CSV**.
+    Punti da disegnare nella finestra relativa alla data massima del CSV:
+    (xs_num, ys, shown_start, shown_end, None) oppure (..., messaggio) se non c'è nulla.
     """
-    window = _parse_window_param()
+    _, mdates = _pyplot()
+    xs_epoch, ys_all = _read_from_csv(username, sensor)
+    if not ys_all.size:
+        return None, None, None, None, "Nessun dato disponibile"
 
-    xs_epoch, ys_raw = _read_from_csv(username, sensor)
+    # Limiti finestra relativi alla data massima del dataset
+    max_dt = dt.datetime.fromtimestamp(xs_epoch.max())
+    start, end = _window_bounds_from_dataset(max_dt, window)
 
-    fig, ax = plt.subplots(figsize=(7.2, 3.1), dpi=120)
+    if start is None:  # "all"
+        keep = slice(None)
+    else:
+        keep = (xs_epoch >= start.timestamp()) & (xs_epoch <= end.timestamp())
+    xs, ys = xs_epoch[keep], ys_all[keep]
+    if not ys.size:
+        return None, None, None, None, "Nessun dato nella finestra selezionata"
 
-    if not ys_raw:
-        _nodata(ax, sensor, username, "Nessun dato disponibile")
-        return _as_png(fig)
+    # Sottocampionamento prima della conversione in date (solo i punti disegnati)
+    xs_ds, ys_ds = _downsample(xs, ys, max_points=1200)
+    xs_num_ds = mdates.date2num([dt.datetime.fromtimestamp(e) for e in xs_ds])
 
-    # Converte epoch -> datetime
-    xs_dt_all = [dt.datetime.fromtimestamp(e) for e in xs_epoch if e is not None]
-    ys_all = [v for v in ys_raw]
+    # Range mostrato (se 'all' usa minimo/massimo reali)
+    shown_start = dt.datetime.fromtimestamp(xs[0]) if window == "all" else start
+    shown_end   = dt.datetime.fromtimestamp(xs[-1]) if window == "all" else end
+    return xs_num_ds, ys_ds, shown_start, shown_end, None
 
-    # Rimuovi eventuali None sincronamente
-    xs_dt_all, ys_all = zip(*[(x, y) for x, y in zip(xs_dt_all, ys_all) if (x is not None and y is not None)])
-    xs_dt_all = list(xs_dt_all); ys_all = list(ys_all)
 
-    # Limiti finestra relativi alla data massima del dataset
-    max_dt = max(xs_dt_all)
-    start, end = _window_bounds_from_dataset(max_dt, window)
+def _range_text(ax, shown_start, shown_end, fontsize=8):
+    ax.text(1.0, 1.02,
+            f"{shown_start.strftime('%Y-%m-%d %H:%M')} → {shown_end.strftime('%Y-%m-%d %H:%M')}",
+            ha="right", va="bottom", transform=ax.transAxes, fontsize=fontsize, color="#555")
+
+
+def render_png(username, sensor, window="all", reuse=False):
+    """
+    PNG (bytes) del sensore leggendo i CSV **con le date originali del CSV**.
+    - Nessuna alterazione dell'anno o delle date.
+    - Intervallo 'window' relativo alla **data massima presente nel CSV**.
+    Non usa la richiesta Flask: gira anche nei processi di render.py.
+    """
+    plt, mdates = _pyplot()
+    fig, ax = _figure(reuse)
+
+    xs_num_ds, ys_ds, shown_start, shown_end, msg = _series(username, sensor, window)
+    if msg:
+        _nodata(ax, sensor, username, msg)
+        return _png_bytes(fig, reuse)
 
-    if start is None:  # "all"
-        xs_dt, ys = xs_dt_all, ys_all
-    else:
-        xs_dt, ys = [], []
-        for d, v in zip(xs_dt_all, ys_all):
-            if start <= d <= end:
-                xs_dt.append(d); ys.append(v)
-
-    if not ys:
-        _nodata(ax, sensor, username, "Nessun dato nella finestra selezionata")
-        return _as_png(fig)
-
-    # Plot
-    xs_num = mdates.date2num(xs_dt)
-    xs_num_ds, ys_ds = _downsample(xs_num, ys, max_points=1200)
     ax.plot_date(xs_num_ds, ys_ds, "-", linewidth=1.2, label="Valori")
 
     # Layout
@@ -208,15 +278,161 @@ def plot_user_sensor(username, sensor, last_n=200):
     ax.xaxis.set_major_locator(mdates.AutoDateLocator())
     ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m-%d %H:%M"))
     plt.setp(ax.get_xticklabels(), rotation=30, ha="right")
-
-    # Range mostrato (se 'all' usa minimo/massimo reali)
-    shown_start = xs_dt[0] if window == "all" else start
-    shown_end   = xs_dt[-1] if window == "all" else end
-    ax.text(1.0, 1.02,
-            f"{shown_start.strftime('%Y-%m-%d %H:%M')} → {shown_end.strftime('%Y-%m-%d %H:%M')}",
-            ha="right", va="bottom", transform=ax.transAxes, fontsize=8, color="#555")
+    _range_text(ax, shown_start, shown_end)
 
     if _has_labeled(ax):
         ax.legend(loc="upper left", fontsize=8, ncol=3)
 
-    return _as_png(fig)
+    return _png_bytes(fig, reuse)
+
+
+def render_overview(kind, name, window="all", usernames=None, reuse=False):
+    """
+    Small multiples in un solo PNG, una colonna di pannelli con la stessa impaginazione:
+      - kind='user':   tutti i sensori dell'utente `name` (asse dei tempi condiviso)
+      - kind='sensor': il sensore `name` per ciascun utente di `usernames` (max OVERVIEW_MAX_PANELS)
+    Ogni CSV viene letto una volta (e resta nella cache del processo).
+    """
+    plt, mdates = _pyplot()
+    if kind == "user":
+        panels = [(name, s) for s in SENSORS]
+    else:
+        panels = [(u, name) for u in (usernames or [])[:OVERVIEW_MAX_PANELS]]
+    if not panels:
+        panels = [("-", name)]
+    sharex = kind == "user"
+    fig, axes = _figure(reuse, rows=len(panels), sharex=sharex)
+
+    for ax, (uname, sensor) in zip(axes, panels):
+        label = sensor.upper() if kind == "user" else uname
+        ax.set_ylabel(f"{label}\n{UNITS.get(sensor, '')}", fontsize=8)
+        ax.tick_params(labelsize=7)
+        ax.grid(True, alpha=0.3)
+        xs_num_ds, ys_ds, shown_start, shown_end, msg = _series(uname, sensor, window)
+        if msg:
+            ax.text(0.5, 0.5, msg, ha="center", va="center", transform=ax.transAxes, color="#666", fontsize=8)
+            ax.set_yticks([])
+            continue
+        ax.plot_date(xs_num_ds, ys_ds, "-", linewidth=0.9)
+        if not sharex or ax is axes[-1]:
+            loc = mdates.AutoDateLocator()
+            ax.xaxis.set_major_locator(loc)
+            # con l'asse condiviso la data va in fondo, altrimenti c'è già il range del pannello
+            ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(loc, show_offset=sharex))
+            ax.xaxis.get_offset_text().set_fontsize(8)
+        if not sharex:
+            _range_text(ax, shown_start, shown_end, fontsize=7)
+
+    if sharex:
+        for ax in axes[:-1]:
+            ax.tick_params(labelbottom=False)
+    title = f"{name} • tutti i sensori" if kind == "user" else f"{name.upper()} • {len(panels)} utenti"
+    fig.suptitle(title, fontsize=10, y=1 - 0.12 / fig.get_figheight())
+    return _png_bytes(fig, reuse, tight=False)
+
+# =========================
+# Serie per i grafici lato client
+# =========================
+def _minmax_decimate(xs, ys, points):
+    """
+    Al massimo ~points punti: per ogni intervallo di indici tiene minimo e massimo
+    (in ordine di tempo), così picchi e cadute restano visibili dopo il sottocampionamento.
+    """
+    import numpy as np
+    n = len(xs)
+    buckets = max(1, points // 2)
+    if n <= points:
+        return xs, ys
+    bid = np.arange(n) * buckets // n
+    order = np.lexsort((ys, bid))            # per bucket, valori crescenti
+    last = np.flatnonzero(np.diff(bid[order], append=buckets))
+    first = np.r_[0, last[:-1] + 1]
+    idx = np.unique(np.concatenate([order[first], order[last]]))
+    return xs[idx], ys[idx]
+
+
+def series_data(username, sensor, window="all", start_ms=None, end_ms=None, points=1200):
+    """
+    Serie sottocampionata per i grafici lato client: stessi CSV e stessa finestra di render_png;
+    start_ms/end_ms (zoom) restringono l'intervallo dentro la finestra.
+    Ritorna dict con ts (epoch ms), values, start/end dell'intervallo (ms) e total (punti originali).
+    """
+    import numpy as np
+    xs, ys = _read_from_csv(username, sensor)
+    if not ys.size:
+        return {"ts": np.empty(0, dtype=np.int64), "values": np.empty(0), "start": None, "end": None, "total": 0}
+
+    start, end = _window_bounds_from_dataset(dt.datetime.fromtimestamp(xs.max()), window)
+    lo = xs.min() if start is None else start.timestamp()
+    hi = end.timestamp()
+    if start_ms is not None:
+        lo = max(lo, start_ms / 1000.0)
+    if end_ms is not None:
+        hi = min(hi, end_ms / 1000.0)
+    keep = (xs >= lo) & (xs <= hi)
+    xs_ds, ys_ds = _minmax_decimate(xs[keep], ys[keep], points)
+    return {
+        "ts": np.round(xs_ds * 1000).astype(np.int64),
+        "values": ys_ds,
+        "start": int(round(lo * 1000)),
+        "end": int(round(hi * 1000)),
+        "total": int(keep.sum()),
+    }
+
+
+def series_response(username, sensor, max_points=5000):
+    """
+    Risposta Flask per /api/series: ?days / ?window come i PNG, ?from / ?to (epoch ms) per lo zoom,
+    ?points (default 1200, al massimo max_points), ?format=json|bin.
+    Il formato bin è little-endian: n timestamp float64 (ms) seguiti da n valori float32;
+    intervallo e punti originali negli header X-Series-*.
+    """
+    from flask import jsonify, Response
+    import numpy as np
+    window = _parse_window_param()
+    start_ms = request.args.get("from", type=int)
+    end_ms = request.args.get("to", type=int)
+    points = min(max(request.args.get("points", type=int, default=1200), 10), max_points)
+    data = series_data(username, sensor, window, start_ms, end_ms, points)
+
+    if request.args.get("format") == "bin":
+        body = data["ts"].astype("<f8").tobytes() + data["values"].astype("<f4").tobytes()
+        headers = {"X-Series-Points": str(len(data["ts"])), "X-Series-Total": str(data["total"]),
+                   "X-Series-Start": str(data["start"] or ""), "X-Series-End": str(data["end"] or ""),
+                   "X-Series-Unit": UNITS.get(sensor, "")}
+        return Response(body, mimetype="application/octet-stream", headers=headers)
+    return jsonify({
+        "ok": True, "username": username, "sensor": sensor, "unit": UNITS.get(sensor, ""),
+        "window": window, "start": data["start"], "end": data["end"], "total": data["total"],
+        "ts": data["ts"].tolist(), "values": np.round(data["values"], 4).tolist(),
+    })
+
+
+# =========================
+# Endpoint principale
+# =========================
+def _send(job, *args):
+    """Esegue job (render.render / render.render_overview) e costruisce la risposta Flask."""
+    import render
+    try:
+        png = job(*args)
+    except render.Busy:
+        return ("Troppi grafici in coda, riprova", 503, {"Retry-After": "2"})
+    except render.RenderTimeout:
+        return ("Timeout nel rendering del grafico", 504)
+    return send_file(io.BytesIO(png), mimetype="image/png")
+
+
+def plot_user_sensor(username, sensor, last_n=200):
+    """
+    Risposta Flask con il PNG del sensore, renderizzato dal pool di processi (render.py).
+    503 se la coda dei grafici è piena, 504 se il rendering supera PLOT_TIMEOUT_SEC.
+    """
+    import render
+    return _send(render.render, username, sensor, _parse_window_param())
+
+
+def plot_overview(kind, name, usernames=None):
+    """Come plot_user_sensor, per una panoramica a più pannelli (render_overview)."""
+    import render
+    return _send(render.render_overview, kind, name, _parse_window_param(), usernames)
@@ -0,0 +1,117 @@
+"""
+Profiler delle query SQLite (opzionale, DB_PROFILE=1).
+
+db.query_all / exec_write / exec_write_count / exec_many passano qui durata e righe
+di ogni statement. Le query sono raggruppate per SQL normalizzato (spazi compattati,
+letterali e liste IN (?, ?, ...) sostituiti da segnaposto) e per ognuna si tengono
+conteggio, tempo totale/massimo e righe. Oltre DB_SLOW_MS la query viene stampata
+([DB][SLOW]) insieme al suo EXPLAIN QUERY PLAN, ricavato al più una volta ogni
+DB_EXPLAIN_EVERY_SEC per statement. La pagina /admin/queries mostra le più costose.
+
+Le statistiche sono del processo corrente; le transazioni aperte con db.transaction()
+non passano dal profiler (misurate solo in blocco dalle metriche, vedi metrics.py).
+"""
+import re
+import threading
+import time
+
+import config
+
+MAX_STATEMENTS = 500          # statement distinti tenuti in memoria
+
+_lock = threading.Lock()
+_stats = {}                   # sql normalizzato -> dict
+_norm_cache = {}              # sql originale -> normalizzato
+_since = time.time()
+
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_RE_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_VALUES = re.compile(r"(VALUES\s*\(\?(?:,\s*\?)*\))(?:\s*,\s*\(\?(?:,\s*\?)*\))+", re.I)
+_RE_SPACE = re.compile(r"\s+")
+
+
+def normalize(sql):
+    """SQL senza letterali né liste di segnaposto di lunghezza variabile: una riga per statement."""
+    norm = _norm_cache.get(sql)
+    if norm is None:
+        s = _RE_SPACE.sub(' ', sql).strip()
+        s = _RE_STRING.sub('?', s)
+        s = _RE_NUMBER.sub('?', s)
+        s = _RE_IN_LIST.sub('(?, ...)', s)
+        s = _RE_VALUES.sub(r'\1, ...', s)
+        if len(_norm_cache) > 4 * MAX_STATEMENTS:
+            _norm_cache.clear()
+        norm = _norm_cache[sql] = s
+    return norm
+
+
+def record(sql, params, seconds, rows):
+    """Aggiorna le statistiche dello statement; se lento, lo stampa con il piano di esecuzione."""
+    norm = normalize(sql)
+    slow = seconds * 1000 >= config.DB_SLOW_MS
+    with _lock:
+        st = _stats.get(norm)
+        if st is None:
+            if len(_stats) >= MAX_STATEMENTS:
+                return
+            st = _stats[norm] = {'sql': norm, 'count': 0, 'total': 0.0, 'max': 0.0, 'rows': 0,
+                                 'slow': 0, 'plan': None, 'plan_at': 0.0}
+        st['count'] += 1
+        st['total'] += seconds
+        st['rows'] += rows
+        if seconds > st['max']:
+            st['max'] = seconds
+        if not slow:
+            return
+        st['slow'] += 1
+        need_plan = time.time() - st['plan_at'] >= config.DB_EXPLAIN_EVERY_SEC
+        if need_plan:
+            st['plan_at'] = time.time()
+
+    plan = explain(sql, params) if need_plan else None
+    if plan is not None:
+        with _lock:
+            st['plan'] = plan
+    print(f'[DB][SLOW] {seconds * 1000:.1f} ms, {rows} righe: {norm}')
+    if plan:
+        print('[DB][SLOW] piano:\n' + plan)
+
+
+def explain(sql, params=()):
+    """EXPLAIN QUERY PLAN come albero indentato (stringa), o None se lo statement non lo supporta."""
+    from db import get_conn
+    try:
+        with get_conn() as con:
+            rows = con.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    except Exception as e:
+        return f'(EXPLAIN non disponibile: {e})'
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node] + detail)
+    return '\n'.join(lines)
+
+
+def top(n=20, key='total'):
+    """I primi n statement per tempo totale ('total'), massimo ('max') o numero di chiamate ('count')."""
+    with _lock:
+        items = [dict(st) for st in _stats.values()]
+    for st in items:
+        st['avg'] = st['total'] / st['count'] if st['count'] else 0.0
+    items.sort(key=lambda st: st[key], reverse=True)
+    return items[:n]
+
+
+def summary():
+    with _lock:
+        return {'statements': len(_stats), 'queries': sum(st['count'] for st in _stats.values()),
+                'seconds': sum(st['total'] for st in _stats.values()), 'since': _since}
+
+
+def reset():
+    global _since
+    with _lock:
+        _stats.clear()
+        _since = time.time()
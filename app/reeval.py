@@ -0,0 +1,137 @@
+"""
+Ricalcolo storico delle anomalie dopo una modifica di soglie, finestre o rilevatori.
+
+Per ogni (utente, sensore) le letture raw vengono lette a blocchi e la media
+mobile calcolata con la somma cumulativa (analytics.anomaly_rows): niente
+una query per lettura come in moving_average_anomaly. Gli utenti sono divisi
+tra processi (ProcessPoolExecutor); il processo principale riscrive poi la
+tabella `anomalies` in un'unica transazione, quindi chi legge vede le
+anomalie vecchie o quelle nuove, mai un misto. Nessuna email né Firestore:
+sono eventi storici.
+
+Le letture vengono da tsblocks.read_arrays (righe raw + blocchi compressi),
+quindi lo storico compattato dei sensori in config.BLOCK_SENSORS viene
+ricalcolato a piena risoluzione. Vengono sostituite solo le anomalie
+nell'intervallo coperto da queste letture: prima di quel punto restano solo i
+bucket di readings_rollup e le anomalie già salvate non vengono toccate.
+
+    python reeval.py [--workers 4] [--user alice]
+"""
+import time, argparse, threading
+
+import config
+import coord
+import pagecache
+from db import query_all, transaction
+from analytics import anomaly_rows, rewrite_anomalies
+
+LEASE_NAME = 'reeval'
+_STATUS_KEY = 'reeval_status'
+
+_thread = None
+
+
+# impostazioni che il ricalcolo legge da config (eventualmente modificate a runtime)
+_SETTINGS = ('DATABASE_URL', 'THRESHOLDS', 'MOVING_AVG_WINDOW', 'DEFAULT_DETECTOR', 'DETECTORS',
+             'DETECTOR_PARAMS', 'WINDOW_SEC', 'MOTION_MODE', 'MOTION_SENSORS', 'MOTION_WINDOW_SEC',
+             'MOTION_HIGH', 'MOTION_MAX_AGE_SEC')
+
+
+def _init_worker(settings):
+    # con spawn il figlio rilegge config dall'ambiente: riallinea le impostazioni del padre
+    for k, v in settings.items():
+        setattr(config, k, v)
+
+
+def _user_job(args):
+    """Anomalie ricalcolate per un utente: [(sensor, start_ms, rows)]."""
+    username, sensors, chunk_rows = args
+    out = []
+    for sensor, start_ms in sensors:
+        out.append((sensor, start_ms, anomaly_rows(username, sensor, start_ms, None, chunk_rows)))
+    return username, out
+
+
+def reevaluate(workers=None, usernames=None, chunk_rows=None):
+    """Ricalcola e riscrive le anomalie. Ritorna {'users', 'anomalies', 'seconds'}."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    t0 = time.perf_counter()
+    workers = config.REEVAL_WORKERS if workers is None else workers
+    chunk_rows = config.REEVAL_CHUNK_ROWS if chunk_rows is None else chunk_rows
+
+    rows = query_all('SELECT username, sensor, MIN(start_ms) AS start_ms FROM ('
+                     '  SELECT username, sensor, MIN(timestamp) AS start_ms FROM readings GROUP BY username, sensor'
+                     '  UNION ALL'
+                     '  SELECT username, sensor, MIN(t_start) FROM reading_blocks GROUP BY username, sensor'
+                     ') GROUP BY username, sensor ORDER BY username, sensor')
+    jobs = {}
+    for r in rows:
+        if usernames and r['username'] not in usernames:
+            continue
+        jobs.setdefault(r['username'], []).append((r['sensor'], r['start_ms']))
+    args = [(u, sensors, chunk_rows) for u, sensors in jobs.items()]
+
+    if workers > 1 and len(args) > 1:
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(workers, len(args)), mp_context=ctx,
+                                 initializer=_init_worker,
+                                 initargs=({k: getattr(config, k) for k in _SETTINGS},)) as pool:
+            results = list(pool.map(_user_job, args))
+    else:
+        results = [_user_job(a) for a in args]
+
+    total = 0
+    with transaction() as con:
+        for username, per_sensor in results:
+            for sensor, start_ms, an_rows in per_sensor:
+                rewrite_anomalies(con, username, sensor, an_rows, start_ms, None)
+                total += len(an_rows)
+    # le anomalie cancellate non spostano sqlite_sequence: le pagine in cache vanno invalidate
+    pagecache.bump()
+
+    res = {'users': len(results), 'anomalies': total, 'seconds': round(time.perf_counter() - t0, 2),
+           'finished_at': time.time()}
+    print('[REEVAL]', res)
+    return res
+
+
+def status():
+    return coord.state_get(_STATUS_KEY, {'running': False})
+
+
+def start_background(workers=None):
+    """Avvia il ricalcolo in un thread (pulsante admin). False se è già in corso."""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return False
+    # lease lungo: un solo ricalcolo alla volta su tutti i worker
+    if not coord.try_acquire_lease(LEASE_NAME, 3600):
+        return False
+
+    def _run():
+        coord.state_set(_STATUS_KEY, {'running': True, 'started_at': time.time()})
+        try:
+            res = reevaluate(workers)
+            coord.state_set(_STATUS_KEY, dict(res, running=False))
+        except Exception as e:
+            print('[REEVAL][WARN]', e)
+            coord.state_set(_STATUS_KEY, {'running': False, 'error': str(e), 'finished_at': time.time()})
+        finally:
+            coord.release_lease(LEASE_NAME)
+
+    _thread = threading.Thread(target=_run, daemon=True, name='reeval')
+    _thread.start()
+    return True
+
+
+if __name__ == '__main__':
+    from db import init_db
+
+    ap = argparse.ArgumentParser(description='Ricalcola le anomalie storiche con le soglie attuali')
+    ap.add_argument('--workers', type=int, default=None, help='Processi (default config.REEVAL_WORKERS)')
+    ap.add_argument('--user', action='append', help='Solo questi utenti (ripetibile)')
+    args = ap.parse_args()
+    init_db()
+    reevaluate(args.workers, args.user)
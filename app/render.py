@@ -0,0 +1,158 @@
+"""
+Rendering dei grafici PNG in un pool di processi.
+
+matplotlib è CPU-bound e tiene il GIL: con il server a thread i grafici di una
+dashboard (6 sensori × N utenti) verrebbero disegnati uno alla volta. Qui il
+rendering (lettura CSV + plot + PNG) gira in PLOT_WORKERS processi separati:
+  - ogni processo importa matplotlib una volta all'avvio (plots.warm) e riusa la
+    stessa figura per tutti i grafici che disegna (una per forma, per le panoramiche)
+  - al massimo PLOT_QUEUE_MAX grafici tra in corso e in coda per processo web:
+    oltre, Busy (la route risponde 503 con Retry-After)
+  - l'attesa del risultato è limitata a PLOT_TIMEOUT_SEC: oltre, RenderTimeout (504);
+    il grafico continua nel processo e occupa il suo posto in coda finché non finisce
+
+Con PLOT_WORKERS=0, o se il pool non riesce a partire più volte di fila, il grafico
+viene disegnato nel thread della richiesta.
+Con gunicorn ogni worker web ha il suo pool: i processi di rendering sono
+WEB_CONCURRENCY × PLOT_WORKERS.
+"""
+import threading
+
+import config
+import metrics
+
+
+class Busy(Exception):
+    """Coda dei grafici piena."""
+
+
+class RenderTimeout(Exception):
+    """Rendering più lungo di PLOT_TIMEOUT_SEC."""
+
+
+_pool = None
+_lock = threading.Lock()
+_inflight = 0
+_failures = 0         # pool rotti consecutivi: oltre MAX_FAILURES si disegna nel thread
+MAX_FAILURES = 3
+_stats = {'rendered': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0}
+
+
+def _init_worker():
+    import plots
+    plots.warm()
+
+
+def _job(fn, *args):
+    import plots
+    return getattr(plots, fn)(*args, reuse=True)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn: il processo web ha già dei thread (feeder, compattatore), fork non è sicuro
+        _pool = ProcessPoolExecutor(max_workers=config.PLOT_WORKERS,
+                                    mp_context=multiprocessing.get_context('spawn'),
+                                    initializer=_init_worker)
+    return _pool
+
+
+def _done(_future):
+    global _inflight
+    with _lock:
+        _inflight -= 1
+
+
+def _reset_pool():
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+def _run(fn, *args):
+    """Esegue plots.<fn>(*args) nel pool (o nel thread se il pool è spento o rotto)."""
+    with metrics.timer('plot_render_seconds', outcome=True, kind=fn):
+        return _submit(fn, *args)
+
+
+def _submit(fn, *args):
+    global _inflight, _failures
+    from concurrent.futures import TimeoutError as FuturesTimeout
+    from concurrent.futures.process import BrokenProcessPool
+
+    import plots
+    if config.PLOT_WORKERS <= 0 or _failures >= MAX_FAILURES:
+        return getattr(plots, fn)(*args)
+
+    with _lock:
+        if _inflight >= config.PLOT_QUEUE_MAX:
+            _stats['rejected'] += 1
+            raise Busy()
+        _inflight += 1
+        pool = _get_pool()
+    try:
+        future = pool.submit(_job, fn, *args)
+    except (BrokenProcessPool, RuntimeError) as e:
+        print('[RENDER][WARN] pool di rendering non disponibile:', e)
+        _done(None)
+        with _lock:
+            _failures += 1
+        _reset_pool()
+        return getattr(plots, fn)(*args)
+    future.add_done_callback(_done)
+
+    try:
+        png = future.result(timeout=config.PLOT_TIMEOUT_SEC)
+    except FuturesTimeout:
+        with _lock:
+            _stats['timeouts'] += 1
+        raise RenderTimeout()
+    except BrokenProcessPool as e:
+        # processo di rendering morto (OOM) o avvio fallito: pool ricreato al prossimo grafico,
+        # questo viene disegnato nel thread della richiesta
+        print('[RENDER][WARN] pool di rendering non disponibile:', e)
+        with _lock:
+            _stats['errors'] += 1
+            _failures += 1
+        _reset_pool()
+        return getattr(plots, fn)(*args)
+    with _lock:
+        _stats['rendered'] += 1
+        _failures = 0
+    return png
+
+
+def render(username, sensor, window='all'):
+    """PNG del grafico (bytes). Solleva Busy o RenderTimeout."""
+    return _run('render_png', username, sensor, window)
+
+
+def render_overview(kind, name, window='all', usernames=None):
+    """PNG di una panoramica a più pannelli (plots.render_overview). Solleva Busy o RenderTimeout."""
+    return _run('render_overview', kind, name, window, list(usernames) if usernames else None)
+
+
+def stats():
+    """Contatori del processo web corrente (per /admin e metriche)."""
+    with _lock:
+        return dict(_stats, inflight=_inflight, workers=config.PLOT_WORKERS, started=_pool is not None)
+
+
+@metrics.collector
+def _metrics():
+    s = stats()
+    return [
+        ('plot_queue_inflight', 'gauge', 'Grafici in corso o in coda nel pool', [({}, s['inflight'])]),
+        ('plot_workers', 'gauge', 'Processi di rendering configurati', [({}, s['workers'])]),
+        ('plot_jobs_total', 'counter', 'Grafici per esito (pool di processi)',
+         [({'outcome': k}, s[k]) for k in ('rendered', 'rejected', 'timeouts', 'errors')]),
+    ]
+
+
+def shutdown():
+    _reset_pool()
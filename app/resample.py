@@ -0,0 +1,152 @@
+"""
+Serie di più sensori allineate nel tempo per un utente.
+
+Ogni sensore ha la sua frequenza (BVP 64 Hz, ACC 32 Hz, EDA 4 Hz, HR 1 Hz, IBI
+irregolare): frame() le riporta tutte su una griglia comune di `period_ms` che parte
+da start_ms, con un'aggregazione per sensore:
+  - 'mean'  media pesata (anche sulle righe già compattate: vsum / n)
+  - 'max' / 'min'
+  - 'last'  ultimo valore del bucket (sui rollup è la media del bucket compattato)
+Il bucketing legge da readings_tiered, quindi copre anche lo storico compattato:
+per mean/max/min le righe sono pre-aggregate per bucket in SQL (GROUP BY), poi
+combinate con np.bincount / ufunc.reduceat; 'last' legge le righe ordinate.
+Con fill_ms > 0 i bucket vuoti prendono l'ultimo valore precedente entro fill_ms
+(pd.merge_asof), utile quando si chiede una frequenza più alta di quella del sensore.
+
+I risultati restano in una piccola cache LRU di processo per RESAMPLE_CACHE_SEC:
+dashboard e analytics chiedono spesso la stessa finestra più volte di seguito.
+"""
+import time, threading
+from collections import OrderedDict
+
+import config
+from db import get_conn
+
+AGGS = ('mean', 'max', 'min', 'last')
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _bucket(b, n, vsum, vmin, vmax, size, agg):
+    import numpy as np
+
+    out = np.full(size, np.nan)
+    if not b.size:
+        return out
+    if agg == 'mean':
+        cnt = np.bincount(b, weights=n, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.bincount(b, weights=vsum, minlength=size) / cnt
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(b)) + 1))
+    if agg == 'max':
+        out[b[starts]] = np.maximum.reduceat(vmax, starts)
+    elif agg == 'min':
+        out[b[starts]] = np.minimum.reduceat(vmin, starts)
+    else:  # last
+        ends = np.concatenate((starts[1:], [b.size])) - 1
+        out[b[starts]] = vsum[ends] / n[ends]
+    return out
+
+
+def _fill(ts, col, fill_ms):
+    """Bucket vuoti <- ultimo valore noto entro fill_ms."""
+    import numpy as np
+    import pandas as pd
+
+    known = ~np.isnan(col)
+    if known.all() or not known.any():
+        return col
+    left = pd.DataFrame({'ts': ts})
+    right = pd.DataFrame({'ts': ts[known], 'v': col[known]})
+    filled = pd.merge_asof(left, right, on='ts', direction='backward', tolerance=int(fill_ms))['v'].to_numpy()
+    return np.where(known, col, filled)
+
+
+def parse_agg(spec):
+    """'hr:mean,acc:max' -> {'hr': 'mean', 'acc': 'max'}; ValueError se non valido."""
+    out = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        sensor, _, agg = item.partition(':')
+        sensor, agg = sensor.strip(), agg.strip() or 'mean'
+        if sensor not in config.SENSORS or agg not in AGGS:
+            raise ValueError(f'aggregazione non valida: {item}')
+        out[sensor] = agg
+    return out
+
+
+def frame(username, start_ms, end_ms, period_ms, sensors=None, agg=None, fill_ms=0):
+    """
+    DataFrame indicizzato dall'inizio del bucket (ms epoch, colonna 'ts'), una colonna per
+    sensore, NaN dove il sensore non ha dati. agg: {sensore: aggregazione}, default
+    config.RESAMPLE_AGG. Il risultato può arrivare dalla cache: non modificarlo.
+    """
+    import numpy as np
+    import pandas as pd
+
+    start_ms, end_ms, period_ms = int(start_ms), int(end_ms), int(period_ms)
+    if period_ms <= 0 or end_ms <= start_ms:
+        raise ValueError('intervallo o periodo non valido')
+    size = -(-(end_ms - start_ms) // period_ms)
+    if size > config.RESAMPLE_MAX_POINTS:
+        raise ValueError(f'troppi punti ({size} > {config.RESAMPLE_MAX_POINTS}): aumentare il periodo')
+    sensors = tuple(sensors or config.SENSORS)
+    aggs = dict(config.RESAMPLE_AGG, **(agg or {}))
+    key = (username, start_ms, end_ms, period_ms, tuple((s, aggs.get(s, 'mean')) for s in sensors), int(fill_ms))
+
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] > now:
+            _cache.move_to_end(key)
+            return hit[1]
+
+    ts = start_ms + np.arange(size, dtype=np.int64) * period_ms
+    cols = {}
+    with get_conn() as con:
+        for sensor in sensors:
+            how = aggs.get(sensor, 'mean')
+            if how == 'last':
+                rows = con.execute(
+                    'SELECT (timestamp - ?) / ?, n, vsum, vmin, vmax FROM readings_tiered '
+                    'WHERE username=? AND sensor=? AND timestamp>=? AND timestamp<? AND vsum IS NOT NULL '
+                    'ORDER BY timestamp',
+                    (start_ms, period_ms, username, sensor, start_ms, end_ms)
+                ).fetchall()
+            else:
+                # pre-aggregazione per bucket in SQL: meno righe da trasferire per i sensori veloci
+                rows = con.execute(
+                    'SELECT (timestamp - ?) / ? AS b, SUM(n), SUM(vsum), MIN(vmin), MAX(vmax) '
+                    'FROM readings_tiered '
+                    'WHERE username=? AND sensor=? AND timestamp>=? AND timestamp<? AND vsum IS NOT NULL '
+                    'GROUP BY b ORDER BY b',
+                    (start_ms, period_ms, username, sensor, start_ms, end_ms)
+                ).fetchall()
+            arr = np.array(rows, dtype=float).reshape(-1, 5)
+            b = arr[:, 0].astype(np.int64)
+            col = _bucket(b, arr[:, 1], arr[:, 2], arr[:, 3], arr[:, 4], size, how)
+            cols[sensor] = _fill(ts, col, fill_ms) if fill_ms else col
+    df = pd.DataFrame(cols, index=pd.Index(ts, name='ts'))
+
+    with _cache_lock:
+        _cache[key] = (now + config.RESAMPLE_CACHE_SEC, df)
+        _cache.move_to_end(key)
+        while len(_cache) > config.RESAMPLE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return df
+
+
+def to_json(df):
+    """{'ts': [...], 'series': {sensore: [valori | null]}} per l'API."""
+    import numpy as np
+    return {
+        'ts': df.index.tolist(),
+        'series': {c: [None if np.isnan(v) else v for v in df[c].tolist()] for c in df.columns},
+    }
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
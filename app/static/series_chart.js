@@ -0,0 +1,179 @@
+// Grafico interattivo leggero (canvas, senza librerie) sopra /api/series.
+// Trascina per zoomare: viene richiesto solo l'intervallo selezionato, già sottocampionato
+// dal server (min/max per intervallo, al massimo un punto per pixel circa).
+// Doppio clic: torna alla finestra iniziale (?days).
+//
+//   <canvas data-series-chart data-user="alice" data-sensor="hr" data-days="7"></canvas>
+//   SeriesChart.attach(canvas)   oppure   SeriesChart.attachAll(document)
+(function () {
+  'use strict';
+
+  var PAD = { left: 52, right: 10, top: 10, bottom: 22 };
+
+  function fmtTime(ms, span) {
+    var d = new Date(ms);
+    var p = function (n) { return (n < 10 ? '0' : '') + n; };
+    var hm = p(d.getHours()) + ':' + p(d.getMinutes());
+    if (span < 120 * 1000) return hm + ':' + p(d.getSeconds());
+    if (span < 36 * 3600 * 1000) return hm;
+    return p(d.getDate()) + '/' + p(d.getMonth() + 1) + ' ' + hm;
+  }
+
+  function Chart(canvas) {
+    this.canvas = canvas;
+    this.user = canvas.dataset.user;
+    this.sensor = canvas.dataset.sensor;
+    this.days = canvas.dataset.days;
+    this.status = canvas.parentNode.querySelector('[data-series-status]');
+    this.data = null;
+    this.pending = null;
+    this.drag = null;
+    this._bind();
+    this.load();
+  }
+
+  Chart.prototype.setSensor = function (sensor) {
+    this.sensor = sensor;
+    this.load();
+  };
+
+  Chart.prototype.load = function (from, to) {
+    var c = this.canvas;
+    var w = c.clientWidth || 600;
+    var q = ['format=bin', 'points=' + Math.round(w * 2)];
+    if (this.days) q.push('days=' + encodeURIComponent(this.days));
+    if (from != null) q.push('from=' + Math.floor(from));
+    if (to != null) q.push('to=' + Math.ceil(to));
+    var url = '/api/series/' + encodeURIComponent(this.sensor) + '/' + encodeURIComponent(this.user) + '?' + q.join('&');
+
+    if (this.pending) this.pending.abort();   // zoom rapidi: conta solo l'ultimo
+    var ctrl = this.pending = new AbortController();
+    var self = this;
+    this._status('caricamento…');
+    fetch(url, { signal: ctrl.signal, credentials: 'same-origin' }).then(function (r) {
+      if (!r.ok) throw new Error('HTTP ' + r.status);
+      var h = r.headers;
+      return r.arrayBuffer().then(function (buf) {
+        var n = parseInt(h.get('X-Series-Points') || '0', 10);
+        self.data = {
+          ts: new Float64Array(buf, 0, n),           // little-endian come i client x86/ARM
+          values: new Float32Array(buf, 8 * n, n),
+          start: parseInt(h.get('X-Series-Start'), 10),
+          end: parseInt(h.get('X-Series-End'), 10),
+          total: parseInt(h.get('X-Series-Total') || '0', 10),
+          unit: h.get('X-Series-Unit') || ''
+        };
+        self.zoomed = from != null || to != null;
+        self.pending = null;
+        self.draw();
+        self._status(n ? (n + ' punti di ' + self.data.total + (self.zoomed ? ' · doppio clic per tornare indietro' : ' · trascina per zoomare')) : 'nessun dato');
+      });
+    }).catch(function (e) {
+      if (e.name !== 'AbortError') self._status('errore: ' + e.message);
+    });
+  };
+
+  Chart.prototype._status = function (msg) {
+    if (this.status) this.status.textContent = msg;
+  };
+
+  Chart.prototype._scales = function () {
+    var d = this.data, c = this.canvas;
+    var lo = Infinity, hi = -Infinity;
+    for (var i = 0; i < d.values.length; i++) {
+      if (d.values[i] < lo) lo = d.values[i];
+      if (d.values[i] > hi) hi = d.values[i];
+    }
+    if (!(hi > lo)) { lo -= 1; hi += 1; }
+    var x0 = d.start, x1 = d.end > d.start ? d.end : d.start + 1;
+    var w = c.clientWidth - PAD.left - PAD.right, h = c.clientHeight - PAD.top - PAD.bottom;
+    return {
+      lo: lo, hi: hi, x0: x0, x1: x1,
+      x: function (t) { return PAD.left + (t - x0) / (x1 - x0) * w; },
+      y: function (v) { return PAD.top + (1 - (v - lo) / (hi - lo)) * h; },
+      t: function (px) { return x0 + (px - PAD.left) / w * (x1 - x0); }
+    };
+  };
+
+  Chart.prototype.draw = function () {
+    var c = this.canvas, dpr = window.devicePixelRatio || 1;
+    c.width = c.clientWidth * dpr;
+    c.height = c.clientHeight * dpr;
+    var g = c.getContext('2d');
+    g.setTransform(dpr, 0, 0, dpr, 0, 0);
+    g.clearRect(0, 0, c.clientWidth, c.clientHeight);
+    if (!this.data || !this.data.ts.length) return;
+
+    var d = this.data, s = this.scales = this._scales();
+    g.font = '11px sans-serif';
+    g.fillStyle = '#555';
+    g.strokeStyle = '#e5e7eb';
+    g.lineWidth = 1;
+    for (var k = 0; k <= 4; k++) {               // griglia e valori sull'asse Y
+      var v = s.lo + (s.hi - s.lo) * k / 4, y = s.y(v);
+      g.beginPath(); g.moveTo(PAD.left, y); g.lineTo(c.clientWidth - PAD.right, y); g.stroke();
+      g.textAlign = 'right'; g.textBaseline = 'middle';
+      g.fillText(v.toFixed(Math.abs(s.hi - s.lo) < 5 ? 2 : 0), PAD.left - 4, y);
+    }
+    g.textBaseline = 'top';
+    for (k = 0; k <= 4; k++) {                   // tempi sull'asse X
+      var t = s.x0 + (s.x1 - s.x0) * k / 4;
+      g.textAlign = k === 0 ? 'left' : (k === 4 ? 'right' : 'center');
+      g.fillText(fmtTime(t, s.x1 - s.x0), s.x(t), c.clientHeight - PAD.bottom + 6);
+    }
+    g.save();
+    g.translate(10, PAD.top + (c.clientHeight - PAD.top - PAD.bottom) / 2);
+    g.rotate(-Math.PI / 2); g.textAlign = 'center'; g.textBaseline = 'top';
+    g.fillText(this.sensor.toUpperCase() + (d.unit ? ' (' + d.unit + ')' : ''), 0, 0);
+    g.restore();
+
+    g.strokeStyle = '#1f77b4';
+    g.lineWidth = 1.2;
+    g.beginPath();
+    for (var i = 0; i < d.ts.length; i++) {
+      var px = s.x(d.ts[i]), py = s.y(d.values[i]);
+      if (i) g.lineTo(px, py); else g.moveTo(px, py);
+    }
+    g.stroke();
+
+    if (this.drag) {                             // selezione in corso
+      g.fillStyle = 'rgba(118, 75, 162, 0.15)';
+      var a = Math.min(this.drag.a, this.drag.b), b = Math.max(this.drag.a, this.drag.b);
+      g.fillRect(a, PAD.top, b - a, c.clientHeight - PAD.top - PAD.bottom);
+    }
+  };
+
+  Chart.prototype._bind = function () {
+    var self = this, c = this.canvas;
+    var xOf = function (e) { return e.clientX - c.getBoundingClientRect().left; };
+    c.addEventListener('mousedown', function (e) {
+      if (!self.scales) return;
+      self.drag = { a: xOf(e), b: xOf(e) };
+    });
+    c.addEventListener('mousemove', function (e) {
+      if (!self.drag) return;
+      self.drag.b = xOf(e);
+      self.draw();
+    });
+    window.addEventListener('mouseup', function () {
+      if (!self.drag) return;
+      var a = Math.min(self.drag.a, self.drag.b), b = Math.max(self.drag.a, self.drag.b);
+      self.drag = null;
+      if (b - a < 5) { self.draw(); return; }   // clic, non selezione
+      self.load(self.scales.t(a), self.scales.t(b));
+    });
+    c.addEventListener('dblclick', function () { self.load(); });
+    window.addEventListener('resize', function () { self.draw(); });
+  };
+
+  window.SeriesChart = {
+    attach: function (canvas) {
+      if (!canvas._seriesChart) canvas._seriesChart = new Chart(canvas);
+      return canvas._seriesChart;
+    },
+    attachAll: function (root) {
+      var list = (root || document).querySelectorAll('canvas[data-series-chart]');
+      for (var i = 0; i < list.length; i++) this.attach(list[i]);
+    }
+  };
+})();
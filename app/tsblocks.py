@@ -0,0 +1,165 @@
+"""
+Storage a blocchi per le serie ad alta frequenza (BVP 64 Hz, ACC 32 Hz).
+
+Invece di una riga SQLite per campione (~40 byte di overhead per 8 byte di
+valore), le letture di un (utente, sensore) vengono raccolte in chunk a durata
+fissa (config.BLOCK_CHUNK_SEC) nella tabella `reading_blocks`:
+
+  - timestamp: delta-of-delta (quasi sempre 0 a frequenza costante)
+  - valori:    quantizzati (config.BLOCK_QUANT) e codificati come delta interi
+
+Entrambi gli array interi sono salvati nel tipo più piccolo che li contiene
+(int8/16/32/64) e compressi con zlib. Codifica e decodifica sono interamente
+vettoriali (NumPy): read_arrays() restituisce direttamente array NumPy.
+
+I blocchi vengono scritti dal compattatore (compactor.py) quando le righe raw
+escono dalla finestra "calda"; read_arrays() unisce blocchi e righe raw ed è
+il punto da cui leggono le serie complete (ricalcolo anomalie, HRV, EDA, movimento).
+"""
+import zlib
+
+import numpy as np
+
+import config
+from db import get_conn
+
+# codice tipo (1 byte) -> dtype
+_DTYPES = [np.int8, np.int16, np.int32, np.int64]
+
+
+def _encode_ints(arr):
+    """Array intero -> bytes: 1 byte di tipo + dati zlib nel dtype più piccolo sufficiente."""
+    arr = np.asarray(arr, dtype=np.int64)
+    lo, hi = (int(arr.min()), int(arr.max())) if arr.size else (0, 0)
+    for code, dt in enumerate(_DTYPES):
+        info = np.iinfo(dt)
+        if info.min <= lo and hi <= info.max:
+            break
+    return bytes([code]) + zlib.compress(arr.astype(_DTYPES[code]).tobytes(), 6)
+
+
+def _decode_ints(blob):
+    dt = _DTYPES[blob[0]]
+    return np.frombuffer(zlib.decompress(blob[1:]), dtype=dt).astype(np.int64)
+
+
+def encode_block(ts, values, quant):
+    """
+    Codifica (timestamp ms, valori) già ordinati per tempo.
+    Ritorna (ts_blob, val_blob); l'errore sui valori è al più quant/2.
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    d1 = np.diff(ts, prepend=ts[:1])               # primo delta = 0
+    dod = np.diff(d1, prepend=0)                   # delta-of-delta
+    q = np.rint(np.asarray(values, dtype=float) / quant).astype(np.int64)
+    dq = np.diff(q, prepend=0)                     # primo elemento = valore assoluto
+    return _encode_ints(dod), _encode_ints(dq)
+
+
+def decode_block(t_start, ts_blob, val_blob, quant):
+    """Inverso di encode_block: ritorna (ts int64 ms, valori float64)."""
+    ts = t_start + np.cumsum(np.cumsum(_decode_ints(ts_blob)))
+    vals = np.cumsum(_decode_ints(val_blob)) * quant
+    return ts, vals
+
+
+def _quant(sensor):
+    return config.BLOCK_QUANT.get(sensor, 1e-4)
+
+
+def write_blocks(con, username, sensor, ts, values):
+    """
+    Scrive (o fonde con quelli esistenti) i blocchi che coprono `ts`.
+    Usa la connessione/transazione del chiamante. Ritorna il numero di blocchi scritti.
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+    keep = ~np.isnan(values)
+    ts, values = ts[keep], values[keep]
+    if not ts.size:
+        return 0
+
+    chunk_ms = int(config.BLOCK_CHUNK_SEC * 1000)
+    quant = _quant(sensor)
+    chunk_ids = ts // chunk_ms
+    written = 0
+    for cid in np.unique(chunk_ids):
+        sel = chunk_ids == cid
+        c_ts, c_vals = ts[sel], values[sel]
+        c_start = int(cid) * chunk_ms
+
+        # dati arrivati in ritardo: fondi con il blocco esistente dello stesso chunk
+        row = con.execute(
+            'SELECT t_start, quant, ts_blob, val_blob FROM reading_blocks '
+            'WHERE username=? AND sensor=? AND chunk_start=?',
+            (username, sensor, c_start)
+        ).fetchall()
+        if row:
+            o_ts, o_vals = decode_block(row[0][0], row[0][2], row[0][3], row[0][1])
+            c_ts = np.concatenate([o_ts, c_ts])
+            c_vals = np.concatenate([o_vals, c_vals])
+
+        order = np.argsort(c_ts, kind='stable')
+        c_ts, c_vals = c_ts[order], c_vals[order]
+        # stesso timestamp due volte (reimport): resta il campione già salvato, come INSERT OR IGNORE
+        first = np.concatenate(([True], np.diff(c_ts) != 0))
+        c_ts, c_vals = c_ts[first], c_vals[first]
+        ts_blob, val_blob = encode_block(c_ts, c_vals, quant)
+        con.execute(
+            'INSERT OR REPLACE INTO reading_blocks'
+            '(username, sensor, chunk_start, t_start, t_end, n, quant, vmin, vmax, vsum, ts_blob, val_blob) '
+            'VALUES(?,?,?,?,?,?,?,?,?,?,?,?)',
+            (username, sensor, c_start, int(c_ts[0]), int(c_ts[-1]), int(c_ts.size), quant,
+             float(c_vals.min()), float(c_vals.max()), float(c_vals.sum()), ts_blob, val_blob)
+        )
+        written += 1
+    return written
+
+
+def read_arrays(username, sensor, start_ms=None, end_ms=None, include_raw=True, limit=None):
+    """
+    Serie completa (timestamp ms, valori) come array NumPy nell'intervallo [start_ms, end_ms]:
+    decodifica i blocchi e, se include_raw, aggiunge le righe raw ancora in `readings`.
+    Con `limit` ritorna solo i primi `limit` campioni (lettura a pezzi di serie lunghe).
+    Un timestamp presente in entrambi i tier viene restituito una volta sola (vince il blocco).
+    """
+    lo = -2**62 if start_ms is None else int(start_ms)
+    hi = 2**62 if end_ms is None else int(end_ms)
+    parts_ts, parts_v = [], []
+    with get_conn() as con:
+        cur = con.execute(
+            'SELECT t_start, quant, ts_blob, val_blob FROM reading_blocks '
+            'WHERE username=? AND sensor=? AND t_end>=? AND t_start<=? ORDER BY chunk_start',
+            (username, sensor, lo, hi)
+        )
+        got = 0
+        for t_start, quant, ts_blob, val_blob in cur:
+            t, v = decode_block(t_start, ts_blob, val_blob, quant)
+            sel = (t >= lo) & (t <= hi)
+            parts_ts.append(t[sel]); parts_v.append(v[sel])
+            got += int(sel.sum())
+            if limit is not None and got >= limit:
+                break
+        if include_raw:
+            lim = '' if limit is None else f' LIMIT {int(limit)}'
+            raw = con.execute(
+                'SELECT timestamp, value FROM readings WHERE username=? AND sensor=? '
+                f'AND timestamp BETWEEN ? AND ? AND value IS NOT NULL ORDER BY timestamp{lim}',
+                (username, sensor, lo, hi)
+            ).fetchall()
+            if raw:
+                arr = np.array(raw, dtype=float)
+                parts_ts.append(arr[:, 0].astype(np.int64)); parts_v.append(arr[:, 1])
+
+    if not parts_ts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+    ts = np.concatenate(parts_ts)
+    vals = np.concatenate(parts_v)
+    if len(parts_ts) > 1:
+        order = np.argsort(ts, kind='stable')
+        ts, vals = ts[order], vals[order]
+        first = np.concatenate(([True], np.diff(ts) != 0))
+        ts, vals = ts[first], vals[first]
+    if limit is not None:
+        ts, vals = ts[:limit], vals[:limit]
+    return ts, vals
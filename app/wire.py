@@ -0,0 +1,197 @@
+"""
+Formato compatto (colonnare) per l'upload dei dispositivi su /api/sensor_data.
+
+Invece di un oggetto JSON per lettura con username/sensor ripetuti, un payload
+contiene una o più serie con intestazione condivisa:
+
+    {"device_id": "gw-1", "seq": 42,
+     "series": [
+        {"username": "alice", "sensor": "bvp",
+         "t0": 1631106796171,          # epoch ms (anche s/µs: normalizzato all'ingest)
+         "dt": [16, 15, 16, ...],      # n-1 delta in ms tra letture consecutive
+         "values": [0.52, -0.36, ...]},
+        {"username": "alice", "sensor": "acc", "t0": ..., "dt": [...],
+         "ax": [...], "ay": [...], "az": [...]},     # acc: 3 assi, magnitudo calcolata qui
+        {"username": "alice", "sensor": "ibi", "t0": ..., "dt": [...],
+         "values": [0.81, 0.79, ...]}                # ibi in s; oltre IBI_MS_ABOVE è in ms e
+     ]}                                              # viene convertito, come nel formato a righe
+
+Codifiche (header Content-Type):
+  - application/msgpack (o application/x-msgpack)  -> richiede `msgpack`
+  - application/cbor                               -> richiede `cbor2`
+  - application/json                               -> stessa struttura in JSON
+Compressione opzionale (header Content-Encoding): gzip (stdlib) o zstd (`zstandard`).
+Se la libreria necessaria non è installata la richiesta viene rifiutata con 415.
+La decompressione procede a pezzi e si ferma oltre config.WIRE_MAX_DECOMPRESSED_MB
+(413): pochi KB compressi non possono diventare GB in memoria.
+
+Con msgpack/CBOR ogni array può essere inviato anche come byte grezzi
+little-endian, dichiarandone il tipo in "dtype", es. {"dt": "<i2", "values": "<f4"}:
+la decodifica diventa un np.frombuffer, senza conversione elemento per elemento.
+"""
+import io, json, zlib
+
+import config
+
+CONTENT_TYPES = {
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/cbor': 'cbor',
+}
+
+# tipi ammessi per gli array binari (niente object/str)
+_DTYPES = {'<i1', '<i2', '<i4', '<i8', '<f4', '<f8'}
+
+
+class UnsupportedFormat(Exception):
+    """Codifica o compressione non disponibile su questo server (HTTP 415)."""
+
+
+def is_compact(mimetype):
+    return mimetype in CONTENT_TYPES
+
+
+class PayloadTooLarge(Exception):
+    """Corpo decompresso oltre il limite configurato (HTTP 413)."""
+
+
+_READ_CHUNK = 1 << 20
+
+
+def _gunzip(body, max_size):
+    """gzip (anche più membri concatenati) senza mai produrre più di max_size + 1 byte."""
+    out, total = [], 0
+    while body:
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunk = d.decompress(body, max_size - total + 1)
+        total += len(chunk)
+        if total > max_size:
+            raise PayloadTooLarge(f'corpo decompresso oltre {max_size} byte')
+        if not d.eof:
+            raise ValueError('stream gzip troncato')
+        out.append(chunk)
+        body = d.unused_data
+    return b''.join(out)
+
+
+def _unzstd(body, max_size):
+    try:
+        import zstandard
+    except ImportError:
+        raise UnsupportedFormat('zstd non disponibile (pip install zstandard)')
+    out, total = [], 0
+    with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+        while True:
+            chunk = reader.read(min(_READ_CHUNK, max_size - total + 1))
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_size:
+                raise PayloadTooLarge(f'corpo decompresso oltre {max_size} byte')
+            out.append(chunk)
+    return b''.join(out)
+
+
+def decompress(body, encoding, max_size=None):
+    """
+    Decomprime il corpo secondo Content-Encoding (gzip, zstd o nessuna).
+    Solleva PayloadTooLarge se il risultato supera max_size byte
+    (default config.WIRE_MAX_DECOMPRESSED_MB).
+    """
+    if max_size is None:
+        max_size = int(config.WIRE_MAX_DECOMPRESSED_MB * 1024 * 1024)
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        if len(body) > max_size:
+            raise PayloadTooLarge(f'corpo oltre {max_size} byte')
+        return body
+    if encoding in ('gzip', 'x-gzip'):
+        return _gunzip(body, max_size)
+    if encoding == 'zstd':
+        return _unzstd(body, max_size)
+    raise UnsupportedFormat(f'Content-Encoding non supportato: {encoding}')
+
+
+def loads(body, mimetype):
+    """Corpo (già decompresso) -> oggetto Python secondo il Content-Type."""
+    kind = CONTENT_TYPES.get(mimetype)
+    if kind == 'msgpack':
+        try:
+            import msgpack
+        except ImportError:
+            raise UnsupportedFormat('msgpack non disponibile (pip install msgpack)')
+        return msgpack.unpackb(body, raw=False)
+    if kind == 'cbor':
+        try:
+            import cbor2
+        except ImportError:
+            raise UnsupportedFormat('CBOR non disponibile (pip install cbor2)')
+        return cbor2.loads(body)
+    return json.loads(body)
+
+
+def _array(series, key, dtypes, default):
+    import numpy as np
+    data = series.get(key)
+    if data is None:
+        return None
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        dt = dtypes.get(key, default)
+        if dt not in _DTYPES:
+            raise ValueError(f'dtype non ammesso per {key}: {dt}')
+        return np.frombuffer(data, dtype=dt)
+    return np.asarray(data, dtype=float if default.startswith('<f') else np.int64)
+
+
+def decode_series(series):
+    """
+    Una serie colonnare -> (username, sensor, ts_ms int64, values float64, axes | None)
+    con array NumPy; axes è una tupla (ax, ay, az) di array per acc.
+    """
+    import numpy as np
+    from ingest import IBI_MS_ABOVE, acc_magnitude, to_epoch_ms
+
+    username, sensor = series.get('username'), series.get('sensor')
+    dtypes = series.get('dtype') or {}
+    t0 = to_epoch_ms(series['t0'])
+    dt = _array(series, 'dt', dtypes, '<i8')
+    n_dt = 0 if dt is None else dt.size
+    ts = np.empty(n_dt + 1, dtype=np.int64)
+    ts[0] = t0
+    if n_dt:
+        ts[1:] = t0 + np.cumsum(dt.astype(np.int64))
+
+    axes = None
+    if sensor == 'acc' and all(k in series for k in ('ax', 'ay', 'az')):
+        axes = tuple(_array(series, k, dtypes, '<f8').astype(float) for k in ('ax', 'ay', 'az'))
+        values = acc_magnitude(*axes)
+    else:
+        values = _array(series, 'values', dtypes, '<f8').astype(float)
+        if sensor == 'ibi':
+            # stessa regola di ingest.parse_reading: durate in ms -> secondi
+            values = np.where(values > IBI_MS_ABOVE, values / 1000.0, values)
+    if values.size != ts.size or (axes and any(a.size != ts.size for a in axes)):
+        raise ValueError(f'lunghezze diverse per {username}/{sensor}: {ts.size} timestamp, {values.size} valori')
+    return username, sensor, ts, values, axes
+
+
+def to_rows(series):
+    """Serie decodificata -> righe (username, sensor, ts, value, axes) per ingest.ingest_batch."""
+    username, sensor, ts, values, axes = series
+    ts_l, v_l = ts.tolist(), values.tolist()
+    if axes is None:
+        return [(username, sensor, t, v, None) for t, v in zip(ts_l, v_l)]
+    ax, ay, az = (a.tolist() for a in axes)
+    return [(username, sensor, t, v, (x, y, z)) for t, v, x, y, z in zip(ts_l, v_l, ax, ay, az)]
+
+
+def encode_series(username, sensor, ts_ms, values=None, axes=None):
+    """Serie colonnare (liste) pronta per msgpack/CBOR/JSON; usata da client e benchmark."""
+    import numpy as np
+    ts = np.asarray(ts_ms, dtype=np.int64)
+    out = {'username': username, 'sensor': sensor, 't0': int(ts[0]), 'dt': np.diff(ts).tolist()}
+    if axes is not None:
+        out['ax'], out['ay'], out['az'] = (np.asarray(a, dtype=float).tolist() for a in axes)
+    else:
+        out['values'] = np.asarray(values, dtype=float).tolist()
+    return out
@@ -0,0 +1,18 @@
+"""
+Entry point WSGI di produzione.
+
+Linux/container (gunicorn, N processi):
+    gunicorn -c gunicorn.conf.py
+Windows (waitress, thread):
+    python app/wsgi.py
+"""
+import os
+
+from app import create_app
+
+app = application = create_app()
+
+if __name__ == '__main__':
+    from waitress import serve
+    serve(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)),
+          threads=int(os.environ.get('WAITRESS_THREADS', '8')))
@@ -0,0 +1,131 @@
+"""
+Benchmark storage a blocchi (tsblocks.py) contro la tabella riga-per-campione.
+
+Carica BVP e ACC (magnitudo) da data_samples/*/ in due DB temporanei:
+  A) `readings` una riga per campione (+ indice username, sensor, timestamp)
+  B) `reading_blocks` chunk compressi
+e misura byte/campione (dimensione file dopo VACUUM), tempo di scansione
+completa verso array NumPy ed errore massimo di quantizzazione.
+
+    python bench/bench_blocks.py [--sensors bvp,acc] [--repeat 5] [--json out.json]
+"""
+import os, sys, json, time, glob, argparse, tempfile
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.append(os.path.join(ROOT, 'app'))
+
+import config
+import db
+import tsblocks
+from ingest import CSV_FILES, acc_magnitude, to_epoch_ms
+
+
+def load_sessions(sensors):
+    """{(username, sensor): (ts_ms, values)} dai CSV di esempio."""
+    out = {}
+    for folder in sorted(glob.glob(os.path.join(ROOT, 'data_samples', '*'))):
+        uname = os.path.basename(folder)
+        for s in sensors:
+            path = os.path.join(folder, CSV_FILES[s])
+            if not os.path.exists(path):
+                continue
+            arr = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+            ts = to_epoch_ms(arr[:, 0])
+            vals = acc_magnitude(arr[:, 1], arr[:, 2], arr[:, 3]) if s == 'acc' else arr[:, 1]
+            out[(uname, s)] = (ts, vals)
+    return out
+
+
+def _fresh_db(path):
+    config.DATABASE_URL = path
+    db.init_db()
+
+
+def _file_bytes(path):
+    with db.get_conn() as con:
+        con.execute('VACUUM')
+        con.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    return os.path.getsize(path)
+
+
+def bench_rows(path, data, repeat):
+    _fresh_db(path)
+    empty = _file_bytes(path)
+    t0 = time.perf_counter()
+    with db.transaction() as con:
+        for (u, s), (ts, vals) in data.items():
+            con.executemany('INSERT INTO readings(username,sensor,timestamp,value) VALUES(?,?,?,?)',
+                            zip([u] * len(ts), [s] * len(ts), ts.tolist(), vals.tolist()))
+    write_s = time.perf_counter() - t0
+    size = _file_bytes(path) - empty
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for (u, s) in data:
+            rows = db.query_all('SELECT timestamp, value FROM readings WHERE username=? AND sensor=? '
+                                'ORDER BY timestamp', (u, s))
+            np.array([r['timestamp'] for r in rows]); np.array([r['value'] for r in rows])
+    scan_s = (time.perf_counter() - t0) / repeat
+    return size, write_s, scan_s
+
+
+def bench_blocks(path, data, repeat):
+    _fresh_db(path)
+    empty = _file_bytes(path)
+    t0 = time.perf_counter()
+    with db.transaction() as con:
+        for (u, s), (ts, vals) in data.items():
+            tsblocks.write_blocks(con, u, s, ts, vals)
+    write_s = time.perf_counter() - t0
+    size = _file_bytes(path) - empty
+
+    max_err = 0.0
+    t0 = time.perf_counter()
+    for i in range(repeat):
+        for (u, s), (ts, vals) in data.items():
+            rts, rvals = tsblocks.read_arrays(u, s, include_raw=False)
+            if i == 0:
+                order = np.argsort(ts, kind='stable')
+                assert np.array_equal(rts, ts[order]), f'timestamp diversi per {u}/{s}'
+                max_err = max(max_err, float(np.max(np.abs(rvals - vals[order]))))
+    scan_s = (time.perf_counter() - t0) / repeat
+    return size, write_s, scan_s, max_err
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Byte/campione e velocità di scansione: righe vs blocchi')
+    ap.add_argument('--sensors', default='bvp,acc')
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--json', help='Salva i risultati in questo file JSON')
+    args = ap.parse_args()
+
+    data = load_sessions([s.strip() for s in args.sensors.split(',') if s.strip()])
+    n = sum(len(ts) for ts, _ in data.values())
+    tmp = tempfile.mkdtemp(prefix='bench_blocks_')
+
+    r_size, r_write, r_scan = bench_rows(os.path.join(tmp, 'rows.db'), data, args.repeat)
+    b_size, b_write, b_scan, err = bench_blocks(os.path.join(tmp, 'blocks.db'), data, args.repeat)
+
+    res = {
+        'samples': n,
+        'rows':   {'bytes_per_sample': r_size / n, 'write_s': r_write, 'scan_s': r_scan,
+                   'scan_samples_per_s': n / r_scan},
+        'blocks': {'bytes_per_sample': b_size / n, 'write_s': b_write, 'scan_s': b_scan,
+                   'scan_samples_per_s': n / b_scan, 'max_abs_error': err,
+                   'chunk_sec': config.BLOCK_CHUNK_SEC},
+    }
+    print(f"[BENCH][BLOCKS] campioni: {n}")
+    for k in ('rows', 'blocks'):
+        r = res[k]
+        print(f"  {k:6s}  {r['bytes_per_sample']:7.2f} B/campione   scrittura {r['write_s']:.3f} s   "
+              f"scansione {r['scan_s'] * 1000:8.1f} ms ({r['scan_samples_per_s'] / 1e6:.2f} M campioni/s)")
+    print(f"  errore max quantizzazione: {err:.6g}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(res, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Costo della deduplicazione in ingestione.
+
+Confronta, su DB temporanei, l'inserimento bulk di N letture con:
+  A) indice non unico + INSERT semplice (schema precedente, duplicati ammessi)
+  B) indice UNIQUE(username, sensor, timestamp) + INSERT OR IGNORE (ingest.ingest_batch)
+e il reinvio dello stesso batch (tutti duplicati) nel caso B.
+
+    python bench/bench_dedup.py [--rows 200000] [--batch 500] [--json out.json]
+"""
+import os, sys, json, time, argparse, tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.append(os.path.join(ROOT, 'app'))
+
+import config
+import db
+from ingest import ingest_batch
+
+
+def make_rows(n, users=4):
+    t0 = 1631106796000
+    return [(f'user{i % users}', 'bvp', t0 + (i // users) * 16, float(i % 100) / 100.0, None)
+            for i in range(n)]
+
+
+def bench_plain(path, rows, batch):
+    """Stesso schema (WAL, indici) ma con l'indice (username, sensor, timestamp) non unico."""
+    config.DATABASE_URL = path
+    db.init_db()
+    with db.get_conn() as con:
+        con.execute('DROP INDEX uq_readings_user_sensor_ts')
+        con.execute('CREATE INDEX idx_readings_user_sensor_ts ON readings(username, sensor, timestamp)')
+        con.commit()
+    t0 = time.perf_counter()
+    for i in range(0, len(rows), batch):
+        with db.transaction() as con:
+            con.executemany('INSERT INTO readings(username,sensor,timestamp,value,ax,ay,az) '
+                            'VALUES(?,?,?,?,?,?,?)',
+                            [(u, s, t, v, None, None, None) for u, s, t, v, _ in rows[i:i + batch]])
+    return time.perf_counter() - t0
+
+
+def bench_dedup(path, rows, batch):
+    config.DATABASE_URL = path
+    db.init_db()
+    t0 = time.perf_counter()
+    for i in range(0, len(rows), batch):
+        ingest_batch(rows[i:i + batch], device_id='bench', seq=i // batch + 1)
+    first = time.perf_counter() - t0
+
+    # reinvio senza seq: ogni riga passa dal controllo della chiave unica
+    t0 = time.perf_counter()
+    for i in range(0, len(rows), batch):
+        res = ingest_batch(rows[i:i + batch])
+        assert res['inserted'] == 0
+    resend = time.perf_counter() - t0
+
+    # reinvio con seq già confermato: scartato senza toccare readings
+    t0 = time.perf_counter()
+    for i in range(0, len(rows), batch):
+        assert ingest_batch(rows[i:i + batch], device_id='bench', seq=i // batch + 1)['duplicate']
+    resend_seq = time.perf_counter() - t0
+    return first, resend, resend_seq
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Throughput di ingestione con e senza deduplicazione')
+    ap.add_argument('--rows', type=int, default=200000)
+    ap.add_argument('--batch', type=int, default=500)
+    ap.add_argument('--json', help='Salva i risultati in questo file JSON')
+    args = ap.parse_args()
+
+    rows = make_rows(args.rows)
+    tmp = tempfile.mkdtemp(prefix='bench_dedup_')
+    plain = bench_plain(os.path.join(tmp, 'plain.db'), rows, args.batch)
+    first, resend, resend_seq = bench_dedup(os.path.join(tmp, 'dedup.db'), rows, args.batch)
+
+    n = len(rows)
+    res = {
+        'rows': n, 'batch': args.batch,
+        'plain_insert_rows_per_s': n / plain,
+        'dedup_insert_rows_per_s': n / first,
+        'dedup_overhead_pct': (first / plain - 1.0) * 100.0,
+        'resend_unique_key_rows_per_s': n / resend,
+        'resend_seq_rows_per_s': n / resend_seq,
+    }
+    print(f"[BENCH][DEDUP] {n} righe, batch da {args.batch}")
+    print(f"  INSERT (indice non unico)       {res['plain_insert_rows_per_s']:12,.0f} righe/s")
+    print(f"  INSERT OR IGNORE (UNIQUE + seq) {res['dedup_insert_rows_per_s']:12,.0f} righe/s"
+          f"  ({res['dedup_overhead_pct']:+.1f}%)")
+    print(f"  reinvio, solo chiave unica      {res['resend_unique_key_rows_per_s']:12,.0f} righe/s")
+    print(f"  reinvio, seq già confermato     {res['resend_seq_rows_per_s']:12,.0f} righe/s")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(res, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Costo per campione dei rilevatori di anomalie.
+
+Sulla serie BVP (64 Hz) di data_samples/<utente>/ misura:
+  - update() puro di ogni rilevatore in streaming (detectors.REGISTRY)
+  - detectors.feed() per campione (lock, cache dello stream, persistenza periodica)
+  - moving_average_anomaly (una query SQL per lettura) su un DB temporaneo
+e il numero di allarmi prodotti.
+
+    python bench/bench_detectors.py [--user alice] [--sql-samples 5000] [--json out.json]
+"""
+import os, sys, json, time, argparse, tempfile
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.append(os.path.join(ROOT, 'app'))
+
+import config
+import db
+import detectors
+from ingest import CSV_FILES, ingest_batch, to_epoch_ms
+
+
+def load_bvp(user):
+    arr = np.loadtxt(os.path.join(ROOT, 'data_samples', user, CSV_FILES['bvp']),
+                     delimiter=',', skiprows=1, ndmin=2)
+    return to_epoch_ms(arr[:, 0]).tolist(), arr[:, 1].tolist()
+
+
+def bench_update(name, ts, vals):
+    det = detectors.create(name, 'bvp')
+    alerts = 0
+    t0 = time.perf_counter()
+    for t, v in zip(ts, vals):
+        if det.update(t, v) is not None:
+            alerts += 1
+    return (time.perf_counter() - t0) / len(ts), alerts
+
+
+def bench_feed(name, ts, vals):
+    t0 = time.perf_counter()
+    alerts = 0
+    for t, v in zip(ts, vals):
+        alerts += len(detectors.feed('bench', 'bvp', name, [(t, v)]))
+    return (time.perf_counter() - t0) / len(ts), alerts
+
+
+def bench_sql(ts, vals, n):
+    """Costo della query di moving_average_anomaly per lettura (soglia irraggiungibile: nessuna scrittura)."""
+    import analytics
+    ingest_batch([('bench', 'bvp', t, v, None) for t, v in zip(ts[:n], vals[:n])])
+    config.THRESHOLDS = dict(config.THRESHOLDS, bvp=float('inf'))
+    t0 = time.perf_counter()
+    for _ in range(n):
+        analytics.moving_average_anomaly('bench', 'bvp')
+    return (time.perf_counter() - t0) / n
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Costo per campione dei rilevatori di anomalie')
+    ap.add_argument('--user', default='alice')
+    ap.add_argument('--sql-samples', type=int, default=5000, help='Campioni per la misura SQL')
+    ap.add_argument('--json', help='Salva i risultati in questo file JSON')
+    args = ap.parse_args()
+
+    ts, vals = load_bvp(args.user)
+    config.DATABASE_URL = os.path.join(tempfile.mkdtemp(prefix='bench_det_'), 'det.db')
+    config.DETECTOR_PERSIST_SEC = 30
+    db.init_db()
+
+    res = {'samples': len(ts), 'detectors': {}}
+    print(f"[BENCH][DETECTORS] BVP {args.user}: {len(ts)} campioni")
+    for name in detectors.REGISTRY:
+        upd, alerts = bench_update(name, ts, vals)
+        feed, _ = bench_feed(name, ts, vals)
+        res['detectors'][name] = {'update_us': upd * 1e6, 'feed_us': feed * 1e6, 'alerts': alerts}
+        print(f"  {name:14s} update {upd * 1e6:7.2f} µs/campione   feed {feed * 1e6:7.2f} µs/campione"
+              f"   allarmi {alerts}")
+    sql = bench_sql(ts, vals, min(args.sql_samples, len(ts)))
+    res['detectors']['moving_average_sql'] = {'update_us': sql * 1e6}
+    print(f"  {'moving_avg SQL':14s} {sql * 1e6:7.2f} µs/campione (query per lettura)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(res, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
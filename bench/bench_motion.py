@@ -0,0 +1,94 @@
+"""
+Allarmi HR/EDA con e senza soppressione durante il movimento (motion.py).
+
+Importa le sessioni di data_samples/ in un DB temporaneo e, per ogni utente e
+sensore di config.MOTION_SENSORS, conta gli allarmi di analytics.anomaly_rows
+con MOTION_MODE='off' e 'suppress', sia con la media mobile storica (default)
+sia col rilevatore a finestra temporale. Misura poi il costo in diretta: motion.observe per
+lettura ACC e motion.level per lettura HR/EDA (solo memoria, nessuna query).
+
+    python bench/bench_motion.py [--user alice] [--json out.json]
+"""
+import os, sys, json, time, argparse, tempfile
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.append(os.path.join(ROOT, 'app'))
+
+import config
+import db
+import bulk
+import motion
+from analytics import anomaly_rows
+
+SAMPLES = os.path.join(ROOT, 'data_samples')
+
+
+def count_alerts(user, sensor, detector, mode):
+    config.DETECTORS = dict(config.DETECTORS, **{sensor: detector})
+    config.MOTION_MODE = mode
+    t0 = time.perf_counter()
+    rows = anomaly_rows(user, sensor)
+    return len(rows), time.perf_counter() - t0
+
+
+def live_cost(session):
+    """Repliche in ordine di tempo: µs per observe (ACC) e per level (HR/EDA)."""
+    motion.reset()
+    acc_ts, acc_v, _ = session['acc']
+    acc = list(zip(acc_ts.tolist(), acc_v.tolist()))
+    t0 = time.perf_counter()
+    for s in acc:
+        motion.observe('bench', [s])
+    t_obs = (time.perf_counter() - t0) / len(acc)
+
+    ts = np.concatenate([session[s][0] for s in config.MOTION_SENSORS if s in session])
+    t0 = time.perf_counter()
+    for t in ts.tolist():
+        motion.level('bench', t)
+    t_lvl = (time.perf_counter() - t0) / max(1, ts.size)
+    return t_obs, t_lvl
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Allarmi HR/EDA con soppressione durante il movimento')
+    ap.add_argument('--user', action='append', help='Solo questi utenti (default: tutti in data_samples/)')
+    ap.add_argument('--json', help='Salva i risultati in questo file JSON')
+    args = ap.parse_args()
+
+    users = args.user or sorted(d for d in os.listdir(SAMPLES) if os.path.isdir(os.path.join(SAMPLES, d)))
+    config.DATABASE_URL = os.path.join(tempfile.mkdtemp(prefix='bench_motion_'), 'motion.db')
+    db.init_db()
+
+    detectors_ = ['moving_average', 'window']
+    res = {'motion_high': config.MOTION_HIGH, 'users': {}}
+    totals = {d: [0, 0] for d in detectors_}
+    print(f"[BENCH][MOTION] soglia movimento {config.MOTION_HIGH} g, finestra {config.MOTION_WINDOW_SEC}s")
+    print(f"  {'utente':12s} {'sensore':7s} {'rilevatore':15s} {'senza':>7s} {'con':>7s} {'ms (con)':>9s}")
+    for user in users:
+        session = bulk.read_session(os.path.join(SAMPLES, user))
+        bulk.load_session(user, session, backfill=False)
+        res['users'][user] = {}
+        for sensor in config.MOTION_SENSORS:
+            for det in detectors_:
+                off, _ = count_alerts(user, sensor, det, 'off')
+                on, secs = count_alerts(user, sensor, det, 'suppress')
+                totals[det][0] += off
+                totals[det][1] += on
+                res['users'][user][f'{sensor}:{det}'] = {'off': off, 'suppress': on, 'seconds': secs}
+                print(f"  {user:12s} {sensor:7s} {det:15s} {off:7d} {on:7d} {secs * 1000:9.1f}")
+
+    for det, (off, on) in totals.items():
+        print(f"  totale {det:15s}: {off} -> {on} allarmi ({100 * (1 - on / off) if off else 0:.0f}% soppressi)")
+    t_obs, t_lvl = live_cost(bulk.read_session(os.path.join(SAMPLES, users[0])))
+    res['totals'] = totals
+    res['live'] = {'observe_us': t_obs * 1e6, 'level_us': t_lvl * 1e6}
+    print(f"  in diretta: observe {t_obs * 1e6:.2f} µs/lettura ACC, level {t_lvl * 1e6:.2f} µs/lettura HR-EDA")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(res, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
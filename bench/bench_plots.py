@@ -0,0 +1,87 @@
+"""
+Throughput del rendering dei grafici al variare dei processi (render.py).
+
+Simula una dashboard: --threads richieste concorrenti (come i thread del server
+Flask) chiedono i grafici dei 6 sensori per gli utenti di data_samples/, ripetuti
+--rounds volte. Per ogni numero di processi (0 = nel thread della richiesta, GIL
+condiviso) misura grafici/s e latenza p50/p95. L'avvio del pool e l'import di
+matplotlib nei processi sono esclusi (riscaldamento prima della misura).
+Con --overview misura anche la stessa dashboard con una panoramica per utente
+(/plots/user/<username>.png): richieste HTTP e tempo totale a confronto.
+
+    python bench/bench_plots.py [--workers 0,1,2,4] [--threads 8] [--rounds 2] [--overview] [--json out.json]
+"""
+import os, sys, json, time, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.append(os.path.join(ROOT, 'app'))
+
+import config
+import render
+
+SAMPLES = os.path.join(ROOT, 'data_samples')
+
+
+def run(jobs, threads, fn=render.render):
+    lat = []
+
+    def one(job):
+        t0 = time.perf_counter()
+        png = fn(*job)
+        lat.append(time.perf_counter() - t0)
+        return len(png)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(threads) as ex:
+        sizes = list(ex.map(one, jobs))
+    wall = time.perf_counter() - t0
+    lat.sort()
+    return {
+        'plots': len(sizes),
+        'seconds': wall,
+        'plots_per_sec': len(sizes) / wall,
+        'p50_ms': lat[len(lat) // 2] * 1000,
+        'p95_ms': lat[int(len(lat) * 0.95) - 1] * 1000,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Grafici/s al variare dei processi di rendering')
+    ap.add_argument('--workers', default=f"0,1,2,{os.cpu_count() or 1}", help='Elenco di PLOT_WORKERS')
+    ap.add_argument('--threads', type=int, default=8, help='Richieste concorrenti')
+    ap.add_argument('--rounds', type=int, default=2)
+    ap.add_argument('--overview', action='store_true', help='Confronta con le panoramiche per utente')
+    ap.add_argument('--json', help='Salva i risultati in questo file JSON')
+    args = ap.parse_args()
+
+    users = sorted(d for d in os.listdir(SAMPLES) if os.path.isdir(os.path.join(SAMPLES, d)))
+    jobs = [(u, s, 'all') for _ in range(args.rounds) for u in users for s in config.SENSORS]
+    ov_jobs = [('user', u, 'all') for _ in range(args.rounds) for u in users]
+    config.PLOT_QUEUE_MAX = len(jobs) + 1
+    config.PLOT_TIMEOUT_SEC = 600
+
+    res = {'cpus': os.cpu_count(), 'threads': args.threads, 'runs': {}}
+    print(f"[BENCH][PLOTS] {len(jobs)} grafici, {args.threads} richieste concorrenti, {os.cpu_count()} CPU")
+    for w in sorted({int(x) for x in args.workers.split(',') if x.strip()}):
+        config.PLOT_WORKERS = w
+        render.shutdown()
+        run([jobs[0]] * max(1, w), max(1, w))   # avvio processi + import matplotlib
+        r = run(jobs, args.threads)
+        res['runs'][w] = r
+        print(f"  processi {w}: {r['plots_per_sec']:6.2f} grafici/s   p50 {r['p50_ms']:7.1f} ms"
+              f"   p95 {r['p95_ms']:7.1f} ms")
+        if args.overview:
+            run([ov_jobs[0]] * max(1, w), max(1, w), render.render_overview)
+            o = run(ov_jobs, args.threads, render.render_overview)
+            res['runs'][f'{w}:overview'] = o
+            print(f"    panoramiche: {len(jobs)} -> {len(ov_jobs)} richieste, "
+                  f"{r['seconds']:6.2f} -> {o['seconds']:6.2f} s   p50 {o['p50_ms']:7.1f} ms")
+    render.shutdown()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(res, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
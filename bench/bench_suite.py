@@ -0,0 +1,369 @@
+"""
+Suite di benchmark end-to-end sull'app Flask vera (test client), con dati sintetici.
+
+Genera con synth.py --users × --days sessioni E4 in una cartella temporanea (CSV per
+grafici/feeder, DATA_SAMPLES_DIR) e usa un DB SQLite nuovo nella stessa cartella.
+Scenari, nell'ordine:
+  - ingest_single  POST /api/sensor_data una lettura per richiesta (--single letture HR)
+  - ingest_batch   POST /api/sensor_data a batch di --batch letture in ordine di tempo,
+                   righe JSON o formato colonnare di wire.py (--format): letture/s
+  - dashboard / analytics   latenza a cache fredda (pagecache svuotata) e calda
+  - plots          /plot/<sensore>/<utente>.png, /plots/user/<utente>.png, /api/series
+  - export         /admin/export_user_csv per ogni utente: latenza e righe/s
+Firestore ed email sono esclusi (FIRESTORE_SYNC=0, EMAIL_MODE=console) e così i thread
+in background (feeder, compattatore): si misura solo il lavoro dell'app.
+
+Il risultato (commit git, parametri, macchina, scenari) va in JSON, di default
+bench/results/suite-<commit>.json; con --compare confronta con un'esecuzione
+precedente ed esce con codice 1 se una latenza o un throughput peggiora oltre --tolerance.
+
+    python bench/bench_suite.py [--users 2] [--days 2] [--minutes 10] [--batch 500]
+                                [--format rows|columnar] [--repeat 5] [--plot-workers 0]
+                                [--json out.json] [--compare vecchio.json] [--verbose]
+"""
+import os, sys, io, json, math, time, shutil, platform, argparse, tempfile, subprocess, contextlib
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.append(os.path.join(ROOT, 'app'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True,
+                              timeout=10).stdout.strip()
+    except Exception:
+        return ''
+
+
+def commit_id():
+    """Hash corto del commit corrente, con '-dirty' se ci sono modifiche non committate."""
+    sha = _git('rev-parse', '--short', 'HEAD') or 'unknown'
+    dirty = _git('status', '--porcelain', '--untracked-files=no')
+    return sha + ('-dirty' if dirty else '')
+
+
+def latency(samples):
+    """Statistiche (ms) di una lista di durate in secondi."""
+    lat = sorted(samples)
+    n = len(lat)
+    if not n:
+        return {'n': 0}
+    return {
+        'n': n,
+        'mean_ms': round(sum(lat) / n * 1000, 3),
+        'p50_ms': round(lat[n // 2] * 1000, 3),
+        'p95_ms': round(lat[min(n - 1, math.ceil(n * 0.95) - 1)] * 1000, 3),
+        'max_ms': round(lat[-1] * 1000, 3),
+    }
+
+
+def timed_get(client, url, times, before=None):
+    """GET ripetuta `times` volte; before() eseguita (fuori misura) prima di ognuna."""
+    lat = []
+    size = 0
+    for _ in range(times):
+        if before:
+            before()
+        t0 = time.perf_counter()
+        r = client.get(url)
+        lat.append(time.perf_counter() - t0)
+        if r.status_code != 200:
+            raise RuntimeError(f'{url}: HTTP {r.status_code}')
+        size = len(r.data)
+    return lat, size
+
+
+def _readings(name, days):
+    """Letture JSON di un utente (tutti i sensori) in ordine di tempo, come le invierebbe un gateway."""
+    import numpy as np
+    rows = []
+    for sess in days:
+        for sensor, df in sess.items():
+            ts = df['timestamp'].to_numpy()
+            if sensor == 'acc':
+                for t, ax, ay, az in zip(ts.tolist(), df['ax'].tolist(), df['ay'].tolist(), df['az'].tolist()):
+                    rows.append({'username': name, 'sensor': sensor, 'timestamp': t, 'ax': ax, 'ay': ay, 'az': az})
+            else:
+                vals = df.iloc[:, 1].to_numpy()
+                if sensor == 'ibi':
+                    vals = vals / 1000.0        # durata in s, come nel DB
+                for t, v in zip(ts.tolist(), np.asarray(vals).tolist()):
+                    rows.append({'username': name, 'sensor': sensor, 'timestamp': t, 'value': v})
+    rows.sort(key=lambda r: r['timestamp'])
+    return rows
+
+
+def _columnar(name, days, batch_sec):
+    """Payload colonnari (wire.py) di batch_sec secondi ciascuno, tutti i sensori per finestra."""
+    import wire
+    payloads = []
+    for sess in days:
+        t_start = min(int(df['timestamp'].iloc[0]) for df in sess.values() if len(df))
+        t_end = max(int(df['timestamp'].iloc[-1]) for df in sess.values() if len(df))
+        for lo in range(t_start, t_end + 1, int(batch_sec * 1000)):
+            hi = lo + int(batch_sec * 1000)
+            series, n = [], 0
+            for sensor, df in sess.items():
+                part = df[(df['timestamp'] >= lo) & (df['timestamp'] < hi)]
+                if not len(part):
+                    continue
+                ts = part['timestamp'].to_numpy()
+                if sensor == 'acc':
+                    s = wire.encode_series(name, sensor, ts, axes=(part['ax'].to_numpy(), part['ay'].to_numpy(),
+                                                                   part['az'].to_numpy()))
+                else:
+                    vals = part.iloc[:, 1].to_numpy()
+                    s = wire.encode_series(name, sensor, ts, vals / 1000.0 if sensor == 'ibi' else vals)
+                series.append(s)
+                n += len(part)
+            if series:
+                payloads.append((n, json.dumps({'series': series})))
+    return payloads
+
+
+def scenario_ingest_single(client, sessions, count):
+    """Una lettura per richiesta: HR del primo utente, con username a parte (nessun duplicato col batch)."""
+    name = next(iter(sessions))
+    hr = sessions[name][0]['hr']
+    lat = []
+    for t, v in list(zip(hr['timestamp'].tolist(), hr['hr'].tolist()))[:count]:
+        body = json.dumps({'username': name + '_single', 'sensor': 'hr', 'timestamp': t, 'value': v})
+        t0 = time.perf_counter()
+        r = client.post('/api/sensor_data', data=body, content_type='application/json')
+        lat.append(time.perf_counter() - t0)
+        if r.status_code != 200:
+            raise RuntimeError(f'/api/sensor_data: HTTP {r.status_code} {r.data[:200]!r}')
+    total = sum(lat)
+    return dict(latency(lat), readings=len(lat), readings_per_sec=round(len(lat) / total, 1) if total else None)
+
+
+def scenario_ingest_batch(client, sessions, batch, fmt):
+    """Tutte le letture di tutti gli utenti, a batch. Payload preparati prima della misura."""
+    payloads = []
+    for name, days in sessions.items():
+        if fmt == 'columnar':
+            # finestra tale che un batch contenga circa `batch` letture (~129 letture/s per utente)
+            payloads.extend(_columnar(name, days, max(1.0, batch / 129.0)))
+        else:
+            rows = _readings(name, days)
+            payloads.extend((len(rows[i:i + batch]), json.dumps({'readings': rows[i:i + batch]}))
+                            for i in range(0, len(rows), batch))
+    lat = []
+    inserted = 0
+    t_all = time.perf_counter()
+    for n, body in payloads:
+        t0 = time.perf_counter()
+        r = client.post('/api/sensor_data', data=body, content_type='application/json')
+        lat.append(time.perf_counter() - t0)
+        if r.status_code != 200:
+            raise RuntimeError(f'/api/sensor_data: HTTP {r.status_code} {r.data[:200]!r}')
+        inserted += r.get_json().get('inserted', 0)
+    wall = time.perf_counter() - t_all
+    readings = sum(n for n, _ in payloads)
+    from db import query_all
+    anomalies = query_all('SELECT COUNT(*) n FROM anomalies')[0]['n']
+    return dict(latency(lat), format=fmt, requests=len(payloads), readings=readings, inserted=inserted,
+                anomalies=anomalies, seconds=round(wall, 3), readings_per_sec=round(readings / wall, 1),
+                payload_bytes=sum(len(b) for _, b in payloads))
+
+
+def scenario_pages(client, users, days, repeat):
+    import pagecache
+    out = {}
+    pages = [('dashboard', f'/dashboard?days={days}')]
+    pages += [('analytics', f'/analytics?user_id={u}&days={days}') for u in users]
+    for kind in ('dashboard', 'analytics'):
+        urls = [url for k, url in pages if k == kind]
+        cold, warm = [], []
+        for url in urls:
+            lat, _ = timed_get(client, url, repeat, before=pagecache.clear)
+            cold += lat
+            timed_get(client, url, 1)
+            lat, size = timed_get(client, url, repeat)
+            warm += lat
+        out[kind] = {'cold': latency(cold), 'warm': latency(warm), 'html_bytes': size}
+    return out
+
+
+def scenario_plots(client, users, days, repeat):
+    import config
+    user = users[0]
+    sensors = {}
+    for s in config.SENSORS:
+        timed_get(client, f'/plot/{s}/{user}.png?days={days}', 1)        # riscaldamento (CSV, figure)
+        lat, size = timed_get(client, f'/plot/{s}/{user}.png?days={days}', repeat)
+        sensors[s] = dict(latency(lat), png_bytes=size)
+    all_lat = [sensors[s]['p50_ms'] for s in config.SENSORS]
+    timed_get(client, f'/plots/user/{user}.png?days={days}', 1)
+    ov, ov_size = timed_get(client, f'/plots/user/{user}.png?days={days}', repeat)
+    timed_get(client, f'/api/series/bvp/{user}?days={days}&format=bin', 1)
+    series, series_size = timed_get(client, f'/api/series/bvp/{user}?days={days}&format=bin', repeat)
+    return {
+        'sensor_png': sensors,
+        'sensor_png_p50_sum_ms': round(sum(all_lat), 3),
+        'overview_png': dict(latency(ov), png_bytes=ov_size),
+        'series_bvp_bin': dict(latency(series), bytes=series_size),
+    }
+
+
+def scenario_export(client, users, repeat):
+    from db import query_all
+    out = {}
+    lat_all, rows_all = [], 0
+    for u in users:
+        rows = query_all('SELECT COUNT(*) n FROM readings WHERE username=?', (u,))[0]['n']
+        lat, size = timed_get(client, f'/admin/export_user_csv?username={u}', repeat)
+        lat_all += lat
+        rows_all += rows * repeat
+        out[u] = dict(latency(lat), rows=rows, csv_bytes=size)
+    total = sum(lat_all)
+    return {'users': out, 'all': dict(latency(lat_all), rows_per_sec=round(rows_all / total, 1) if total else None)}
+
+
+def _flatten(d, prefix=''):
+    for k, v in d.items():
+        key = f'{prefix}.{k}' if prefix else str(k)
+        if isinstance(v, dict):
+            yield from _flatten(v, key)
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            yield key, v
+
+
+def compare(old, new, tolerance):
+    """Stampa le variazioni di latenze (p50) e throughput (_per_sec); ritorna le regressioni oltre tolerance."""
+    old_m, new_m = dict(_flatten(old['results'])), dict(_flatten(new['results']))
+    regressions = []
+    print(f"[BENCH][SUITE] confronto {old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    for key, v in new_m.items():
+        higher_is_better = key.endswith('_per_sec')
+        if not (higher_is_better or key.endswith('p50_ms')) or not old_m.get(key):
+            continue
+        change = (v - old_m[key]) / old_m[key]
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > tolerance:
+            flag = '  << peggiorato'
+            regressions.append(key)
+        elif worse < -tolerance:
+            flag = '  (migliorato)'
+        print(f"  {key:55s} {old_m[key]:12.2f} -> {v:12.2f}  {change * 100:+6.1f}%{flag}")
+    if old['meta'].get('params') != new['meta'].get('params'):
+        print('  [WARN] parametri diversi tra le due esecuzioni: confronto solo indicativo')
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark end-to-end dell\'app con dati E4 sintetici')
+    ap.add_argument('--users', type=int, default=2)
+    ap.add_argument('--days', type=int, default=2)
+    ap.add_argument('--minutes', type=float, default=10, help='Durata della sessione giornaliera')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--batch', type=int, default=500, help='Letture per POST nello scenario batch')
+    ap.add_argument('--format', choices=('rows', 'columnar'), default='rows', help='Formato dei batch')
+    ap.add_argument('--single', type=int, default=200, help='Letture inviate una per richiesta')
+    ap.add_argument('--repeat', type=int, default=5, help='Ripetizioni per pagina/grafico/export')
+    ap.add_argument('--plot-workers', type=int, default=0, help='PLOT_WORKERS durante la suite')
+    ap.add_argument('--workdir', help='Cartella di lavoro (default: temporanea, rimossa alla fine)')
+    ap.add_argument('--json', help='File dei risultati (default bench/results/suite-<commit>.json)')
+    ap.add_argument('--compare', help='Risultati precedenti da confrontare')
+    ap.add_argument('--tolerance', type=float, default=0.2, help='Peggioramento relativo ammesso con --compare')
+    ap.add_argument('--verbose', action='store_true', help='Mostra i log dell\'app')
+    args = ap.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='healthmon-bench-')
+    samples = os.path.join(workdir, 'data_samples')
+    db_path = os.path.join(workdir, 'bench.db')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    # prima di importare l'app: config legge l'ambiente all'import
+    os.environ.update({
+        'DATABASE_URL': db_path, 'DATA_SAMPLES_DIR': samples, 'PLOT_WORKERS': str(args.plot_workers),
+        'EMAIL_MODE': 'console', 'FIRESTORE_SYNC': '0', 'FEEDER_SUPERVISOR': '0', 'COMPACTOR': '0',
+    })
+    import synth
+
+    meta = {
+        'commit': commit_id(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'params': {k: getattr(args, k) for k in ('users', 'days', 'minutes', 'seed', 'batch', 'format',
+                                                 'single', 'repeat', 'plot_workers')},
+    }
+    results = {}
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        t0 = time.perf_counter()
+        sessions = synth.generate(args.users, args.days, args.minutes, seed=args.seed)
+        rows = synth.write_csv(sessions, samples)
+        results['synth'] = {'seconds': round(time.perf_counter() - t0, 3), 'rows': rows}
+        print(f"[BENCH][SUITE] {meta['commit']}: {args.users} utenti × {args.days} giorni × {args.minutes:g} min, "
+              f"{sum(rows.values())} letture in {workdir}")
+
+        with quiet:
+            t0 = time.perf_counter()
+            import app as webapp
+            import auth, render
+            flask_app = webapp.create_app({'TESTING': True, 'FEEDER_SUPERVISOR': False, 'COMPACTOR': False})
+            for name in sessions:
+                auth.create_user(name, f'{name}@example.org', 'bench', 'user')
+            results['startup_sec'] = round(time.perf_counter() - t0, 3)
+            client = flask_app.test_client()
+            if client.post('/login', data={'username': 'admin', 'password': 'admin123'}).status_code != 302:
+                raise RuntimeError('login admin fallito')
+
+        users = list(sessions)
+        days = args.days + 1
+        steps = [
+            ('ingest_single', lambda: scenario_ingest_single(client, sessions, args.single)),
+        ] if args.single > 0 else []
+        steps += [
+            ('ingest_batch', lambda: scenario_ingest_batch(client, sessions, args.batch, args.format)),
+            ('pages', lambda: scenario_pages(client, users, days, args.repeat)),
+            ('plots', lambda: scenario_plots(client, users, days, args.repeat)),
+            ('export', lambda: scenario_export(client, users, args.repeat)),
+        ]
+        for name, fn in steps:
+            t0 = time.perf_counter()
+            with quiet:
+                results[name] = fn()
+            print(f"[BENCH][SUITE] {name:14s} {time.perf_counter() - t0:7.1f}s  {_headline(name, results[name])}")
+        with quiet:
+            render.shutdown()
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    out = {'meta': meta, 'results': results}
+    path = args.json or os.path.join(ROOT, 'bench', 'results', f"suite-{meta['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(out, f, indent=2)
+    print(f'[BENCH][SUITE] risultati in {path}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), out, args.tolerance)
+        if regressions:
+            print(f'[BENCH][SUITE] {len(regressions)} metriche peggiorate oltre il {args.tolerance:.0%}')
+            sys.exit(1)
+
+
+def _headline(name, r):
+    if name.startswith('ingest'):
+        return f"{r['readings_per_sec']:10.0f} letture/s   p50 {r['p50_ms']:8.1f} ms"
+    if name == 'pages':
+        return '   '.join(f"{k} fredda {v['cold']['p50_ms']:.1f} / calda {v['warm']['p50_ms']:.1f} ms"
+                          for k, v in r.items())
+    if name == 'plots':
+        return (f"PNG sensore p50 {r['sensor_png']['hr']['p50_ms']:.1f} ms (hr)   "
+                f"panoramica {r['overview_png']['p50_ms']:.1f} ms   serie {r['series_bvp_bin']['p50_ms']:.1f} ms")
+    if name == 'export':
+        return f"{r['all']['rows_per_sec']:10.0f} righe/s   p50 {r['all']['p50_ms']:8.1f} ms"
+    return ''
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Byte sul filo e costo di decodifica dei formati di upload di /api/sensor_data.
+
+Per tutte le serie di data_samples/*/ confronta:
+  - json_rows       batch attuale {"readings": [{username, sensor, timestamp, value}, ...]}
+  - json_columnar   formato colonnare di wire.py in JSON
+  - msgpack / cbor  formato colonnare (liste), se la libreria è installata
+  - msgpack_bin / cbor_bin   array come byte grezzi (dt nel tipo intero minimo, valori float32)
+ognuno senza compressione, gzip e (se disponibile) zstd. La decodifica è misurata
+fino alle righe pronte per ingest.ingest_batch (decompressione inclusa).
+
+    python bench/bench_wire.py [--repeat 5] [--json out.json]
+"""
+import os, sys, json, gzip, glob, time, argparse
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.append(os.path.join(ROOT, 'app'))
+
+import wire
+from ingest import CSV_FILES, parse_reading, to_epoch_ms
+
+
+def load_series():
+    """Lista di serie (username, sensor, ts_ms, values, axes) dai CSV di esempio."""
+    out = []
+    for folder in sorted(glob.glob(os.path.join(ROOT, 'data_samples', '*'))):
+        uname = os.path.basename(folder)
+        for sensor, fname in CSV_FILES.items():
+            path = os.path.join(folder, fname)
+            if not os.path.exists(path):
+                continue
+            arr = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+            if not arr.size:
+                continue
+            ts = to_epoch_ms(arr[:, 0])
+            if sensor == 'acc':
+                out.append((uname, sensor, ts, None, (arr[:, 1], arr[:, 2], arr[:, 3])))
+            else:
+                vals = arr[:, 1] / 1000.0 if sensor == 'ibi' else arr[:, 1]
+                out.append((uname, sensor, ts, vals, None))
+    return out
+
+
+def _min_int_dtype(a):
+    for dt in ('<i1', '<i2', '<i4'):
+        info = np.iinfo(np.dtype(dt))
+        if not a.size or (info.min <= a.min() and a.max() <= info.max):
+            return dt
+    return '<i8'
+
+
+def _binary_series(u, s, ts, vals, axes):
+    dt = np.diff(ts)
+    out = {'username': u, 'sensor': s, 't0': int(ts[0]), 'dtype': {}}
+    out['dtype']['dt'] = _min_int_dtype(dt)
+    out['dt'] = dt.astype(out['dtype']['dt']).tobytes()
+    cols = zip(('ax', 'ay', 'az'), axes) if axes is not None else [('values', vals)]
+    for k, a in cols:
+        out['dtype'][k] = '<f4'
+        out[k] = np.asarray(a, dtype='<f4').tobytes()
+    return out
+
+
+def payloads(series):
+    """{nome formato: (mimetype, bytes non compressi)}"""
+    rows = []
+    for u, s, ts, vals, axes in series:
+        if axes is not None:
+            rows += [{'username': u, 'sensor': s, 'timestamp': t, 'ax': x, 'ay': y, 'az': z}
+                     for t, x, y, z in zip(ts.tolist(), *(a.tolist() for a in axes))]
+        else:
+            rows += [{'username': u, 'sensor': s, 'timestamp': t, 'value': v}
+                     for t, v in zip(ts.tolist(), vals.tolist())]
+    columnar = {'device_id': 'bench', 'seq': 1,
+                'series': [wire.encode_series(u, s, ts, vals, axes) for u, s, ts, vals, axes in series]}
+    binary = {'device_id': 'bench', 'seq': 1, 'series': [_binary_series(*x) for x in series]}
+
+    out = {
+        'json_rows': ('application/json', json.dumps({'device_id': 'bench', 'seq': 1, 'readings': rows}).encode()),
+        'json_columnar': ('application/json', json.dumps(columnar).encode()),
+    }
+    try:
+        import msgpack
+        out['msgpack'] = ('application/msgpack', msgpack.packb(columnar))
+        out['msgpack_bin'] = ('application/msgpack', msgpack.packb(binary))
+    except ImportError:
+        print('[BENCH][WIRE] msgpack non installato: formato saltato')
+    try:
+        import cbor2
+        out['cbor'] = ('application/cbor', cbor2.dumps(columnar))
+        out['cbor_bin'] = ('application/cbor', cbor2.dumps(binary))
+    except ImportError:
+        print('[BENCH][WIRE] cbor2 non installato: formato saltato')
+    return out
+
+
+def compressors():
+    out = {'identity': lambda b: b, 'gzip': lambda b: gzip.compress(b, 6)}
+    try:
+        import zstandard
+        out['zstd'] = zstandard.ZstdCompressor(level=3).compress
+    except ImportError:
+        print('[BENCH][WIRE] zstandard non installato: zstd saltato')
+    return out
+
+
+def decode_rows(body, mimetype, encoding):
+    """Stesso percorso di /api/sensor_data fino alle righe per ingest_batch."""
+    data = wire.loads(wire.decompress(body, encoding), mimetype)
+    if 'series' in data:
+        rows = []
+        for s in data['series']:
+            rows.extend(wire.to_rows(wire.decode_series(s)))
+        return rows
+    return [parse_reading(d) for d in data['readings']]
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Byte sul filo e decodifica: JSON vs colonnare msgpack/CBOR')
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--json', help='Salva i risultati in questo file JSON')
+    args = ap.parse_args()
+
+    series = load_series()
+    n = sum(len(x[2]) for x in series)
+    res = {'readings': n, 'formats': {}}
+    print(f"[BENCH][WIRE] {n} letture in {len(series)} serie")
+    print(f"  {'formato':14s} {'compr.':8s} {'byte':>11s} {'B/lettura':>10s} {'decodifica':>12s}")
+    comps = compressors()
+    for name, (mimetype, raw) in payloads(series).items():
+        for enc, compress in comps.items():
+            body = compress(raw)
+            assert len(decode_rows(body, mimetype, enc)) == n
+            t0 = time.perf_counter()
+            for _ in range(args.repeat):
+                decode_rows(body, mimetype, enc)
+            dec = (time.perf_counter() - t0) / args.repeat
+            res['formats'][f'{name}+{enc}'] = {'bytes': len(body), 'bytes_per_reading': len(body) / n,
+                                               'decode_s': dec, 'readings_per_s': n / dec}
+            print(f"  {name:14s} {enc:8s} {len(body):11,d} {len(body) / n:10.2f} {dec * 1000:9.1f} ms")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(res, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark del tempo di avvio: esegue `python -X importtime` sui moduli
+dell'app e riporta i tempi cumulativi di import (in ms).
+
+Esempi:
+    python bench/importtime.py
+    python bench/importtime.py --module app --top 15 --json bench_importtime.json
+    python bench/importtime.py --max-ms 400     # exit code 1 se si supera la soglia
+"""
+import os, sys, json, argparse, subprocess
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'app'))
+DEFAULT_MODULES = ['app', 'db', 'analytics', 'plots', 'firestore_db']
+
+
+def measure(module):
+    """Ritorna (totale_ms, [(modulo, self_ms, cumulative_ms), ...]) per `import module`."""
+    env = dict(os.environ)
+    env.setdefault('PYTHONDONTWRITEBYTECODE', '1')
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=APP_DIR, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f'import {module} fallito:\n{proc.stderr[-2000:]}')
+
+    entries = []
+    for line in proc.stderr.splitlines():
+        # formato: "import time:  self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cum_us, name = line[len('import time:'):].split('|', 2)
+            entries.append((name.rstrip(), int(self_us) / 1000.0, int(cum_us) / 1000.0))
+        except ValueError:
+            continue
+
+    total = next((cum for name, _, cum in reversed(entries) if name.strip() == module), None)
+    return total, entries
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Report -X importtime dei moduli dell\'app')
+    ap.add_argument('--module', action='append', help='Modulo da misurare (ripetibile)')
+    ap.add_argument('--top', type=int, default=10, help='Quanti import più lenti mostrare')
+    ap.add_argument('--json', help='Salva il report in questo file JSON')
+    ap.add_argument('--max-ms', type=float, help='Soglia (ms) per il primo modulo: oltre → exit 1')
+    args = ap.parse_args()
+
+    modules = args.module or DEFAULT_MODULES
+    report = {}
+    for mod in modules:
+        total, entries = measure(mod)
+        slowest = sorted(entries, key=lambda e: e[2], reverse=True)[:args.top]
+        report[mod] = {
+            'total_ms': total,
+            'top': [{'module': n.strip(), 'self_ms': s, 'cumulative_ms': c} for n, s, c in slowest],
+        }
+        print(f'[IMPORTTIME] {mod}: {total:.1f} ms')
+        for n, s, c in slowest:
+            print(f'    {c:9.1f} ms  (self {s:7.1f})  {n.strip()}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('[IMPORTTIME] report salvato in', args.json)
+
+    if args.max_ms is not None:
+        first = report[modules[0]]['total_ms'] or 0.0
+        if first > args.max_ms:
+            print(f'[IMPORTTIME][FAIL] {modules[0]}: {first:.1f} ms > {args.max_ms:.1f} ms')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Generatore di sessioni E4 sintetiche, nello stesso formato dei CSV di data_samples/.
+
+Frequenze e distribuzioni ricalcano i wrist_*.csv reali:
+  - acc  32 Hz, assi in g quantizzati a 1/64 (gravità + rumore, oscillazioni nei tratti di attività)
+  - bvp  64 Hz, onda pulsatile alla frequenza cardiaca, artefatti durante il movimento
+  - eda   4 Hz, livello tonico lognormale con deriva lenta + SCR (salita 1-3 s, discesa 4-10 s)
+  - temp  4 Hz, 33-36.5 °C con deriva lenta, passi da 0.02
+  - hr    1 Hz, baseline personale + random walk + aumento durante l'attività
+  - ibi   battiti ricavati dall'HR (ms, risoluzione 1/64 s) con buchi come nell'E4
+Attività (movimento) comune a tutti i sensori, così motion.py ha qualcosa da sopprimere.
+
+Una sessione al giorno per utente, alle `hour`, lunga `minutes`; stesso seed = stessi valori.
+
+    python bench/synth.py --users 3 --days 2 --minutes 20 --out /tmp/synth
+    -> /tmp/synth/<user>/wrist_*.csv
+"""
+import os, sys, time, argparse
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.append(os.path.join(ROOT, 'app'))
+
+from ingest import CSV_FILES
+
+RATES = {'acc': 32, 'bvp': 64, 'eda': 4, 'temp': 4, 'hr': 1}
+
+
+def _ar1(rng, n, phi, sigma):
+    """Random walk smorzato (AR(1)) lungo n campioni."""
+    e = rng.normal(0, sigma, n)
+    out = np.empty(n)
+    acc = 0.0
+    for i in range(n):           # n piccolo (1 Hz o sottocampionato): il ciclo non pesa
+        acc = phi * acc + e[i]
+        out[i] = acc
+    return out
+
+
+def _activity(rng, seconds):
+    """Intensità di movimento 0..1 al secondo: 1-3 tratti di 1-4 minuti, bordi smussati."""
+    m = np.zeros(seconds)
+    for _ in range(rng.integers(1, 4)):
+        length = int(rng.uniform(60, 240))
+        if length >= seconds:
+            continue
+        start = int(rng.integers(0, seconds - length))
+        m[start:start + length] = rng.uniform(0.5, 1.0)
+    k = np.ones(15) / 15
+    return np.clip(np.convolve(m, k, mode='same'), 0, 1)
+
+
+def _at(per_sec, t_sec):
+    """Valore per-secondo interpolato agli istanti t_sec."""
+    return np.interp(t_sec, np.arange(per_sec.size), per_sec)
+
+
+def session(rng, start_ms, minutes, profile):
+    """Dict sensore -> DataFrame con le colonne dei CSV E4 (timestamp in ms)."""
+    import pandas as pd
+    seconds = int(minutes * 60)
+    motion = _activity(rng, seconds)
+    out = {}
+
+    # HR 1 Hz
+    hr = profile['hr'] + _ar1(rng, seconds, 0.98, 0.6) + 35 * motion
+    hr = np.clip(hr, 45, 185)
+    t = np.arange(seconds)
+    out['hr'] = pd.DataFrame({'timestamp': start_ms + t * 1000, 'hr': np.round(hr, 2)})
+
+    # IBI: un battito ogni 60/HR secondi; l'E4 perde i battiti in movimento e a tratti
+    beats = [0.0]
+    while beats[-1] < seconds:
+        beats.append(beats[-1] + 60.0 / _at(hr, beats[-1]))
+    beats = np.array(beats[1:-1])
+    ibi = np.diff(np.r_[0.0, beats]) * (1 + rng.normal(0, 0.03, beats.size))
+    ibi = np.round(ibi * 64) / 64 * 1000                 # risoluzione 1/64 s, in ms
+    on = np.zeros(seconds, bool)                          # tratti con battiti validi (Markov on/off)
+    state, i = False, 0
+    while i < seconds:
+        length = int(rng.exponential(20 if state else 40)) + 1
+        on[i:i + length] = state
+        i += length
+        state = not state
+    keep = on[beats.astype(int)] & (_at(motion, beats) < 0.2)
+    keep[0] = False                                       # il primo intervallo non è un IBI
+    out['ibi'] = pd.DataFrame({'timestamp': start_ms + np.round(beats[keep] * 1000).astype(np.int64),
+                               'duration': ibi[keep]})
+
+    # BVP 64 Hz: onda pulsatile (con incisura dicrota) alla frequenza cardiaca
+    fs = RATES['bvp']
+    tb = np.arange(seconds * fs) / fs
+    phase = 2 * np.pi * np.cumsum(_at(hr, tb) / 60.0 / fs)
+    amp = profile['bvp_amp'] * (1 + 0.2 * np.sin(2 * np.pi * tb / 17))
+    bvp = amp * (np.sin(phase) + 0.5 * np.sin(2 * phase + 0.7))
+    bvp += rng.normal(0, 3, tb.size) + rng.normal(0, 1, tb.size) * 80 * _at(motion, tb)
+    out['bvp'] = pd.DataFrame({'timestamp': start_ms + np.round(tb * 1000).astype(np.int64),
+                               'bvp': np.round(bvp, 2)})
+
+    # EDA 4 Hz: tonica lognormale con deriva + SCR (più frequenti durante l'attività)
+    fs = RATES['eda']
+    te = np.arange(seconds * fs) / fs
+    tonic = profile['eda'] * np.exp(_at(_ar1(rng, seconds, 0.995, 0.01), te))
+    rate = (2 + 4 * _at(motion, te)) / 60.0 / fs          # SCR per campione
+    impulses = (rng.random(te.size) < rate) * rng.exponential(0.3, te.size) * np.sqrt(profile['eda'])
+    kt = np.arange(0, 30, 1 / fs)
+    kernel = (1 - np.exp(-kt / 1.5)) * np.exp(-kt / 6.0)
+    kernel /= kernel.max()
+    eda = np.clip(tonic + np.convolve(impulses, kernel)[:te.size] + rng.normal(0, 0.002, te.size), 0, None)
+    out['eda'] = pd.DataFrame({'timestamp': start_ms + np.round(te * 1000).astype(np.int64),
+                               'eda': np.round(eda, 6)})
+
+    # TEMP 4 Hz: deriva lenta, passi da 0.02 °C
+    temp = profile['temp'] + _at(_ar1(rng, seconds, 0.999, 0.01), te) - 0.6 * _at(motion, te)
+    out['temp'] = pd.DataFrame({'timestamp': start_ms + np.round(te * 1000).astype(np.int64),
+                                'temp': np.round(np.clip(temp, 30, 37.5) / 0.02) * 0.02})
+
+    # ACC 32 Hz: gravità con orientamento che deriva + oscillazioni (~2 Hz) in movimento, 1/64 g
+    fs = RATES['acc']
+    ta = np.arange(seconds * fs) / fs
+    m = _at(motion, ta)
+    g = np.array(profile['gravity'])[:, None] + np.vstack(
+        [_at(_ar1(rng, seconds, 0.99, 0.01), ta) for _ in range(3)])
+    g /= np.linalg.norm(g, axis=0)
+    axes = []
+    for k in range(3):
+        osc = np.sin(2 * np.pi * 2.0 * ta + rng.uniform(0, 2 * np.pi)) * rng.uniform(0.5, 1.2)
+        a = g[k] + m * osc + rng.normal(0, 0.01, ta.size) + rng.normal(0, 0.3, ta.size) * m
+        axes.append(np.round(a * 64) / 64)
+    out['acc'] = pd.DataFrame({'timestamp': start_ms + np.round(ta * 1000).astype(np.int64),
+                               'ax': axes[0], 'ay': axes[1], 'az': axes[2]})
+    return out
+
+
+def profile_for(rng):
+    """Caratteristiche personali (baseline) di un utente sintetico."""
+    gravity = np.array([-0.3, 0.15, 0.9]) + rng.normal(0, 0.15, 3)
+    return {
+        'hr': rng.normal(72, 6),
+        'bvp_amp': rng.uniform(30, 80),
+        'eda': float(np.clip(rng.lognormal(0.3, 0.8), 0.1, 12)),
+        'temp': rng.normal(34.5, 0.6),
+        'gravity': (gravity / np.linalg.norm(gravity)).tolist(),
+    }
+
+
+def generate(users, days, minutes=20, hour=9, seed=0, end_day_ms=None):
+    """
+    Sessioni per users × days: {username: [sessione del giorno 0, ...]} con sessione come in session().
+    Le sessioni finiscono il giorno di end_day_ms (default oggi, ora locale) e vanno indietro di `days` giorni.
+    """
+    if end_day_ms is None:
+        lt = time.localtime()
+        end_day_ms = int(time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, 0, 0, 0, 0, 0, -1)) * 1000)
+    rng = np.random.default_rng(seed)
+    out = {}
+    for u in range(users):
+        name = f'synth{u:03d}'
+        prof = profile_for(rng)
+        out[name] = []
+        for d in range(days):
+            day_ms = end_day_ms - (days - 1 - d) * 86400 * 1000
+            out[name].append(session(rng, day_ms + hour * 3600 * 1000, minutes, prof))
+    return out
+
+
+def write_csv(sessions, out_dir):
+    """Scrive <out_dir>/<username>/wrist_*.csv (sessioni dei vari giorni concatenate). Ritorna le righe per sensore."""
+    import pandas as pd
+    rows = {}
+    for name, days in sessions.items():
+        folder = os.path.join(out_dir, name)
+        os.makedirs(folder, exist_ok=True)
+        for sensor, fname in CSV_FILES.items():
+            df = pd.concat([s[sensor] for s in days], ignore_index=True)
+            df.to_csv(os.path.join(folder, fname), index=False)
+            rows[sensor] = rows.get(sensor, 0) + len(df)
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Sessioni E4 sintetiche (formato data_samples/)')
+    ap.add_argument('--users', type=int, default=3)
+    ap.add_argument('--days', type=int, default=2)
+    ap.add_argument('--minutes', type=float, default=20, help='Durata della sessione giornaliera')
+    ap.add_argument('--hour', type=int, default=9, help='Ora di inizio della sessione')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--out', required=True, help='Cartella di destinazione')
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    rows = write_csv(generate(args.users, args.days, args.minutes, args.hour, args.seed), args.out)
+    print(f"[SYNTH] {args.users} utenti × {args.days} giorni in {time.perf_counter() - t0:.1f}s: "
+          + ', '.join(f'{s} {n}' for s, n in rows.items()))
+
+
+if __name__ == '__main__':
+    main()
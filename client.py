@@ -1,4 +1,23 @@
-import os, time, csv, argparse, requests, glob
+"""
+Feeder HTTP standalone (gateway del braccialetto).
+
+Le letture non vengono inviate direttamente: il lettore dei CSV le accoda in uno
+spool SQLite su disco (--spool) insieme alla posizione nel file, nella stessa
+transazione. Un thread sender svuota lo spool a batch su /api/sensor_data con
+{device_id, seq, readings}; seq è l'id dell'ultima lettura del batch e le righe
+vengono cancellate solo dopo una risposta 2xx. Così:
+
+  - se il server è giù le letture restano su disco e il sender ritenta con
+    backoff esponenziale (con jitter, niente raffiche di reinvii al riavvio);
+  - se il client si ferma o crasha riparte dallo stesso punto dei CSV e
+    rimanda solo ciò che non è stato confermato (il server scarta i seq già visti);
+  - lo spool è limitato (--max-spool): quando è pieno il lettore si ferma e
+    aspetta il sender invece di scartare dati;
+  - solo un batch che il server rifiuta per il contenuto (POISON_STATUS) esce
+    dallo spool, nella tabella `rejected`: URL o credenziali sbagliati (404, 401,
+    403) fermano l'invio e si ritenta, senza perdere letture.
+"""
+import os, time, json, uuid, random, sqlite3, argparse, threading, requests
 
 SENSORS = {
     'acc': 'wrist_acc.csv',
@@ -9,40 +28,185 @@ SENSORS = {
     'temp':'wrist_skin_temperature.csv',
 }
 
-def stream_folder(folder, server_url, username, interval=1.0):
+BACKOFF_BASE_SEC = 0.5
+BACKOFF_MAX_SEC = 60.0
+# Risposte che dipendono dal contenuto del batch: reinviarlo darebbe lo stesso errore.
+# Tutto il resto (401/403/404 da config sbagliata, 408, 429, 5xx) si ritenta con backoff.
+POISON_STATUS = (400, 413, 415, 422)
+
+
+# =========================
+# Spool su disco
+# =========================
+
+def open_spool(path):
+    con = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    con.execute('PRAGMA journal_mode=WAL').fetchall()
+    con.execute('PRAGMA synchronous=NORMAL')
+    con.execute('CREATE TABLE IF NOT EXISTS spool(id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT)')
+    con.execute('CREATE TABLE IF NOT EXISTS rejected(id INTEGER PRIMARY KEY, payload TEXT, error TEXT)')
+    con.execute('CREATE TABLE IF NOT EXISTS offsets(path TEXT PRIMARY KEY, offset INTEGER)')
+    con.execute('CREATE TABLE IF NOT EXISTS meta(k TEXT PRIMARY KEY, v TEXT)')
+    con.commit()
+    return con
+
+
+def device_id(con):
+    """Identificativo stabile del gateway, generato alla prima esecuzione e salvato nello spool."""
+    row = con.execute("SELECT v FROM meta WHERE k='device_id'").fetchone()
+    if row:
+        return row[0]
+    did = f'gw-{uuid.uuid4().hex[:12]}'
+    con.execute("INSERT INTO meta(k, v) VALUES('device_id', ?)", (did,))
+    con.commit()
+    return did
+
+
+def spool_size(con):
+    return con.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+
+
+# =========================
+# Lettore CSV -> spool
+# =========================
+
+def parse_payload(sensor, line, username):
+    parts = line.strip().split(',')
+    payload = {"username": username, "sensor": sensor}
+    # acc: timestamp,ax,ay,az -> inviamo i 3 assi, il server calcola la magnitudo
+    if sensor == 'acc' and len(parts) >= 4:
+        try:
+            payload["timestamp"] = float(parts[0])
+            payload["ax"], payload["ay"], payload["az"] = (float(p) for p in parts[1:4])
+        except ValueError:
+            return None
+        return payload
+    # try timestamp,value else value-only
+    try:
+        if len(parts) >= 2:
+            ts = float(parts[0]); val = float(parts[1])
+        else:
+            ts = time.time(); val = float(parts[0])
+    except:
+        ts = time.time()
+        try: val = float(parts[-1])
+        except: return None
+    if sensor == 'ibi':
+        val = val / 1000.0  # durata IBI in ms -> secondi
+    payload["timestamp"] = ts
+    payload["value"] = val
+    return payload
+
+
+def open_sources(con, folder):
+    """Apre i CSV in binario e riprende dall'offset salvato nello spool (header saltato al primo avvio)."""
     fps = {}
-    for k,fname in SENSORS.items():
-        path = os.path.join(folder, fname)
-        if os.path.exists(path):
-            fps[k] = open(path, 'r', newline='')
-            next(fps[k], None)  # skip header
+    for k, fname in SENSORS.items():
+        path = os.path.abspath(os.path.join(folder, fname))
+        if not os.path.exists(path):
+            continue
+        f = open(path, 'rb')
+        row = con.execute('SELECT offset FROM offsets WHERE path=?', (path,)).fetchone()
+        if row and row[0] <= os.fstat(f.fileno()).st_size:
+            f.seek(row[0])
+        else:
+            f.readline()  # skip header
+        fps[k] = (path, f)
+    return fps
+
+
+def spool_lines(con, fps, username, lines_per_sensor=1):
+    """Accoda fino a `lines_per_sensor` righe per sensore; letture e offset nella stessa transazione."""
+    rows, offsets = [], []
+    for sensor, (path, f) in fps.items():
+        for _ in range(lines_per_sensor):
+            line = f.readline()
+            if not line:
+                break
+            payload = parse_payload(sensor, line.decode('utf-8', 'replace'), username)
+            if payload is not None:
+                rows.append((json.dumps(payload),))
+        offsets.append((path, f.tell()))
+    with con:
+        con.executemany('INSERT INTO spool(payload) VALUES(?)', rows)
+        con.executemany('INSERT OR REPLACE INTO offsets(path, offset) VALUES(?,?)', offsets)
+    return len(rows)
+
+
+# =========================
+# Sender spool -> server
+# =========================
+
+def send_batch(session, con, server_url, did, batch_size):
+    """
+    Invia il batch più vecchio dello spool. Ritorna il numero di letture confermate
+    (0 se lo spool è vuoto); solleva un'eccezione se il server non risponde 2xx.
+    """
+    rows = con.execute('SELECT id, payload FROM spool ORDER BY id LIMIT ?', (batch_size,)).fetchall()
+    if not rows:
+        return 0
+    last_id = rows[-1][0]
+    body = {"device_id": did, "seq": last_id, "readings": [json.loads(p) for _, p in rows]}
+    r = session.post(f"{server_url}/api/sensor_data", json=body, timeout=10)
+    if r.status_code in POISON_STATUS:
+        # batch rifiutato (es. dati malformati): messo da parte, altrimenti bloccherebbe lo spool
+        print('[CLIENT][WARN] batch rifiutato', r.status_code, r.text[:200])
+        with con:
+            con.execute('INSERT OR REPLACE INTO rejected(id, payload, error) '
+                        'SELECT id, payload, ? FROM spool WHERE id<=?', (f'HTTP {r.status_code}', last_id))
+            con.execute('DELETE FROM spool WHERE id<=?', (last_id,))
+        return len(rows)
+    r.raise_for_status()
+    # ack: le righe confermate escono dallo spool solo adesso
+    with con:
+        con.execute('DELETE FROM spool WHERE id<=?', (last_id,))
+    return len(rows)
+
+
+def sender_loop(spool_path, server_url, batch_size, stop_event, idle_sec=0.5):
+    con = open_spool(spool_path)
+    did = device_id(con)
+    session = requests.Session()
+    failures = 0
+    while not stop_event.is_set():
+        try:
+            n = send_batch(session, con, server_url, did, batch_size)
+            failures = 0
+            if n == 0:
+                stop_event.wait(idle_sec)
+        except Exception as e:
+            failures += 1
+            delay = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** (failures - 1))
+            delay *= random.uniform(0.5, 1.0)  # jitter: più gateway non ritentano all'unisono
+            print(f'[CLIENT][WARN] invio fallito ({e}), nuovo tentativo tra {delay:.1f}s '
+                  f'(in coda: {spool_size(con)})')
+            stop_event.wait(delay)
+    con.close()
+
+
+def stream_folder(folder, server_url, username, interval=1.0, spool_path='client_spool.db',
+                  batch_size=200, max_spool=500000):
+    con = open_spool(spool_path)
+    stop = threading.Event()
+    sender = threading.Thread(target=sender_loop, args=(spool_path, server_url, batch_size, stop),
+                              daemon=True, name='client-sender')
+    sender.start()
+    fps = open_sources(con, folder)
     try:
         while True:
-            sent_any = False
-            for sensor, f in list(fps.items()):
-                line = f.readline()
-                if not line:
-                    continue
-                parts = line.strip().split(',')
-                # try timestamp,value else value-only
-                try:
-                    if len(parts) >= 2:
-                        ts = float(parts[0]); val = float(parts[1])
-                    else:
-                        ts = time.time(); val = float(parts[0])
-                except:
-                    ts = time.time()
-                    try: val = float(parts[-1])
-                    except: continue
-                payload = {"username": username, "sensor": sensor, "timestamp": ts, "value": val}
-                r = requests.post(f"{server_url}/api/sensor_data", json=payload, timeout=5)
-                r.raise_for_status()
-                sent_any = True
-            time.sleep(interval if sent_any else interval)
+            # spool pieno: il lettore aspetta il sender (i CSV restano la fonte, nessuna perdita)
+            if spool_size(con) >= max_spool:
+                time.sleep(interval)
+                continue
+            spool_lines(con, fps, username)
+            time.sleep(interval)
     finally:
-        for f in fps.values():
+        stop.set()
+        sender.join(timeout=15)
+        for _, f in fps.values():
             try: f.close()
             except: pass
+        con.close()
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
@@ -50,5 +214,9 @@ if __name__ == "__main__":
     ap.add_argument("--server", default="http://127.0.0.1:5000", help="URL del server Flask")
     ap.add_argument("--username", required=True, help="Nome utente per associare i dati")
     ap.add_argument("--interval", type=float, default=1.0, help="Intervallo secondi tra invii")
+    ap.add_argument("--spool", default="client_spool.db", help="File SQLite dello spool su disco")
+    ap.add_argument("--batch", type=int, default=200, help="Letture per richiesta")
+    ap.add_argument("--max-spool", type=int, default=500000, help="Letture massime in coda su disco")
     args = ap.parse_args()
-    stream_folder(args.folder, args.server, args.username, args.interval)
+    stream_folder(args.folder, args.server, args.username, args.interval,
+                  spool_path=args.spool, batch_size=args.batch, max_spool=args.max_spool)
@@ -0,0 +1,15 @@
+# Configurazione gunicorn: `gunicorn -c gunicorn.conf.py`
+# Ogni worker è un processo separato che chiama create_app(); lo stato condiviso
+# (feeder leader, cooldown alert, stato email) è coordinato via SQLite (app/coord.py).
+import os
+import multiprocessing
+
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app')
+wsgi_app = 'wsgi:app'
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+# Niente preload: i thread (supervisore feeder) non sopravvivono al fork
+preload_app = False
+accesslog = '-'